@@ -23,10 +23,31 @@ STOLOS_QB_REDIS_MAX_NETWORK_DELAY=4
 STOLOS_QB_ZOOKEEPER_HOSTS=localhost:2181
 STOLOS_QB_ZOOKEEPER_TIMEOUT=5
 
+# SQLite queue backend
+# STOLOS_QUEUE_BACKEND=sqlite
+STOLOS_QB_SQLITE_PATH=/tmp/stolos-tests.sqlite
+
+# Local directory queue backend
+# STOLOS_QUEUE_BACKEND=file
+STOLOS_QB_FILE_DIR=/tmp/stolos-tests-queue
+
+# In-process queue backend (single process only)
+# STOLOS_QUEUE_BACKEND=memory
+
 
 # You can define your own custom queue backend
 # STOLOS_QUEUE_BACKEND=mymodule.myqueue_backend
 
+# Time queue backend calls.  Serve the metrics over http and/or send them
+# to statsd
+# STOLOS_METRICS=true
+# STOLOS_METRICS_PORT=9102
+# STOLOS_METRICS_STATSD=localhost:8125
+
+# Profile 1 in N jobs with cProfile and write the stats to a directory
+# STOLOS_PROFILE=/tmp/stolos-profiles
+# STOLOS_PROFILE_SAMPLE=100
+
 
 #
 # Configuration backend.  the default is json
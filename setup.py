@@ -23,7 +23,9 @@ setup(
     url='https://github.com/sailthru/stolos',
 
     packages=find_packages(),
-    scripts=['./bin/stolos-submit'],
+    scripts=[
+        './bin/stolos-submit', './bin/stolos-export',
+        './bin/stolos-compile-config', './bin/stolos-status'],
     data_files=[
         ('conf', findall('conf')),
         ('stolos/examples', findall('stolos/examples'))
@@ -1,10 +1,32 @@
 import logging as _logging
 log = _logging.getLogger('stolos')
 
-import os.path as _p
-import pkg_resources as _pkg_resources
-__version__ = _pkg_resources.get_distribution(
-    _p.basename(_p.dirname(_p.abspath(__file__)))).version
+import sys as _sys
+
+
+def _get_version():
+    """Look up the installed version.  This imports pkg_resources, which is
+    slow, so it only happens when stolos.__version__ is accessed"""
+    global _version
+    try:
+        return _version
+    except NameError:
+        import os.path as _p
+        import pkg_resources as _pkg_resources
+        _version = _pkg_resources.get_distribution(
+            _p.basename(_p.dirname(_p.abspath(__file__)))).version
+        return _version
+
+
+def __getattr__(name):  # python3.7+ (PEP 562)
+    if name == '__version__':
+        return _get_version()
+    raise AttributeError(
+        "module %r has no attribute %r" % (__name__, name))
+
+
+if _sys.version_info < (3, 7):
+    __version__ = _get_version()
 
 
 class Uninitialized(Exception):
@@ -2,6 +2,10 @@ from stolos.initializer import initialize as _initialize
 from stolos import dag_tools as _dt
 from stolos import configuration_backend as _cb
 from stolos import queue_backend as _qb
+from stolos import metrics as _metrics
+from stolos import profiling as _profiling
+from stolos.queue_backend import status as _status
+from stolos.queue_backend import critical_path as _critical_path
 
 from stolos.queue_backend import (
     check_state, maybe_add_subtask, readd_subtask, get_qbclient
@@ -38,10 +42,44 @@ def initialize(args=None):
         To guarantee NO arguments are read from sys.argv, set args=[]
         Example:  args=['--option1', 'val', ...]
     """
-    _initialize([_dt, _cb, _qb], args=args)
+    _initialize([_dt, _cb, _qb, _metrics, _profiling], args=args)
 
 
 def get_qsize(app_name, queued=True, taken=True):
     """Get the number of objects in the queue"""
     return get_qbclient().LockingQueue(app_name).size(
         queued=queued, taken=taken)
+
+
+def get_status(app_names=None):
+    """Return {app_name: counts} for the given apps (by default, all apps).
+    `counts` is a dict of the num jobs that are pending, completed, failed,
+    skipped and blocked (waiting on parents, outside of the queue), and the
+    queue_size, which includes jobs currently being processed.
+
+    Counts come from counters that Stolos updates as jobs change state, so
+    this is cheap and never scans queues.  It may drift from the true
+    counts.  See stolos.queue_backend.status.recount
+    """
+    if app_names is None:
+        app_names = sorted(_dt.get_task_names())
+    return _status.get_status(app_names)
+
+
+def get_eta(app_name, job_id, default_duration=0):
+    """Estimate when a job, like a daily report, will complete, given how
+    long its incomplete ancestors took to run in the past.  Return a dict:
+        `seconds` - num seconds from now until it completes (0 if it has)
+        `eta` - unix timestamp of when it completes
+        `critical_path` - list of (app_name, job_id, expected seconds) of
+            the jobs that must run one after the other, first job first.
+            These are the stragglers to prioritize
+        `num_jobs` - num incomplete jobs the job depends on, including itself
+
+    `default_duration` - num seconds that jobs of apps that never completed
+        a job are expected to take
+
+    To analyze many jobs at once, see stolos.queue_backend.critical_path
+    """
+    return _critical_path.get_eta(
+        app_name, job_id, default_duration=default_duration)
@@ -0,0 +1,7 @@
+"""
+Benchmarks that measure how fast Stolos and its backends do their work.
+Each module is a script:  python -m stolos.benchmarks.<module> -h
+
+Options not recognized by a benchmark are passed to Stolos's initializer,
+so choose backends as usual, ie:  --queue_backend file --qb_file_dir DIR
+"""
@@ -0,0 +1,193 @@
+"""
+Time how long Stolos takes to traverse a large synthetic tasks graph, and
+keep a history of the results to catch slowdowns.
+
+Workloads, each run on the same random sample of (app_name, job_id) pairs:
+    parse_job_id, passes_filter - per job_id
+    get_parents, get_children - generate all parents or children of a job_id
+    topological_sort - sort the whole sample
+
+The config comes from stolos.benchmarks.synthetic_dag.  With --history, the
+results are appended to a json-lines file, and compared to the last run that
+used the same parameters.  The script exits with an error if a workload got
+more than --max_slowdown times slower.  ie:
+    python -m stolos.benchmarks.dag_traversal --history dag_traversal.jsonl
+"""
+import os
+import simplejson
+import subprocess
+import sys
+import tempfile
+import time
+
+from stolos import argparse_shared as at
+from stolos import api
+from stolos import dag_tools as dt
+from stolos import log
+from . import harness
+from . import synthetic_dag
+
+
+WORKLOADS = (
+    'parse_job_id', 'passes_filter', 'get_parents', 'get_children',
+    'topological_sort')
+# results are only compared to earlier runs with the same parameters
+PARAMS = ('num_apps', 'max_parents', 'num_client_ids', 'num_job_ids', 'seed',
+          'compiled')
+
+
+def _time_each(workload, func, job_ids):
+    """Call func(app_name, job_id) for each job_id.  Also report how many
+    items it returned on average"""
+    latencies = []
+    num_items = 0
+    for app_name, job_id in job_ids:
+        secs, rv = harness.timed(func, app_name, job_id)
+        latencies.append(secs)
+        num_items += len(rv) if isinstance(rv, list) else 1
+    return harness.summarize(
+        workload, latencies,
+        mean_items=round(float(num_items) / max(len(job_ids), 1), 2))
+
+
+def run(workloads, job_ids):
+    """Time the given workloads.  Return a list of result summaries"""
+    funcs = dict(
+        parse_job_id=dt.parse_job_id,
+        passes_filter=dt.passes_filter,
+        get_parents=lambda a, j: list(dt.get_parents(a, j)),
+        get_children=lambda a, j: list(dt.get_children(a, j)),
+    )
+    results = []
+    for workload in workloads:
+        log.info("Running benchmark", extra=dict(workload=workload))
+        if workload == 'topological_sort':
+            secs, rv = harness.timed(
+                lambda: list(dt.topological_sort(job_ids)))
+            results.append(harness.summarize(
+                workload, [secs], num_sorted=len(rv)))
+        else:
+            results.append(_time_each(workload, funcs[workload], job_ids))
+    return results
+
+
+def compare(previous, current, max_slowdown):
+    """Return the workloads whose median latency in `current` is more than
+    `max_slowdown` times what it was in `previous`, as a list of
+    (workload, previous p50_ms, current p50_ms)"""
+    before = dict((x['workload'], x['p50_ms']) for x in previous['results'])
+    rv = []
+    for x in current['results']:
+        p50 = before.get(x['workload'])
+        if p50 and x['p50_ms'] > p50 * max_slowdown:
+            rv.append((x['workload'], p50, x['p50_ms']))
+    return rv
+
+
+def read_history(fp, params):
+    """Return the results in the given json-lines history file that were
+    created with the given parameters, oldest first"""
+    if not os.path.exists(fp):
+        return []
+    with open(fp) as fin:
+        runs = [simplejson.loads(line) for line in fin if line.strip()]
+    return [x for x in runs if x['params'] == params]
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')).decode().strip()
+    except Exception:
+        return None
+
+
+def main(ns, args):
+    """Run the benchmark.  Return (its results, the workloads that slowed
+    down since the last comparable run in --history)"""
+    params = dict((k, getattr(ns, k)) for k in PARAMS)
+    params['compiled'] = bool(ns.compiled)
+    tasks = synthetic_dag.generate(
+        num_apps=ns.num_apps, max_parents=ns.max_parents,
+        num_client_ids=ns.num_client_ids, seed=ns.seed)
+    job_ids = synthetic_dag.sample_job_ids(
+        tasks, ns.num_job_ids, num_client_ids=ns.num_client_ids,
+        seed=ns.seed)
+    fd, tasks_json = tempfile.mkstemp(
+        prefix='stolos_benchmark', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            simplejson.dump(tasks, fout)
+        # traversal doesn't use the queue backend
+        api.initialize([
+            '--queue_backend', 'memory',
+            '--job_id_default_template', synthetic_dag.JOB_ID_TEMPLATE,
+            '--job_id_validations', synthetic_dag.JOB_ID_VALIDATIONS,
+            '--configuration_backend', 'json', '--tasks_json', tasks_json,
+            '--tasks_json_compiled', tasks_json + '.compiled',
+        ] + list(args))
+        if ns.compiled:
+            from stolos.configuration_backend import json_config
+            json_config.write_compiled(dt.compile_dag(), tasks_json)
+        rv = dict(
+            params=params, python=sys.version.split()[0],
+            revision=_git_revision(), started_at=time.time(),
+            results=run(ns.workload, job_ids))
+    finally:
+        for fp in [tasks_json, tasks_json + '.compiled']:
+            if os.path.exists(fp):
+                os.remove(fp)
+
+    slowdowns = []
+    if ns.history:
+        history = read_history(ns.history, params)
+        if history:
+            slowdowns = compare(history[-1], rv, ns.max_slowdown)
+        with open(ns.history, 'a') as fout:
+            fout.write(simplejson.dumps(rv, sort_keys=True) + '\n')
+    for workload, before, after in slowdowns:
+        log.warn("Traversal got slower", extra=dict(
+            workload=workload, previous_p50_ms=before, p50_ms=after))
+    print(simplejson.dumps(rv, sort_keys=True, indent=2))
+    return rv, slowdowns
+
+
+build_arg_parser = at.build_arg_parser([
+    at.add_argument(
+        '--workload', nargs='*', choices=WORKLOADS, default=list(WORKLOADS),
+        help="Workloads to run.  By default, run all of them"),
+    at.add_argument(
+        '--num_apps', type=int, default=300,
+        help="Num apps in the synthetic tasks config"),
+    at.add_argument(
+        '--max_parents', type=int, default=4,
+        help="Max num apps that an app depends on"),
+    at.add_argument(
+        '--num_client_ids', type=int, default=1000,
+        help="Width of the client_id range that apps autofill"),
+    at.add_argument(
+        '--num_job_ids', type=int, default=200,
+        help="Num (app_name, job_id) pairs to run each workload on"),
+    at.add_argument(
+        '--seed', type=int, default=0,
+        help="Seed used to generate the config and job_ids"),
+    at.add_argument(
+        '--compiled', action='store_true', help=(
+            "Compile the config first, like stolos-compile-config does")),
+    at.add_argument(
+        '--history', help=(
+            "A json-lines file.  Append the results to it and compare them"
+            " to the last run with the same parameters")),
+    at.add_argument(
+        '--max_slowdown', type=float, default=1.5, help=(
+            "Fail if a workload's median latency grew by more than this"
+            " factor since the last comparable run in --history")),
+], description=__doc__.split('\n\n')[0], add_help=True)
+
+
+if __name__ == '__main__':
+    NS, args = build_arg_parser().parse_known_args()
+    if main(NS, args)[1]:
+        sys.exit(1)
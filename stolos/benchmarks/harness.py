@@ -0,0 +1,127 @@
+"""
+Tools shared by the benchmarks: time calls, summarize latencies, run
+worker processes and start a throwaway redis-server.
+"""
+import os
+import simplejson
+import socket
+import subprocess
+import sys
+import time
+
+
+def percentile(sorted_values, q):
+    """Return the q-th percentile (0 <= q <= 100) of a sorted list,
+    using the nearest rank"""
+    if not sorted_values:
+        return None
+    idx = int(round(q / 100. * (len(sorted_values) - 1)))
+    return sorted_values[idx]
+
+
+def summarize(workload, latencies, elapsed=None, **extra):
+    """Return a json-able dict describing a workload's results.
+
+    `latencies` - a list of the num seconds each operation took
+    `elapsed` - total num seconds the workload took.  By default, assume
+        operations ran one after another
+    `extra` - other fields to include, like the queue depth
+    """
+    latencies = sorted(latencies)
+    if elapsed is None:
+        elapsed = sum(latencies)
+    rv = dict(
+        workload=workload, ops=len(latencies),
+        ops_per_sec=len(latencies) / elapsed if elapsed else None,
+        p50_ms=_ms(percentile(latencies, 50)),
+        p99_ms=_ms(percentile(latencies, 99)),
+        max_ms=_ms(latencies[-1] if latencies else None))
+    rv.update(extra)
+    return rv
+
+
+def _ms(secs):
+    return None if secs is None else round(secs * 1000, 4)
+
+
+def timed(func, *args, **kwargs):
+    """Call func.  Return (num seconds it took, its return value)"""
+    start = time.time()
+    rv = func(*args, **kwargs)
+    return time.time() - start, rv
+
+
+def worker_ready():
+    """Called by a worker process.  Tell run_workers we're ready and block
+    until all workers are"""
+    sys.stdout.write('ready\n')
+    sys.stdout.flush()
+    sys.stdin.readline()
+
+
+def worker_done(result):
+    """Called by a worker process to report its json-able result"""
+    sys.stdout.write(simplejson.dumps(result) + '\n')
+    sys.stdout.flush()
+
+
+def run_workers(module_name, args, num_workers):
+    """Run `python -m module_name args` in num_workers processes.  Wait until
+    every worker called worker_ready() and then let them all go at once.
+    Return (their results, num seconds from go until the last finished)
+    """
+    cmd = [sys.executable, '-m', module_name] + list(args)
+    workers = [
+        subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            env=os.environ)
+        for _ in range(num_workers)]
+    try:
+        for p in workers:
+            assert p.stdout.readline().strip() == b'ready', (
+                "Worker failed to start: %s" % ' '.join(cmd))
+        start = time.time()
+        for p in workers:
+            p.stdin.write(b'go\n')
+            p.stdin.flush()
+        results = []
+        for p in workers:
+            out, _ = p.communicate()
+            assert p.returncode == 0, "Worker failed: %s" % ' '.join(cmd)
+            results.append(simplejson.loads(out.decode().splitlines()[-1]))
+        return results, time.time() - start
+    finally:
+        for p in workers:
+            if p.poll() is None:
+                p.kill()
+
+
+def _free_port():
+    s = socket.socket()
+    try:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+def start_redis_server(executable='redis-server'):
+    """Start a redis-server that keeps nothing on disk.
+    Return (the process, Stolos options that connect the redis queue backend
+    to it).  The caller should kill the process"""
+    port = _free_port()
+    p = subprocess.Popen(
+        [executable, '--port', str(port), '--save', '', '--appendonly', 'no'],
+        stdout=open(os.devnull, 'w'))
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(('localhost', port), 1).close()
+            break
+        except socket.error:
+            if p.poll() is not None or time.time() > deadline:
+                p.kill()
+                raise
+            time.sleep(.05)
+    return p, ['--queue_backend', 'redis', '--qb_redis_host', 'localhost',
+               '--qb_redis_port', str(port)]
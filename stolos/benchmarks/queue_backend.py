@@ -0,0 +1,191 @@
+"""
+Drive a queue backend through standard workloads and report throughput and
+latency percentiles as json.
+
+Workloads:
+    bulk_put - put items onto one queue
+    get_consume - processes concurrently get() and consume() from one queue
+    lock_churn - acquire and release locks
+    is_queued, size - query queues of increasing depth
+    fan_out - a completed parent queues its children (_maybe_queue_children)
+
+Compare backends, or catch a regression, by running it against a local
+backend.  ie:
+    python -m stolos.benchmarks.queue_backend --start_redis
+    python -m stolos.benchmarks.queue_backend --queue_backend sqlite \\
+        --qb_sqlite_path /tmp/bench.sqlite
+"""
+import os
+import random
+import simplejson
+import sys
+import tempfile
+import time
+
+from stolos import argparse_shared as at
+from stolos import api
+from stolos import log
+from stolos.queue_backend.modify_job_state import _maybe_queue_children
+from . import harness
+from . import queue_throughput
+
+
+WORKLOADS = (
+    'bulk_put', 'get_consume', 'lock_churn', 'is_queued', 'size', 'fan_out')
+# all paths a benchmark touches are beneath this one
+ROOT = 'stolos_benchmark'
+
+
+def _path(*names):
+    return '/'.join((ROOT, ) + names)
+
+
+def lock_churn(num_ops, num_paths=10):
+    """Acquire and release locks on a few paths"""
+    qbcli = api.get_qbclient()
+    locks = [qbcli.Lock(_path('locks', str(i))) for i in range(num_paths)]
+    latencies = []
+    start = time.time()
+    for i in range(num_ops):
+        lock = locks[i % num_paths]
+        t = time.time()
+        assert lock.acquire(), "Could not acquire an unused lock"
+        lock.release()
+        latencies.append(time.time() - t)
+    return [harness.summarize('lock_churn', latencies, time.time() - start)]
+
+
+def _fill_queue(app_name, depth):
+    q = api.get_qbclient().LockingQueue(app_name)
+    for i in range(depth):
+        q.put('job-%s' % i)
+    return q
+
+
+def query_by_depth(workload, num_ops, depths):
+    """Time is_queued() or size() on queues of each depth"""
+    rv = []
+    for depth in depths:
+        q = _fill_queue(_path(workload, str(depth)), depth)
+        if workload == 'is_queued':
+            # half the lookups miss, which is the slow case for some backends
+            items = ['job-%s' % random.randint(0, 2 * depth)
+                     for _ in range(num_ops)]
+            latencies = [harness.timed(q.is_queued, x)[0] for x in items]
+        else:
+            latencies = [harness.timed(q.size)[0] for _ in range(num_ops)]
+        rv.append(harness.summarize(workload, latencies, queue_depth=depth))
+    return rv
+
+
+def fan_out_config(num_children):
+    """Return a tasks config where a parent app has num_children children"""
+    parent = _path('fan_out', 'parent')
+    tasks = {parent: {}}
+    for i in range(num_children):
+        tasks[_path('fan_out', 'child%s' % i)] = {
+            'depends_on': {'app_name': [parent]}}
+    return tasks
+
+
+def fan_out(num_ops, num_children):
+    """Complete parent jobs whose children are then queued"""
+    parent = _path('fan_out', 'parent')
+    latencies = []
+    for i in range(num_ops):
+        job_id = '20140606_%s_profile' % i
+        latencies.append(harness.timed(
+            _maybe_queue_children, parent, job_id)[0])
+    return [harness.summarize(
+        'fan_out', latencies, num_children=num_children)]
+
+
+def run(ns, backend_args):
+    """Run the chosen workloads.  Return a list of result summaries"""
+    qbcli = api.get_qbclient()
+    results = []
+    for workload in ns.workload:
+        qbcli.delete(ROOT, _recursive=True)
+        log.info("Running benchmark", extra=dict(workload=workload))
+        try:
+            if workload == 'bulk_put':
+                results.append(queue_throughput.bulk_put(
+                    _path('bulk_put'), ns.num_ops))
+            elif workload == 'get_consume':
+                if qbcli.__name__.endswith('qbcli_memory'):
+                    log.warn(
+                        "Skipping a multi-process workload because the"
+                        " memory backend can't share a queue between"
+                        " processes", extra=dict(workload=workload))
+                    continue
+                _fill_queue(_path('get_consume'), ns.num_ops)
+                results.append(queue_throughput.get_consume(
+                    _path('get_consume'), ns.num_workers, backend_args))
+            elif workload == 'lock_churn':
+                results.extend(lock_churn(ns.num_ops))
+            elif workload in ['is_queued', 'size']:
+                results.extend(query_by_depth(
+                    workload, min(ns.num_ops, 1000), ns.depths))
+            elif workload == 'fan_out':
+                results.extend(fan_out(
+                    max(1, ns.num_ops // ns.fan_out), ns.fan_out))
+        finally:
+            qbcli.delete(ROOT, _recursive=True)
+    return results
+
+
+def main(ns, backend_args):
+    redis_server = None
+    if ns.start_redis:
+        redis_server, redis_args = harness.start_redis_server()
+        backend_args = list(backend_args) + redis_args
+    fd, tasks_json = tempfile.mkstemp(
+        prefix='stolos_benchmark', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            simplejson.dump(fan_out_config(ns.fan_out), fout)
+        api.initialize(list(backend_args) + [
+            '--configuration_backend', 'json', '--tasks_json', tasks_json])
+        rv = dict(
+            queue_backend=api.get_qbclient().__name__,
+            python=sys.version.split()[0], started_at=time.time(),
+            results=run(ns, backend_args))
+    finally:
+        os.remove(tasks_json)
+        if redis_server is not None:
+            redis_server.kill()
+    if ns.output == '-':
+        print(simplejson.dumps(rv, sort_keys=True, indent=2))
+    else:
+        with open(ns.output, 'w') as fout:
+            simplejson.dump(rv, fout, sort_keys=True, indent=2)
+    return rv
+
+
+build_arg_parser = at.build_arg_parser([
+    at.add_argument(
+        '--workload', nargs='*', choices=WORKLOADS, default=list(WORKLOADS),
+        help="Workloads to run.  By default, run all of them"),
+    at.add_argument(
+        '--num_ops', type=int, default=1000,
+        help="Num operations per workload"),
+    at.add_argument(
+        '-n', '--num_workers', type=int, default=8,
+        help="Num processes that concurrently get items from a queue"),
+    at.add_argument(
+        '--depths', nargs='*', type=int, default=[10, 100, 1000],
+        help="Queue depths to run the is_queued and size workloads at"),
+    at.add_argument(
+        '--fan_out', type=int, default=20,
+        help="Num children that a parent queues in the fan_out workload"),
+    at.add_argument(
+        '-o', '--output', default='-',
+        help="File to write the json results to.  By default, stdout"),
+    at.add_argument('--start_redis', action='store_true', help=(
+        "Start a throwaway redis-server and benchmark the redis backend")),
+], description=__doc__.split('\n\n')[0], add_help=True)
+
+
+if __name__ == '__main__':
+    NS, backend_args = build_arg_parser().parse_known_args()
+    main(NS, backend_args)
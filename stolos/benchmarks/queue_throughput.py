@@ -0,0 +1,103 @@
+"""
+Measure how many items per second concurrent processes can put onto and
+get (then consume) from one queue.
+
+One process puts --num_items onto the queue.  Then --num_workers processes
+start, and once they are all ready, they empty the queue like runners do:
+get(), then consume().  The result is a json object on stdout.
+
+    python -m stolos.benchmarks.queue_throughput -n 32 --num_items 10000 \\
+        --queue_backend file --qb_file_dir /tmp/stolos-bench
+"""
+import simplejson
+import time
+
+from stolos import argparse_shared as at
+from stolos import api
+from . import harness
+
+
+def bulk_put(app_name, num_items):
+    """Put num_items onto the queue.  Return a summary of the results"""
+    q = api.get_qbclient().LockingQueue(app_name)
+    latencies = []
+    start = time.time()
+    for i in range(num_items):
+        latencies.append(harness.timed(q.put, 'job-%s' % i)[0])
+    return harness.summarize('bulk_put', latencies, time.time() - start)
+
+
+def dequeue(app_name):
+    """Get and consume items until the queue is empty.
+    Return the num seconds each get() and consume() pair took"""
+    q = api.get_qbclient().LockingQueue(app_name)
+    latencies = []
+    while True:
+        start = time.time()
+        if q.get(timeout=1) is None:
+            return latencies
+        q.consume()
+        latencies.append(time.time() - start)
+
+
+def get_consume(app_name, num_workers, backend_args):
+    """Let num_workers processes empty the queue at the same time.
+    Return a summary of the results"""
+    results, elapsed = harness.run_workers(
+        'stolos.benchmarks.queue_throughput',
+        ['--worker', '--app_name', app_name] + list(backend_args),
+        num_workers)
+    latencies = [x for result in results for x in result]
+    return harness.summarize(
+        'get_consume', latencies, elapsed, num_workers=num_workers)
+
+
+def _worker(ns, backend_args):
+    api.initialize(backend_args)
+    api.get_qbclient().LockingQueue(ns.app_name)
+    harness.worker_ready()
+    harness.worker_done(dequeue(ns.app_name))
+
+
+def main(ns, backend_args):
+    api.initialize(backend_args)
+    qbcli = api.get_qbclient()
+    qbcli.delete(ns.app_name, _recursive=True)
+    try:
+        put = bulk_put(ns.app_name, ns.num_items)
+        got = get_consume(ns.app_name, ns.num_workers, backend_args)
+    finally:
+        qbcli.delete(ns.app_name, _recursive=True)
+    assert got['ops'] == ns.num_items, (
+        "Workers consumed %s of %s items" % (got['ops'], ns.num_items))
+    rv = dict(
+        queue_backend=qbcli.__name__, num_workers=ns.num_workers,
+        num_items=ns.num_items,
+        put_per_sec=put['ops_per_sec'],
+        get_consume_per_sec=got['ops_per_sec'],
+        results=[put, got])
+    print(simplejson.dumps(rv, sort_keys=True))
+    return rv
+
+
+build_arg_parser = at.build_arg_parser([
+    at.add_argument(
+        '-n', '--num_workers', type=int, default=32,
+        help="Num processes that concurrently empty the queue"),
+    at.add_argument(
+        '--num_items', type=int, default=10000,
+        help="Num items to put onto the queue"),
+    at.add_argument(
+        '--app_name', default='stolos_benchmark/queue_throughput',
+        help="Path of the queue to use.  It is deleted before and after"),
+    at.add_argument('--worker', action='store_true', help=(
+        "(internal) run as a worker process")),
+], description=__doc__.split('\n\n')[0], add_help=True)
+
+
+if __name__ == '__main__':
+    NS, backend_args = build_arg_parser().parse_known_args()
+    if NS.worker:
+        _worker(NS, backend_args)
+    else:
+        main(NS, backend_args)
@@ -0,0 +1,325 @@
+"""
+Simulate a pipeline to compare scheduling strategies without a cluster.
+
+Threads run Stolos's runner (stolos.runner.main) over and over against
+one queue backend until every queue is empty.  The jobs do nothing, so the
+results measure only the cost of scheduling:
+    makespan - num seconds until the last job finished
+    jobs_per_sec - completed jobs / makespan
+    wasted_dequeues - jobs that were taken from a queue but didn't run,
+        because their parents hadn't completed or they were locked
+    ops_per_job - num queue backend calls per completed job, not counting
+        calls that found an empty queue
+
+The tasks config comes from stolos.benchmarks.synthetic_dag.  Options not
+recognized here are passed to Stolos, so runner options (ie
+--requeue_delay) and backends can be compared.  ie:
+    python -m stolos.benchmarks.simulator --num_runners 16 --enqueue all
+    python -m stolos.benchmarks.simulator --queue_backend sqlite \\
+        --qb_sqlite_path /tmp/sim.sqlite
+
+The redis and zookeeper backends expect one runner per process.  Give them
+a long lock timeout (ie --qb_redis_lock_timeout 60), or their lock
+extending threads may fall behind the runner threads.
+"""
+import argparse
+import collections
+import itertools
+import logging
+import os
+import random
+import simplejson
+import sys
+import tempfile
+import threading
+import time
+
+from stolos import argparse_shared as at
+from stolos import configuration_backend as cb
+from stolos import dag_tools as dt
+from stolos import queue_backend as qb
+from stolos import log
+from stolos import metrics
+from stolos import runner
+from stolos.initializer import initialize
+from . import synthetic_dag
+
+
+class CountingBackend(object):
+    """Wrap a queue backend and count calls to its api.
+
+    `counts` - num calls to each function or method, ie "Lock.acquire"
+    `calls` - a list of (name, path, return value) per thread.  The caller
+        may clear it to see what a thread does next
+    """
+    def __init__(self, qbcli):
+        self._qbcli = qbcli
+        self.__name__ = qbcli.__name__
+        self.counts = collections.Counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def calls(self):
+        try:
+            return self._local.calls
+        except AttributeError:
+            self._local.calls = []
+            return self._local.calls
+
+    def _call(self, name, path, func, *args, **kwargs):
+        rv = func(*args, **kwargs)
+        with self._lock:
+            self.counts[name] += 1
+        self.calls.append((name, path, rv))
+        return rv
+
+    def __getattr__(self, name):
+        attr = getattr(self._qbcli, name)
+        if name in ('LockingQueue', 'Lock'):
+            return lambda path: _CountingObject(self, name, path, attr(path))
+        if name in metrics.QB_FUNCS:
+            return lambda path, *args, **kwargs: self._call(
+                name, path, attr, path, *args, **kwargs)
+        return attr
+
+
+class _CountingObject(object):
+    """A LockingQueue or Lock whose method calls are counted"""
+    def __init__(self, backend, kls_name, path, obj):
+        self._backend = backend
+        self._kls_name = kls_name
+        self._path = path
+        self._obj = obj
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr):
+            return attr
+        return lambda *args, **kwargs: self._backend._call(
+            '%s.%s' % (self._kls_name, name), self._path, attr,
+            *args, **kwargs)
+
+
+def iter_job_ids(app_name, date):
+    """Yield every job_id that app_name has on a date, given its
+    autofill_values"""
+    template, components = dt.get_job_id_template(app_name)
+    autofill = dt.get_autofill_values(app_name, raise_err=False)
+    values = [[date] if k == 'date' else autofill[k] for k in components]
+    for job_id_data in itertools.product(*values):
+        yield template.format(**dict(zip(components, job_id_data)))
+
+
+def enqueue(app_names, date):
+    """Queue every job the given apps have on a date.  Return num jobs"""
+    num_jobs = 0
+    for app_name in app_names:
+        for job_id in iter_job_ids(app_name, date):
+            num_jobs += qb.maybe_add_subtask(app_name, job_id)
+    return num_jobs
+
+
+class _Stats(object):
+    """What the runners did.  Counters are shared by threads"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.ran = collections.Counter()
+
+    def inc(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+
+def _classify(backend, app_name, job_id):
+    """Given the backend calls a runner made, decide why it didn't run the
+    job it dequeued"""
+    execute_lock = qb.get_lock_path('execute', app_name, job_id)
+    for name, path, rv in backend.calls:
+        if name == 'Lock.acquire' and path == execute_lock and not rv:
+            return 'lock_failures'
+    return 'parents_not_ready'
+
+
+def _run_runner(base_ns, backend, app_names, stats, done):
+    """Loop over the apps in random order, running each app's runner once,
+    until told to stop"""
+    app_names = list(app_names)
+    while not done.is_set():
+        random.shuffle(app_names)
+        for app_name in app_names:
+            if done.is_set():
+                return
+            ran = []
+            ns = argparse.Namespace(**vars(base_ns))
+            ns.app_name = app_name
+            ns.job_id = None
+            ns.job_type_func = lambda ns: ran.append(ns.job_id)
+            del backend.calls[:]
+            try:
+                runner.main(ns)
+            except Exception:
+                stats.inc('errors')
+                log.exception("Runner failed", extra=dict(
+                    app_name=app_name, job_id=ns.job_id))
+                continue
+            if ns.job_id is None:
+                with stats.lock:
+                    stats.counts['empty_polls'] += 1
+                    stats.counts['empty_poll_ops'] += len(backend.calls)
+                continue
+            stats.inc('dequeues')
+            if ran:
+                with stats.lock:
+                    stats.ran[(app_name, ns.job_id)] += 1
+            else:
+                stats.inc(_classify(backend, app_name, ns.job_id))
+
+
+def _num_queued(qbcli, app_names):
+    return sum(qbcli.LockingQueue(app_name).size() for app_name in app_names)
+
+
+def simulate(num_runners, app_names, enqueue_apps, base_ns,
+             max_seconds, date=synthetic_dag.DATES[0]):
+    """Queue jobs for `enqueue_apps`, then run `num_runners` threads until
+    every queue is empty.  Return a summary of what happened"""
+    qbcli = qb.get_qbclient()
+    backend = CountingBackend(qbcli)
+    stats = _Stats()
+    done = threading.Event()
+    base_ns.queue_backend = backend  # get_NS() is base_ns
+    try:
+        num_enqueued = enqueue(enqueue_apps, date)
+        enqueue_counts = backend.counts.copy()
+        backend.counts.clear()
+        threads = [
+            threading.Thread(
+                target=_run_runner,
+                args=(base_ns, backend, app_names, stats, done))
+            for _ in range(num_runners)]
+        start = time.time()
+        for t in threads:
+            t.daemon = True
+            t.start()
+        while _num_queued(qbcli, app_names) and \
+                time.time() - start < max_seconds:
+            time.sleep(.01)
+        makespan = time.time() - start
+        done.set()
+        for t in threads:
+            t.join()
+    finally:
+        base_ns.queue_backend = qbcli
+
+    completed = len(stats.ran)
+    wasted = stats.counts['lock_failures'] + stats.counts['parents_not_ready']
+    # polling empty queues is how the simulator finds work, not a cost of
+    # the scheduling strategy
+    num_ops = sum(backend.counts.values()) - stats.counts['empty_poll_ops']
+    return dict(
+        num_runners=num_runners, num_enqueued=num_enqueued,
+        timed_out=makespan >= max_seconds,
+        makespan=round(makespan, 4),
+        completed=completed,
+        jobs_per_sec=completed / makespan if makespan else None,
+        duplicate_runs=sum(stats.ran.values()) - completed,
+        dequeues=stats.counts['dequeues'],
+        wasted_dequeues=wasted,
+        lock_failures=stats.counts['lock_failures'],
+        parents_not_ready=stats.counts['parents_not_ready'],
+        empty_polls=stats.counts['empty_polls'],
+        errors=stats.counts['errors'],
+        backend_ops=num_ops,
+        ops_per_job=float(num_ops) / completed if completed else None,
+        ops=dict(backend.counts),
+        enqueue_ops=dict(enqueue_counts),
+    )
+
+
+def main(ns, args):
+    tasks = synthetic_dag.generate(
+        num_apps=ns.num_apps, max_parents=ns.max_parents,
+        num_client_ids=ns.num_client_ids, seed=ns.seed)
+    app_names = sorted(tasks)
+    roots = [x for x in app_names if 'depends_on' not in tasks[x]]
+    fd, tasks_json = tempfile.mkstemp(
+        prefix='stolos_simulator', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as fout:
+            simplejson.dump(tasks, fout)
+        _, base_ns = initialize([runner.build_arg_parser, dt, cb, qb], [
+            '--queue_backend', 'memory',
+            '--job_id_default_template', synthetic_dag.JOB_ID_TEMPLATE,
+            '--job_id_validations', synthetic_dag.JOB_ID_VALIDATIONS,
+            '--configuration_backend', 'json', '--tasks_json', tasks_json,
+            '--app_name', app_names[0], '--timeout', '0',
+        ] + list(args))
+        logging.getLogger('stolos').setLevel(ns.log_level)
+        qbcli = qb.get_qbclient()
+        for app_name in app_names:
+            qbcli.delete(app_name, _recursive=True)
+        try:
+            result = simulate(
+                ns.num_runners, app_names,
+                roots if ns.enqueue == 'roots' else app_names,
+                base_ns, ns.max_seconds)
+        finally:
+            for app_name in app_names:
+                qbcli.delete(app_name, _recursive=True)
+    finally:
+        os.remove(tasks_json)
+    rv = dict(
+        queue_backend=qbcli.__name__, python=sys.version.split()[0],
+        started_at=time.time(), num_apps=ns.num_apps,
+        num_client_ids=ns.num_client_ids, seed=ns.seed, enqueue=ns.enqueue,
+        runner_options=dict(
+            (k, getattr(base_ns, k)) for k in [
+                'requeue_delay', 'retry_delay', 'max_delay']),
+        results=[result])
+    if ns.output == '-':
+        print(simplejson.dumps(rv, sort_keys=True, indent=2))
+    else:
+        with open(ns.output, 'w') as fout:
+            simplejson.dump(rv, fout, sort_keys=True, indent=2)
+    return rv
+
+
+build_arg_parser = at.build_arg_parser([
+    at.add_argument(
+        '--num_runners', type=int, default=8,
+        help="Num runners (threads) that run jobs at the same time"),
+    at.add_argument(
+        '--enqueue', choices=['roots', 'all'], default='roots', help=(
+            "Queue the jobs of apps without parents, which queue their"
+            " children as they complete.  Or, queue every app's jobs at"
+            " once, like a backfill")),
+    at.add_argument(
+        '--num_apps', type=int, default=30,
+        help="Num apps in the synthetic tasks config"),
+    at.add_argument(
+        '--max_parents', type=int, default=3,
+        help="Max num apps that an app depends on"),
+    at.add_argument(
+        '--num_client_ids', type=int, default=4, help=(
+            "Num client_ids that apps autofill.  Together with --num_apps,"
+            " this decides the num jobs")),
+    at.add_argument(
+        '--seed', type=int, default=0,
+        help="Seed used to generate the tasks config"),
+    at.add_argument(
+        '--max_seconds', type=float, default=300,
+        help="Give up if the queues aren't empty after this many seconds"),
+    at.add_argument(
+        '--log_level', default='ERROR',
+        help="Stolos's log level while simulating"),
+    at.add_argument(
+        '-o', '--output', default='-',
+        help="File to write the json results to.  By default, stdout"),
+], description=__doc__.split('\n\n')[0], add_help=True)
+
+
+if __name__ == '__main__':
+    NS, args = build_arg_parser().parse_known_args()
+    main(NS, args)
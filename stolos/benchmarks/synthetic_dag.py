@@ -0,0 +1,167 @@
+"""
+Generate large, random but valid tasks configs to benchmark Stolos with.
+
+Apps are created in order and only depend on apps created before them, so
+the graph is acyclic.  Each app uses one of three job_id templates:
+    {date}_{client_id}_{collection_name}  (the default template)
+    {date}_{client_id}
+    {date}
+and defines wide autofill_values for its client_id and collection_name.
+Dependencies mix the forms the json configuration backend supports:
+unnamed groups, named groups (OR), named lists of groups (AND) and
+"all" values.  Job_id components must be parsed by
+stolos.examples.job_id_validations.
+
+    python -m stolos.benchmarks.synthetic_dag --num_apps 500 -o tasks.json
+"""
+import datetime as dt
+import random
+import simplejson
+
+from stolos import argparse_shared as at
+
+
+JOB_ID_TEMPLATE = '{date}_{client_id}_{collection_name}'
+JOB_ID_VALIDATIONS = 'stolos.examples.job_id_validations'
+COLLECTION_NAMES = ['profile', 'purchase', 'content', 'client']
+DATES = [int((dt.date(2015, 1, 1) + dt.timedelta(days=i)).strftime('%Y%m%d'))
+         for i in range(60)]
+
+# job_id template: the job_id components it contains
+TEMPLATES = {
+    None: ('date', 'client_id', 'collection_name'),
+    '{date}_{client_id}': ('date', 'client_id'),
+    '{date}': ('date', ),
+}
+
+
+def _components(app):
+    return TEMPLATES[app.get('job_id')]
+
+
+def _app_name(i):
+    return 'app%04d' % i
+
+
+def _dep_group(rand, child, parents, num_client_ids):
+    """Return a dependency group on the given parents.  It defines values
+    for the job_id components that the parents have and the child doesn't,
+    which is what validation requires"""
+    grp = {'app_name': [name for name, _ in parents]}
+    missing = set(
+        k for _, parent in parents for k in _components(parent)
+    ).difference(_components(child))
+    if 'client_id' in missing:
+        # "all" requires every parent to autofill the client_id
+        if rand.random() < .5 and all(
+                'client_id' in _components(parent) for _, parent in parents):
+            grp['client_id'] = 'all'
+        else:
+            grp['client_id'] = sorted(rand.sample(
+                range(num_client_ids), min(num_client_ids, 5)))
+    if 'collection_name' in missing:
+        grp['collection_name'] = sorted(rand.sample(COLLECTION_NAMES, 2))
+    return grp
+
+
+def _depends_on(rand, child, parents, num_client_ids):
+    """Return the depends_on section for a child given its parents as a list
+    of (app_name, app config) pairs"""
+    kind = rand.choice(
+        ['default'] + (len(parents) > 1) * ['or', 'and'])
+    if kind == 'default':
+        return _dep_group(rand, child, parents, num_client_ids)
+    # split parents into two groups
+    split = rand.randint(1, len(parents) - 1)
+    grps = [_dep_group(rand, child, x, num_client_ids)
+            for x in (parents[:split], parents[split:])]
+    if kind == 'or':
+        return {'depgrp%s' % i: grp for i, grp in enumerate(grps)}
+    # a named list of dependency groups means the child depends on all of
+    # them.  Validation only supports AND-ing two groups.
+    return {'depgrp0': grps}
+
+
+def generate(num_apps=300, max_parents=4, num_client_ids=1000, seed=0):
+    """Return a random tasks config (as a dict) with `num_apps` apps.
+
+    `max_parents` - max num apps that an app depends on
+    `num_client_ids` - apps autofill client_ids from 0 to this number.
+        The larger it is, the more job_ids get_children and get_parents
+        generate for apps that depend on "all" client_ids
+    `seed` - the same arguments and seed always generate the same config
+    """
+    rand = random.Random(seed)
+    tasks = {}
+    for i in range(num_apps):
+        app = {}
+        template = rand.choice(list(TEMPLATES))
+        if template is not None:
+            app['job_id'] = template
+        autofill = {}
+        if 'client_id' in _components(app):
+            autofill['client_id'] = '0:%s' % num_client_ids
+        if 'collection_name' in _components(app):
+            autofill['collection_name'] = list(COLLECTION_NAMES)
+        if autofill:
+            app['autofill_values'] = autofill
+        if 'collection_name' in _components(app) and rand.random() < .3:
+            app['valid_if_or'] = {
+                'collection_name': sorted(rand.sample(COLLECTION_NAMES, 2))}
+        if i and rand.random() < .9:
+            names = rand.sample(
+                range(i), rand.randint(1, min(i, max_parents)))
+            app['depends_on'] = _depends_on(
+                rand, app, [(_app_name(x), tasks[_app_name(x)])
+                            for x in sorted(names)],
+                num_client_ids)
+        tasks[_app_name(i)] = app
+    return tasks
+
+
+def sample_job_ids(tasks, num_job_ids, num_client_ids=1000, seed=0):
+    """Return a list of random (app_name, job_id) pairs from the given
+    config"""
+    rand = random.Random(seed)
+    app_names = sorted(tasks)
+    rv = []
+    for _ in range(num_job_ids):
+        app_name = rand.choice(app_names)
+        values = dict(
+            date=rand.choice(DATES),
+            client_id=rand.randrange(num_client_ids),
+            collection_name=rand.choice(COLLECTION_NAMES))
+        job_id = '_'.join(
+            str(values[k]) for k in _components(tasks[app_name]))
+        rv.append((app_name, job_id))
+    return rv
+
+
+def main(ns):
+    tasks = generate(
+        num_apps=ns.num_apps, max_parents=ns.max_parents,
+        num_client_ids=ns.num_client_ids, seed=ns.seed)
+    with open(ns.output, 'w') as fout:
+        simplejson.dump(tasks, fout, sort_keys=True, indent=1)
+
+
+build_arg_parser = at.build_arg_parser([
+    at.add_argument(
+        '--num_apps', type=int, default=300, help="Num apps to generate"),
+    at.add_argument(
+        '--max_parents', type=int, default=4,
+        help="Max num apps that an app depends on"),
+    at.add_argument(
+        '--num_client_ids', type=int, default=1000,
+        help="Width of the client_id range that apps autofill"),
+    at.add_argument(
+        '--seed', type=int, default=0,
+        help="Seed for the random number generator"),
+    at.add_argument(
+        '-o', '--output', required=True,
+        help="File to write the tasks config to"),
+], description=__doc__.split('\n\n')[0], add_help=True)
+
+
+if __name__ == '__main__':
+    main(build_arg_parser().parse_args())
@@ -51,7 +51,8 @@ build_arg_parser = at.build_arg_parser([at.group(
         default='json',
         known_backends={
             "json": "stolos.configuration_backend.json_config.JSONMapping",
-            "redis": "stolos.configuration_backend.redis_config.RedisMapping"},
+            "redis": "stolos.configuration_backend.redis_config.RedisMapping",
+            "mmap": "stolos.configuration_backend.mmap_config.MmapMapping"},
         help=(
             "Where do you store the application dependency data?"
             ' This option defines which configuration backend Stolos uses'
@@ -1,4 +1,7 @@
+import hashlib
+import os
 import simplejson
+from six.moves import cPickle as pickle
 
 from . import (
     TasksConfigBaseMapping, TasksConfigBaseSequence, log,
@@ -6,6 +9,13 @@ from . import (
 
 from stolos import argparse_shared as at
 from stolos import get_NS
+from stolos.exceptions import _log_raise_if
+
+
+COMPILED_SUFFIX = '.compiled'
+_COMPILED_FORMAT = 1
+# pickle protocol readable by both python2 and python3
+_PICKLE_PROTOCOL = 2
 
 
 build_arg_parser = at.build_arg_parser([at.group(
@@ -13,9 +23,109 @@ build_arg_parser = at.build_arg_parser([at.group(
     at.add_argument(
         '--tasks_json', required=True, help=(
             "Filepath to a json file defining Stolos application config")),
+    at.add_argument(
+        '--tasks_json_compiled', help=(
+            "Filepath to a snapshot of --tasks_json created by"
+            " stolos-compile-config.  If the snapshot was compiled from the"
+            " current --tasks_json, Stolos loads it instead of parsing json"
+            " and building the DAG.  By default, look for"
+            " <tasks_json>%s" % COMPILED_SUFFIX)),
 )])
 
 
+def _get_compiled_fp(fp):
+    return getattr(get_NS(), 'tasks_json_compiled', None) \
+        or fp + COMPILED_SUFFIX
+
+
+def _source_hash(source):
+    return hashlib.sha1(source).hexdigest()
+
+
+def write_compiled(compiled, tasks_json, compiled_fp=None):
+    """
+    Save a snapshot of the given `tasks_json` file, so that Stolos can load
+    it quickly.  The snapshot is only used while `tasks_json` is unchanged.
+
+    `compiled` (dict) - must contain the parsed tasks config under key,
+        "tasks".  See stolos.dag_tools.compile_dag()
+    `compiled_fp` - where to save the snapshot.
+        By default, save to <tasks_json>.compiled
+    """
+    with open(tasks_json, 'rb') as fin:
+        source = fin.read()
+    _log_raise_if(
+        simplejson.loads(source) != compiled['tasks'],
+        "The compiled config doesn't match the tasks_json file."
+        "  Did the file change while compiling?",
+        dict(tasks_json=tasks_json), ValueError)
+    if compiled_fp is None:
+        compiled_fp = tasks_json + COMPILED_SUFFIX
+    tmp_fp = '%s.%s.tmp' % (compiled_fp, os.getpid())
+    with open(tmp_fp, 'wb') as fout:
+        pickle.dump(dict(
+            format=_COMPILED_FORMAT, source_hash=_source_hash(source),
+            compiled=compiled), fout, _PICKLE_PROTOCOL)
+    os.rename(tmp_fp, compiled_fp)  # so readers never see a partial file
+    return compiled_fp
+
+
+def _read_compiled(compiled_fp, source):
+    """Return the compiled config if it was compiled from given json source
+    or None if it doesn't exist or is out of date"""
+    try:
+        with open(compiled_fp, 'rb') as fin:
+            data = pickle.load(fin)
+    except (IOError, OSError):
+        return None
+    except Exception:
+        log.warn("Could not read compiled config.  Ignoring it", extra=dict(
+            tasks_json_compiled=compiled_fp), exc_info=True)
+        return None
+    if data.get('format') != _COMPILED_FORMAT \
+            or data.get('source_hash') != _source_hash(source):
+        log.warn(
+            "Compiled config is out of date.  Ignoring it."
+            "  Run stolos-compile-config again",
+            extra=dict(tasks_json_compiled=compiled_fp))
+        return None
+    return data['compiled']
+
+
+def _stat_key(fp):
+    try:
+        st = os.stat(fp)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime)
+
+
+# tasks_json filepath: (stat keys, parsed tasks config, compiled config)
+_LOADED = {}
+
+
+def _load(fp):
+    """Return the stat keys, parsed tasks config and compiled config (or
+    None) of the given json file.  Files are only read again if they
+    changed"""
+    compiled_fp = _get_compiled_fp(fp)
+    with open(fp, 'rb') as fin:
+        st = os.fstat(fin.fileno())
+        key = ((st.st_ino, st.st_size, st.st_mtime), _stat_key(compiled_fp))
+        if fp in _LOADED and _LOADED[fp][0] == key:
+            return _LOADED[fp]
+        source = fin.read()
+    compiled = None
+    if key[1] is not None:
+        compiled = _read_compiled(compiled_fp, source)
+    if compiled is None:
+        tasks = simplejson.loads(source)
+    else:
+        tasks = compiled['tasks']
+    _LOADED[fp] = (key, tasks, compiled)
+    return _LOADED[fp]
+
+
 class _JSONMappingBase(object):
     def __getitem__(self, key):
         return _ensure_type(
@@ -29,7 +139,13 @@ class JSONMapping(_JSONMappingBase, TasksConfigBaseMapping):
     """
     A read-only dictionary loaded with data from a file identified by
     the --tasks_json option
+
+    If the file was compiled (see stolos-compile-config), `compiled` holds
+    the precomputed DAG.  The file is only parsed again if it changes.
     """
+    compiled = None
+    version = None
+
     def __init__(self, data=None):
         if data is None:
             try:
@@ -40,12 +156,14 @@ class JSONMapping(_JSONMappingBase, TasksConfigBaseMapping):
                     " configuration backend") % self.__class__.__name__)
                 raise
             try:
-                self.cache = simplejson.load(open(fp))
+                key, self.cache, self.compiled = _load(fp)
+                self.version = (fp, key)
             except:
                 log.error("Failed to read json file.", extra={'fp': fp})
                 raise
         elif isinstance(data, self.__class__):
             self.cache = data.cache
+            self.compiled = data.compiled
         else:
             assert isinstance(data, dict), (
                 "Oops! %s did not receive a dict" % self.__class__.__name__)
@@ -0,0 +1,183 @@
+"""
+Read Stolos configuration from a compiled, memory-mapped file.
+
+Many Stolos processes on one host can share a single physical copy of the
+config and the precomputed DAG.  The file is mapped read-only, and each app's
+config is only decoded when it is requested, so a process holds in memory just
+the offset table and the configs it uses.
+
+Create the file with:  stolos-compile-config --mmap -o FILE
+The file may be compiled from any configuration backend.
+
+File layout:
+    header: magic bytes, offset of the index, length of the index
+    blobs: json encoded values
+    index: a json object mapping each key of the compiled config to the
+        [offset, length] of its blob.  Per-app sections, like "tasks",
+        map each app_name to an [offset, length]
+"""
+import collections
+import mmap
+import os
+import simplejson
+import struct
+
+from stolos import argparse_shared as at
+from stolos import get_NS
+from stolos import util
+from stolos.exceptions import _log_raise_if
+from . import TasksConfigBaseMapping, _ensure_type, log
+from .json_config import JSONMapping, JSONSequence
+
+
+build_arg_parser = at.build_arg_parser([at.group(
+    "Configuration Backend Options: Memory-mapped",
+    at.add_argument(
+        '--tasks_mmap', required=True, help=(
+            "Filepath to a file created by stolos-compile-config --mmap")),
+)])
+
+
+_MAGIC = b'STOLOSMMAP1\n'
+_HEADER = struct.Struct('>%dsQQ' % len(_MAGIC))
+# compiled config keys that map app_name to a value
+_SECTIONS = frozenset(['tasks', 'autofill_values', 'job_id_templates'])
+
+
+def _dumps(value):
+    return util.tobytes(simplejson.dumps(value, separators=(',', ':')))
+
+
+def write_mmap(compiled, fp):
+    """
+    Write a compiled config to a memory-mappable file.
+    The file is replaced atomically, so running processes never read a
+    partially written file.
+
+    `compiled` (dict) - see stolos.dag_tools.compile_dag()
+    """
+    blobs = []
+    offset = [_HEADER.size]
+
+    def add(value):
+        blob = _dumps(value)
+        blobs.append(blob)
+        offset[0] += len(blob)
+        return [offset[0] - len(blob), len(blob)]
+
+    index = {}
+    for key, value in compiled.items():
+        if key in _SECTIONS:
+            index[key] = {k: add(v) for k, v in value.items()}
+        else:
+            index[key] = add(value)
+    index_blob = _dumps(index)
+
+    tmp_fp = '%s.%s.tmp' % (fp, os.getpid())
+    with open(tmp_fp, 'wb') as fout:
+        fout.write(_HEADER.pack(_MAGIC, offset[0], len(index_blob)))
+        for blob in blobs:
+            fout.write(blob)
+        fout.write(index_blob)
+    os.rename(tmp_fp, fp)
+    return fp
+
+
+class _MmapSection(collections.Mapping):
+    """A read-only mapping whose values are decoded from the mmap on access.
+    Nested sections are also _MmapSection instances"""
+    def __init__(self, buf, index):
+        self._buf = buf
+        self._index = index
+
+    def __getitem__(self, key):
+        entry = self._index[key]
+        if isinstance(entry, dict):
+            return _MmapSection(self._buf, entry)
+        offset, length = entry
+        return simplejson.loads(self._buf[offset:offset + length])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+
+# filepath: (os.stat key, the root _MmapSection)
+_OPENED = {}
+
+
+def _open(fp):
+    """Map the file into memory, or reuse the mapping if the file is
+    unchanged.  Return (os.stat key, the root _MmapSection)"""
+    with open(fp, 'rb') as fin:
+        st = os.fstat(fin.fileno())
+        key = (st.st_ino, st.st_size, st.st_mtime)
+        if fp in _OPENED and _OPENED[fp][0] == key:
+            return _OPENED[fp]
+        buf = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, index_offset, index_length = _HEADER.unpack(buf[:_HEADER.size])
+    _log_raise_if(
+        magic != _MAGIC,
+        "File is not a memory-mappable Stolos config."
+        "  Create it with stolos-compile-config --mmap",
+        dict(tasks_mmap=fp), ValueError)
+    index = simplejson.loads(buf[index_offset:index_offset + index_length])
+    root = _MmapSection(buf, index)
+    _OPENED[fp] = (key, root)
+    log.debug("Mapped compiled config into memory", extra=dict(
+        tasks_mmap=fp, num_apps=len(index['tasks'])))
+    return _OPENED[fp]
+
+
+class MmapMapping(TasksConfigBaseMapping):
+    """
+    A read-only dictionary of app configs backed by a memory-mapped file
+    identified by the --tasks_mmap option.  Returns application config as a
+    JSONMapping
+
+    `compiled` exposes the precomputed DAG stored in the file
+    """
+    compiled = None
+    version = None
+
+    def __init__(self, data=None):
+        if data is None:
+            fp = get_NS().tasks_mmap
+            try:
+                key, self.compiled = _open(fp)
+            except Exception:
+                log.error(
+                    "Failed to map compiled config file",
+                    extra=dict(tasks_mmap=fp))
+                raise
+            self.tasks = self.compiled['tasks']
+            self.cache = {}
+            self.version = (fp, key)
+        elif isinstance(data, self.__class__):
+            self.compiled = data.compiled
+            self.version = data.version
+            self.tasks = data.tasks
+            self.cache = data.cache
+        else:
+            assert isinstance(data, dict), (
+                "Oops! %s did not receive a dict" % self.__class__.__name__)
+            self.tasks = self.cache = data
+
+    def __getitem__(self, key):
+        if key not in self.cache:
+            self.cache[key] = self.tasks[key]
+        return _ensure_type(self.cache[key], JSONMapping, JSONSequence)
+
+    def __iter__(self):
+        return iter(self.tasks)
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, key):
+        return key in self.tasks
@@ -1,9 +1,33 @@
 """
 Fetch Stolos configuration from redis rather than from a json file.
+
+Each app's config is a redis hash.  The names of all apps are kept in an index
+(a redis set) so that listing apps doesn't scan the whole redis keyspace.
+Use set_config(...) to keep the index up to date, or call
+rebuild_app_index(...) if you write app configs to redis some other way.
+
+Hash fields and values are json encoded, and the hash has a field,
+"__stolos_encoding__", that marks the encoding.  Older configs, without the
+marker, store python reprs of each field and value.  These are still readable,
+and migrate_to_json(...) converts them.
+
+Decoded app configs are cached and shared by every RedisMapping in the process.
+set_config(...) increments a version counter for the app and for the whole
+config, and RedisMapping instances poll the counter (at most once every
+--redis_config_refresh_interval seconds) to learn which cached app configs are
+stale.  If you write app configs to redis some other way, the cache is
+disabled until set_config(...) is called, or call bump_config_version(...)
+after changing an app.
 """
+import ast
+import itertools
+import re
 import redis
+import simplejson
+import time
 
 from stolos import get_NS
+from stolos import util
 from stolos.exceptions import _log_raise_if
 from . import TasksConfigBaseMapping, _ensure_type, log
 from .json_config import JSONMapping, JSONSequence
@@ -26,36 +50,249 @@ build_arg_parser = at.build_arg_parser([at.group(
     at.add_argument(
         '--redis_port', default=6379, type=int,
         help="Port to connect to redis server at"),
+    at.add_argument(
+        '--redis_config_refresh_interval', default=1, type=float, help=(
+            "Max num seconds that app configs cached by this process may be"
+            " out of date.  Set to 0 to check for changes every time the"
+            " config is requested")),
     at.add_argument(
         '--redis_connection_opts', type=lambda x: x.split('='), help=(
             "Additional arguments to pass to redis.StrictRedis")),
 )])
 
 
+# num keys to ask for per SCAN call or to fetch per pipeline
+_BATCH_SIZE = 1000
+
+
+def _app_index_key(redis_key_prefix):
+    return "%s__app_names__" % redis_key_prefix
+
+
+def _version_key(redis_key_prefix):
+    """A counter incremented whenever any app config changes"""
+    return "%s__config_version__" % redis_key_prefix
+
+
+def _app_versions_key(redis_key_prefix):
+    """A hash of app_name: num times that app's config changed"""
+    return "%s__app_versions__" % redis_key_prefix
+
+
+def _reserved_keys(redis_key_prefix):
+    return frozenset([
+        _app_index_key(redis_key_prefix),
+        _version_key(redis_key_prefix),
+        _app_versions_key(redis_key_prefix)])
+
+
+# hash field that identifies how an app config is encoded
+_ENCODING_FIELD = '__stolos_encoding__'
+JSON = 'json1'
+REPR = 'repr'  # the original encoding.  Hashes don't have an _ENCODING_FIELD
+
+
+def _decode_repr(value):
+    if not isinstance(value, str):
+        value = value.decode('utf8')  # python3 only
+    return ast.literal_eval(value)
+
+
+_DECODERS = {JSON: simplejson.loads, REPR: _decode_repr}
+
+
+def _encode_fields(app_conf, encoding):
+    if encoding == JSON:
+        fields = {
+            simplejson.dumps(k): simplejson.dumps(v)
+            for k, v in app_conf.items()}
+        _log_raise_if(
+            {simplejson.loads(k): simplejson.loads(v)
+             for k, v in fields.items()} != app_conf,
+            "App config doesn't survive json encoding.  Nested dicts may"
+            " only have string keys.  Use encoding=REPR instead",
+            dict(app_config=app_conf), TypeError)
+        fields[_ENCODING_FIELD] = JSON
+        return fields
+    elif encoding == REPR:
+        return {repr(k): repr(v) for k, v in app_conf.items()}
+    raise ValueError("Unrecognized app config encoding: %s" % encoding)
+
+
+def _decode_fields(val):
+    """Convert a redis hash into a dict"""
+    encoding = util.frombytes(val.pop(util.tobytes(_ENCODING_FIELD), None))
+    if encoding is None:
+        encoding = REPR
+    _log_raise_if(
+        encoding not in _DECODERS,
+        "Unrecognized app config encoding.  Is Stolos out of date?",
+        dict(encoding=encoding), ValueError)
+    loads = _DECODERS[encoding]
+    return {loads(k): loads(v) for k, v in val.items()}
+
+
+def _decode_app_config(val):
+    return _ensure_type(_decode_fields(val), JSONMapping, JSONSequence)
+
+
+def _scan_app_names(cli, redis_key_prefix):
+    """Yield the name of each key with the given prefix, without the prefix.
+    This may visit the whole redis keyspace and yield non-hash keys."""
+    match = re.sub(r'([\\*?\[\]])', r'\\\1', redis_key_prefix) + '*'
+    reserved = _reserved_keys(redis_key_prefix)
+    for key in cli.scan_iter(match=match, count=_BATCH_SIZE):
+        key = util.frombytes(key)
+        if key not in reserved:
+            yield key[len(redis_key_prefix):]
+
+
+def _list_app_names(cli, redis_key_prefix):
+    """Get app names from the index, or scan for them if there is none"""
+    app_names = cli.smembers(_app_index_key(redis_key_prefix))
+    if app_names:
+        return (util.frombytes(x) for x in app_names)
+    return _scan_app_names(cli, redis_key_prefix)
+
+
+class _SharedCache(object):
+    """Decoded app configs shared by all RedisMapping instances in a process
+    that read from the same redis db and key prefix.
+
+    Changes are detected by polling the config version counter.  When it
+    changes, only the apps whose own version changed are evicted, and they
+    are refetched the next time they are requested.
+    """
+    def __init__(self, cli, redis_key_prefix):
+        self.cli = cli
+        self.redis_key_prefix = redis_key_prefix
+        self.configs = {}
+        self.app_versions = {}
+        self.version = None
+        self.last_refresh = None
+
+    @property
+    def enabled(self):
+        """Cached configs can't be trusted unless changes are versioned"""
+        return self.version is not None
+
+    def refresh(self, interval):
+        now = time.time()
+        if self.last_refresh is not None \
+                and now - self.last_refresh < interval:
+            return
+        self.last_refresh = now
+        version = self.cli.get(_version_key(self.redis_key_prefix))
+        if version is None:
+            self.invalidate()
+            return
+        if version == self.version:
+            return
+        app_versions = self.cli.hgetall(
+            _app_versions_key(self.redis_key_prefix))
+        app_versions = {
+            util.frombytes(k): int(v) for k, v in app_versions.items()}
+        stale = [
+            app_name for app_name in self.configs
+            if app_versions.get(app_name) !=
+            self.app_versions.get(app_name)]
+        for app_name in stale:
+            del self.configs[app_name]
+        log.debug("Refreshed cached app configs", extra=dict(
+            config_version=util.frombytes(version), num_stale=len(stale)))
+        self.app_versions = app_versions
+        self.version = version
+
+    def invalidate(self, app_name=None):
+        """Forget the given app's config, or all configs, and check for
+        changes on the next refresh"""
+        if app_name is None:
+            self.configs.clear()
+        else:
+            self.configs.pop(app_name, None)
+        self.version = None
+        self.last_refresh = None
+
+    def add(self, app_name, app_conf):
+        if self.enabled:
+            self.configs[app_name] = app_conf
+
+
+# (redis_host, redis_port, redis_db, redis_key_prefix): _SharedCache
+_SHARED_CACHES = {}
+
+
+def _get_shared_cache(host, port, db, redis_key_prefix):
+    key = (host, port, db, redis_key_prefix)
+    if key not in _SHARED_CACHES:
+        cli = redis.StrictRedis(db=db, port=port, host=host)
+        _SHARED_CACHES[key] = _SharedCache(cli, redis_key_prefix)
+    return _SHARED_CACHES[key]
+
+
+def _invalidate_shared_caches(redis_key_prefix, app_name=None):
+    """Make this process's changes to app configs visible immediately"""
+    for shared in _SHARED_CACHES.values():
+        if shared.redis_key_prefix == redis_key_prefix:
+            shared.invalidate(app_name)
+
+
 class _RedisConfig(object):
+    @property
+    def shared(self):
+        return _get_shared_cache(
+            self.host, self.port, self.db, self.redis_key_prefix)
+
     def __getitem__(self, key):
+        if key not in self.cache and key in self.shared.configs:
+            self.cache[key] = self.shared.configs[key]
         if key not in self.cache:
-            key = "%s%s" % (self.redis_key_prefix, key)
+            rkey = "%s%s" % (self.redis_key_prefix, key)
             try:
-                val = self.cli.hgetall(key)
+                val = self.cli.hgetall(rkey)
             except:
                 log.error((
                     "Redis failed to fetch app config data."
                     "Is the redis key you used an incorrect type?"
-                    "  It should be a hash."), extra=dict(key=key))
+                    "  It should be a hash."), extra=dict(key=rkey))
                 raise
             _log_raise_if(
                 not val,
                 "Given app_name does not exist in redis",
-                dict(app_name=key), KeyError)
-
-            # Convert redis values to python objects.  Potentially dangerous.
-            val = {eval(k, {}, {}): eval(v, {}, {}) for k, v in val.items()}
-            self.cache[key] = _ensure_type(val, JSONMapping, JSONSequence)
+                dict(app_name=rkey), KeyError)
+            self.cache[key] = _decode_app_config(val)
+            self.shared.add(key, self.cache[key])
         return self.cache[key]
 
     def __len__(self):
-        return self.cli.dbsize()
+        n = self.cli.scard(_app_index_key(self.redis_key_prefix))
+        if n:
+            return n
+        return sum(1 for _ in self)
+
+    def _iter_app_names(self):
+        return _list_app_names(self.cli, self.redis_key_prefix)
+
+    def _prefetch(self, app_names):
+        """Fetch the config of the given apps in one round trip and yield
+        the names of apps that exist"""
+        for app_name in app_names:
+            if app_name not in self.cache and app_name in self.shared.configs:
+                self.cache[app_name] = self.shared.configs[app_name]
+        missing = [x for x in app_names if x not in self.cache]
+        if missing:
+            with self.cli.pipeline(transaction=False) as pipe:
+                for app_name in missing:
+                    pipe.hgetall("%s%s" % (self.redis_key_prefix, app_name))
+                vals = pipe.execute(raise_on_error=False)
+            for app_name, val in zip(missing, vals):
+                # skip deleted apps and keys that aren't hashes
+                if val and isinstance(val, dict):
+                    self.cache[app_name] = _decode_app_config(val)
+                    self.shared.add(app_name, self.cache[app_name])
+        for app_name in app_names:
+            if app_name in self.cache:
+                yield app_name
 
 
 class RedisMapping(_RedisConfig, TasksConfigBaseMapping):
@@ -66,39 +303,61 @@ class RedisMapping(_RedisConfig, TasksConfigBaseMapping):
     Each key: value in redis is of form:
         app_name: {python dict of app config stored as a k:v hashmap in redis)
 
+    App configs are cached for the lifetime of the instance, and a newly
+    created instance sees configs at most --redis_config_refresh_interval
+    seconds out of date.
     """
     def __init__(self, data=None):
         NS = get_NS()
+        self.host = NS.redis_host
+        self.port = NS.redis_port
         self.db = NS.redis_db
         self.redis_key_prefix = NS.redis_key_prefix
-        self.cli = redis.StrictRedis(
-            db=NS.redis_db, port=NS.redis_port, host=NS.redis_host)
+        self.cli = self.shared.cli
         if data is None:
+            self.shared.refresh(NS.redis_config_refresh_interval)
             self.cache = {}
         elif isinstance(data, self.__class__):
             self.cli = data.cli
+            self.redis_key_prefix = data.redis_key_prefix
             self.cache = data.cache
         else:
             assert isinstance(data, dict), (
                 "Oops! %s did not receive a dict" % self.__class__.__name__)
             self.cache = data
 
+    @property
+    def version(self):
+        """Unknown unless changes to the config are versioned"""
+        if not self.shared.enabled:
+            return None
+        return (self.host, self.port, self.db, self.redis_key_prefix,
+                self.shared.version)
+
     def __iter__(self):
-        return iter(
-            app_name for app_name in self.cli.keys(
-                '%s*' % self.redis_key_prefix))
+        batch = []
+        for app_name in self._iter_app_names():
+            batch.append(app_name)
+            if len(batch) >= _BATCH_SIZE:
+                for app_name in self._prefetch(batch):
+                    yield app_name
+                batch = []
+        for app_name in self._prefetch(batch):
+            yield app_name
 
 
 def set_config(app_name, app_conf, cli,
-               delete_first=False, redis_key_prefix=""):
+               delete_first=False, redis_key_prefix="", encoding=None):
     """
     A simple function to help you create redis config from a python dict.
     It intelligently stores string keys as strings and int keys as ints so
-    that they can be eval'd on read.
+    that they can be decoded on read.
     This mostly just serves as an example.
 
     `delete_first` (bool) if True, remove the app config first
     `redis_key_prefix` if redis keys used by Stolos have a prefix, specify it
+    `encoding` either JSON or REPR.  By default, use the encoding of the
+        existing app config, or JSON if there isn't one.
 
         >> app_name = 'myapp1'
         >> app_conf = {"bash_cmd": "echo 123"}
@@ -106,17 +365,105 @@ def set_config(app_name, app_conf, cli,
         >> set_config(app_name, app_conf, cli, delete_first=True)
         [True]
         >> cli.hgetall("%s%s" % ('', app_name))
-        {"'bash_cmd'": "'echo 123'"}
+        {'"bash_cmd"': '"echo 123"', '__stolos_encoding__': 'json1'}
 
     """
     key = '%s%s' % (redis_key_prefix, app_name)
+    if encoding is None:
+        if delete_first or cli.hexists(key, _ENCODING_FIELD) \
+                or not cli.exists(key):
+            encoding = JSON
+        else:
+            encoding = REPR
+    fields = _encode_fields(app_conf, encoding)
     with cli.pipeline(transaction=True) as pipe:
         if delete_first:
             pipe.delete(key)
-        pipe.hmset(key, {repr(k): repr(v) for k, v in app_conf.items()})
-        rv = pipe.execute()
+        pipe.hmset(key, fields)
+        pipe.sadd(_app_index_key(redis_key_prefix), app_name)
+        _bump_config_version(pipe, app_name, redis_key_prefix)
+        # only return what the delete and hmset commands returned
+        rv = pipe.execute()[:-3]
+    _invalidate_shared_caches(redis_key_prefix, app_name)
     if not rv[-1]:
         raise Exception(
             "Failed to set app config data",
             extra=dict(app_name=app_name, app_config=app_conf))
     return rv
+
+
+def _bump_config_version(cli, app_name, redis_key_prefix):
+    cli.hincrby(_app_versions_key(redis_key_prefix), app_name, 1)
+    cli.incr(_version_key(redis_key_prefix))
+
+
+def bump_config_version(cli, app_name, redis_key_prefix=""):
+    """
+    Notify Stolos processes that an app config changed, so they don't use
+    a cached copy of it.
+
+    You only need this if you change app configs without set_config(...)
+    """
+    with cli.pipeline(transaction=True) as pipe:
+        _bump_config_version(pipe, app_name, redis_key_prefix)
+        pipe.execute()
+    _invalidate_shared_caches(redis_key_prefix, app_name)
+
+
+def migrate_to_json(cli, redis_key_prefix=""):
+    """
+    Convert all app configs that use the old python repr encoding to json.
+    Return the names of the converted apps.
+
+    Apps whose config can't be stored as json are logged and left as they are
+    """
+    migrated = []
+    for app_name in list(_list_app_names(cli, redis_key_prefix)):
+        key = "%s%s" % (redis_key_prefix, app_name)
+        if cli.type(key) != b'hash' or cli.hexists(key, _ENCODING_FIELD):
+            continue
+        app_conf = _decode_fields(cli.hgetall(key))
+        try:
+            set_config(
+                app_name, app_conf, cli, delete_first=True,
+                redis_key_prefix=redis_key_prefix, encoding=JSON)
+        except TypeError:
+            log.warn(
+                "Could not migrate app config to json", extra=dict(
+                    app_name=app_name))
+            continue
+        migrated.append(app_name)
+    log.info("Migrated app configs to json", extra=dict(
+        num_apps=len(migrated), redis_key_prefix=redis_key_prefix))
+    return migrated
+
+
+def rebuild_app_index(cli, redis_key_prefix=""):
+    """
+    Scan redis for app configs (hashes with the given key prefix) and replace
+    the index of app names with the apps found.  Return the number of apps.
+
+    You only need this if you store app configs without set_config(...)
+    """
+    app_names = []
+    scan = _scan_app_names(cli, redis_key_prefix)
+    while True:
+        batch = list(itertools.islice(scan, _BATCH_SIZE))
+        if not batch:
+            break
+        with cli.pipeline(transaction=False) as pipe:
+            for app_name in batch:
+                pipe.type("%s%s" % (redis_key_prefix, app_name))
+            types = pipe.execute()
+        app_names.extend(
+            x for x, typ in zip(batch, types)
+            if util.frombytes(typ) == 'hash')
+    index_key = _app_index_key(redis_key_prefix)
+    with cli.pipeline(transaction=True) as pipe:
+        pipe.delete(index_key)
+        if app_names:
+            pipe.sadd(index_key, *app_names)
+        pipe.execute()
+    log.info("Rebuilt index of app names", extra=dict(
+        num_apps=len(app_names), redis_key_prefix=redis_key_prefix))
+    return len(app_names)
@@ -51,6 +51,10 @@ class TasksConfigBaseMapping(ABCTasksConfigBase, collections.Mapping):
     Any TasksConfig object that is a key:value mapping should
     inherit from this class"""
 
+    # A hashable value that changes whenever the config does, so that data
+    # derived from the config can be cached.  None if it is unknown
+    version = None
+
     def __iter__(self):
         raise NotImplementedError("You need to write this")
 
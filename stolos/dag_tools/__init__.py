@@ -44,6 +44,8 @@ build_arg_parser = at.build_arg_parser([at.group(
 # Expose various functions to the rest of Stolos internals
 from .build import (
     build_dag,
+    get_dag,
+    compile_dag,
     visualize_dag,
 )
 from .node import (
@@ -61,7 +63,7 @@ from .traversal import (
     get_children,
     topological_sort,
 )
-build_dag, visualize_dag
+build_dag, get_dag, compile_dag, visualize_dag
 create_job_id, parse_job_id, passes_filter, get_job_id_template, get_job_type,
 get_autofill_values,
 get_task_names,
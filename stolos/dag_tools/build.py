@@ -1,8 +1,6 @@
 from functools import reduce
-import networkx as nx
 import os
 import six
-import tempfile
 
 from stolos.exceptions import _log_raise, _log_raise_if, DAGMisconfigured
 from stolos import configuration_backend as cb
@@ -10,6 +8,7 @@ from stolos import configuration_backend as cb
 from stolos import get_NS
 from . import node
 from . import log
+from .graph import CompactDAG, _Builder
 
 
 def _validate_dep_grp_metadata(dep_grp, ld, tasks_conf, dep_name):
@@ -311,6 +310,7 @@ def validate_autofill_values(app_name1, metadata, dg, tasks_conf, ld):
 
 
 def validate_dag(dg, tasks_conf):
+    import networkx as nx
     assert nx.algorithms.dag.is_directed_acyclic_graph(dg)
 
     for app_name1, metadata in tasks_conf.items():
@@ -324,6 +324,8 @@ def validate_dag(dg, tasks_conf):
 def visualize_dag(dg=None, plot_nx=False, plot_graphviz=True, write_dot=True,
                   prog='dot'):
     """For interactive use"""
+    import networkx as nx
+    import tempfile
     import webbrowser
     if not dg:
         dg = build_dag()
@@ -344,7 +346,8 @@ def visualize_dag(dg=None, plot_nx=False, plot_graphviz=True, write_dot=True,
 def _add_nodes(tasks_conf, dg):
     """Add nodes to a networkx graph
     `tasks_conf` a subclass of cb.TasksConfigBaseMapping
-    `dg` a networkx.MultiDiGraph instance (or something compatible)
+    `dg` a networkx.MultiDiGraph instance (or something compatible, like
+        graph._Builder)
     """
     for app_name, _attr_conf in tasks_conf.items():
         attr_dict = dict(_attr_conf)
@@ -424,8 +427,27 @@ def _build_dict_deps(dg, app_name, deps):
                     exception_kls=DAGMisconfigured)
 
 
+def _build_compiled_dag(tasks_conf, compiled):
+    """Build the DAG from the edges of a compiled (and validated) config"""
+    import networkx as nx
+    dg = nx.MultiDiGraph()
+    for app_name in compiled['topological_order']:
+        dg.add_node(app_name, dict(tasks_conf[app_name]))
+    for parent, child, dep_name in compiled['edges']:
+        dg.add_edge(parent, child, key=dep_name, label=dep_name)
+    return dg
+
+
 def build_dag(validate=False):
+    """Return the tasks graph as a networkx.MultiDiGraph
+
+    Stolos itself only uses this to validate or visualize the graph.  To
+    traverse the graph, get_dag() is much faster"""
+    import networkx as nx
     tasks_conf = cb.get_tasks_config()
+    compiled = node.get_compiled(tasks_conf)
+    if compiled is not None and not validate:
+        return _build_compiled_dag(tasks_conf, compiled)
     dg = nx.MultiDiGraph()
     for app_name, deps in _add_nodes(tasks_conf, dg):
         _build_dict_deps(
@@ -434,3 +456,59 @@ def build_dag(validate=False):
     if validate:
         validate_dag(dg, tasks_conf)
     return dg
+
+
+# (tasks config version, options), CompactDAG of the last get_dag() call
+_DAG = [None, None]
+
+
+def get_dag():
+    """Return the tasks graph as a graph.CompactDAG, which supports the
+    traversals Stolos does when it runs jobs.  The graph is not validated.
+    It is built again only if the tasks config or options change"""
+    tasks_conf = cb.get_tasks_config()
+    version = getattr(tasks_conf, 'version', None)
+    key = (version, sorted(node._compiled_options().items()))
+    if version is not None and _DAG[0] == key:
+        return _DAG[1]
+    compiled = node.get_compiled(tasks_conf)
+    if compiled is not None:
+        dag = CompactDAG.from_edges(
+            compiled['topological_order'], compiled['edges'])
+    else:
+        builder = _Builder()
+        for app_name, deps in _add_nodes(tasks_conf, builder):
+            _build_dict_deps(dg=builder, app_name=app_name, deps=deps)
+        dag = builder.build()
+    _DAG[:] = [key, dag]
+    return dag
+
+
+def compile_dag():
+    """
+    Validate the DAG and precompute the information Stolos would otherwise
+    derive from the tasks config every time it starts.
+    Return a dict that a configuration backend may store alongside the
+    config (see json_config.write_compiled) and expose as `compiled`.
+    """
+    tasks_conf = cb.get_tasks_config()
+    dg = build_dag(validate=True)
+    edges = [(parent, child, dep_name)
+             for parent, child, dep_name in dg.edges(keys=True)]
+    return dict(
+        options=node._compiled_options(),
+        tasks=tasks_conf.to_dict(),
+        edges=edges,
+        # the same order get_dag() derives from the uncompiled config
+        topological_order=list(
+            CompactDAG.from_edges(dg.nodes(), edges).topological_order()),
+        job_id_templates={
+            app_name: node.get_job_id_template(app_name)
+            for app_name in tasks_conf},
+        autofill_values={
+            app_name: {
+                k: list(v) for k, v in
+                node.get_autofill_values(app_name, raise_err=False).items()}
+            for app_name in tasks_conf
+            if 'autofill_values' in tasks_conf[app_name]},
+    )
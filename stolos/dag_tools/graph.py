@@ -0,0 +1,146 @@
+"""
+A compact, read-only representation of the tasks graph for traversal.
+
+Traversing the graph (ie getting parents, children or a topological sort)
+doesn't need networkx.  Apps are identified by integer ids, edges are stored
+as tuples, and the topological order is computed once.  networkx is only
+needed to validate or visualize the graph.  See build.build_dag()
+"""
+import heapq
+
+from stolos.exceptions import _log_raise_if, DAGMisconfigured
+
+
+class _Builder(object):
+    """Collects nodes and edges.  Quacks enough like a networkx.MultiDiGraph
+    that build._add_nodes and build._build_dict_deps can populate it"""
+    def __init__(self):
+        self.ids = {}
+        self.app_names = []
+        self.edges = []
+        self._seen_edges = set()
+
+    def _get_id(self, app_name):
+        if app_name not in self.ids:
+            self.ids[app_name] = len(self.app_names)
+            self.app_names.append(app_name)
+        return self.ids[app_name]
+
+    def add_node(self, app_name, attr_dict=None):
+        self._get_id(app_name)
+
+    def add_edge(self, parent, child, key, **attrs):
+        # like a MultiDiGraph, an edge is identified by (parent, child, key)
+        edge = (self._get_id(parent), self._get_id(child), key)
+        if edge not in self._seen_edges:
+            self._seen_edges.add(edge)
+            self.edges.append(edge)
+
+    def build(self):
+        return CompactDAG(self.app_names, self.edges)
+
+
+class CompactDAG(object):
+    """
+    The tasks graph as adjacency lists of integer app ids.
+
+    `app_names` - a sequence of app names.  An app's id is its index
+    `edges` - a sequence of (parent_id, child_id, dependency_group_name)
+    """
+    __slots__ = ['app_names', 'ids', '_children', '_parents', '_order']
+
+    def __init__(self, app_names, edges):
+        self.app_names = tuple(app_names)
+        self.ids = {app_name: i for i, app_name in enumerate(self.app_names)}
+        children = [[] for _ in self.app_names]
+        parents = [[] for _ in self.app_names]
+        for parent, child, dep_name in edges:
+            children[parent].append((child, dep_name))
+            parents[child].append((parent, dep_name))
+        self._children = tuple(
+            tuple(_group_by_app(x)) for x in children)
+        self._parents = tuple(tuple(x) for x in parents)
+        self._order = None
+
+    @classmethod
+    def from_edges(cls, app_names, edges):
+        """Build from (parent_app_name, child_app_name, dep_name) edges"""
+        builder = _Builder()
+        for app_name in app_names:
+            builder.add_node(app_name)
+        for parent, child, dep_name in edges:
+            builder.add_edge(parent, child, key=dep_name)
+        return builder.build()
+
+    def __contains__(self, app_name):
+        return app_name in self.ids
+
+    def __len__(self):
+        return len(self.app_names)
+
+    def children(self, app_name):
+        """Return a list of (child_app_name, dependency_group_name) pairs.
+        Edges to the same child are adjacent"""
+        names = self.app_names
+        return [
+            (names[child], dep_name)
+            for child, dep_name in self._children[self.ids[app_name]]]
+
+    def parents(self, app_name):
+        """Return a list of (parent_app_name, dependency_group_name) pairs"""
+        names = self.app_names
+        return [
+            (names[parent], dep_name)
+            for parent, dep_name in self._parents[self.ids[app_name]]]
+
+    def topological_order(self):
+        """Return a tuple of app names where parents precede their children.
+        Apps that may go in either order are sorted by name, so the order
+        doesn't depend on how the graph was built.
+        Raise DAGMisconfigured if the graph has a cycle"""
+        if self._order is None:
+            self._order = _topological_order(self.app_names, self._children)
+        _log_raise_if(
+            len(self._order) != len(self.app_names),
+            "The tasks graph has a cycle, so it can't be sorted",
+            extra=dict(cyclic_app_names=sorted(
+                set(self.app_names).difference(
+                    self.app_names[x] for x in self._order))),
+            exception_kls=DAGMisconfigured)
+        return tuple(self.app_names[x] for x in self._order)
+
+
+def _group_by_app(edges):
+    """Put edges to the same app next to each other, keeping the order in
+    which apps first appear"""
+    groups = {}
+    order = []
+    for app_id, dep_name in edges:
+        if app_id not in groups:
+            groups[app_id] = []
+            order.append(app_id)
+        groups[app_id].append(dep_name)
+    for app_id in order:
+        for dep_name in groups[app_id]:
+            yield (app_id, dep_name)
+
+
+def _topological_order(app_names, children):
+    """Kahn's algorithm, taking the ready node with the smallest app name
+    first.  Return a tuple of node ids.  If there is a cycle, the nodes in
+    (or downstream of) it are missing from the result"""
+    num_parents = [0] * len(children)
+    for edges in children:
+        for child, _ in edges:
+            num_parents[child] += 1
+    ready = [(app_names[x], x) for x, n in enumerate(num_parents) if n == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, app_id = heapq.heappop(ready)
+        order.append(app_id)
+        for child, _ in children[app_id]:
+            num_parents[child] -= 1
+            if num_parents[child] == 0:
+                heapq.heappush(ready, (app_names[child], child))
+    return tuple(order)
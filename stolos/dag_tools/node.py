@@ -12,6 +12,27 @@ from stolos import get_NS
 from . import log
 
 
+def _compiled_options():
+    """Options that the compiled DAG depends on"""
+    ns = get_NS()
+    return dict(
+        job_id_default_template=ns.job_id_default_template,
+        dependency_group_default_name=ns.dependency_group_default_name)
+
+
+def get_compiled(tasks_conf=None):
+    """Return the precomputed DAG if the configuration backend has one and
+    it was compiled with current options.  Otherwise, return None.
+    See build.compile_dag()
+    """
+    if tasks_conf is None:
+        tasks_conf = cb.get_tasks_config()
+    compiled = getattr(tasks_conf, 'compiled', None)
+    if compiled is None or compiled['options'] != _compiled_options():
+        return None
+    return compiled
+
+
 def create_job_id(app_name, **job_id_identifiers):
     templ, ptempl = get_job_id_template(app_name)
     rv = _validate_job_id_identifiers(
@@ -50,13 +71,17 @@ def parse_job_id(app_name, job_id, delimiter=None):
     return _validate_job_id_identifiers(app_name, vals)
 
 
+# (app_name, job_id component) pairs already warned about
+_MISSING_VALIDATIONS = set()
+
+
 def _validate_job_id_identifiers(
         app_name, vals, validations=None, **_log_details):
+    # this runs for every job_id Stolos parses, so log details are only built
+    # if there is something to log
     if validations is None:
         validations = get_NS().job_id_validations
     _, template = get_job_id_template(app_name)
-    ld = dict(app_name=app_name, job_id_template=template)
-    ld.update(_log_details)
     rv = {}
     for key, _val in zip(template, vals):
         # validate the job_id
@@ -66,15 +91,20 @@ def _validate_job_id_identifiers(
             assert val is not False, "validation func returned False"
         except KeyError:
             val = _val
-            log.warn(
-                "No job_id validation for key.  You should implement one",
-                extra=dict(job_id_key=key, **ld))
+            if (app_name, key) not in _MISSING_VALIDATIONS:
+                _MISSING_VALIDATIONS.add((app_name, key))
+                log.warn(
+                    "No job_id validation for key.  You should implement one",
+                    extra=dict(
+                        job_id_key=key, app_name=app_name,
+                        job_id_template=template, **_log_details))
         except Exception as err:
             val = _val
             msg = "An identifier in a job_id failed validation"
             log.exception(msg, extra=dict(
                 job_id_identifier=key, bad_value=_val, error_details=err,
-                **ld))
+                app_name=app_name, job_id_template=template,
+                **_log_details))
             raise InvalidJobId("%s err: %s" % (msg, err))
         rv[key] = val
     return rv
@@ -85,7 +115,13 @@ def get_autofill_values(app_name, raise_err=True):
 
     `raise_err` - If False, return {} if autofill_values does not exist
     """
-    app_data = cb.get_tasks_config()[app_name]
+    tasks_conf = cb.get_tasks_config()
+    compiled = get_compiled(tasks_conf)
+    if compiled is not None and app_name in compiled['autofill_values']:
+        return {
+            k: list(v)
+            for k, v in compiled['autofill_values'][app_name].items()}
+    app_data = tasks_conf[app_name]
     try:
         vals = app_data['autofill_values']
     except KeyError:
@@ -160,9 +196,14 @@ def passes_filter(app_name, job_id):
 
 
 def get_job_id_template(app_name, template=None):
+    dg = cb.get_tasks_config()
     if template is None:
+        compiled = get_compiled(dg)
+        if compiled is not None and app_name in compiled['job_id_templates']:
+            template, parsed_template = \
+                compiled['job_id_templates'][app_name]
+            return (template, list(parsed_template))
         template = get_NS().job_id_default_template
-    dg = cb.get_tasks_config()
     template = dg[app_name].get('job_id', template)
     parsed_template = re.findall(r'{(.*?)}', template)
     return (template, parsed_template)
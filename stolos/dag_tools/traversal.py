@@ -1,5 +1,5 @@
 from collections import defaultdict
-import networkx as nx
+import logging
 
 from stolos.util import crossproduct, flatmap_with_kwargs
 
@@ -9,7 +9,7 @@ from stolos.exceptions import (
 from stolos import configuration_backend as cb
 from stolos import get_NS
 
-from .build import build_dag
+from .build import get_dag
 from .node import (parse_job_id, get_job_id_template, get_autofill_values)
 from . import log
 
@@ -24,7 +24,7 @@ def topological_sort(lst):
     dct = defaultdict(list)
     for app_job in lst:
         dct[app_job[0]].append(app_job)
-    for node in nx.topological_sort(build_dag()):
+    for node in get_dag().topological_order():
         for app_job2 in dct[node]:
             yield app_job2
 
@@ -61,9 +61,11 @@ def get_parents(app_name, job_id, include_dependency_group=False,
             grp, parsed_job_id, child_app_name=app_name)
             for grp in dep_group)
         if not compatible:
-            log.debug(
-                "ignore possible parents whose job_id can't match given child",
-                extra=dict(dependency_group_name=group_name, **ld))
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug(
+                    "ignore possible parents whose job_id can't match given"
+                    " child",
+                    extra=dict(dependency_group_name=group_name, **ld))
             continue
 
         for subgrp in dep_group:
@@ -314,10 +316,9 @@ def _iter_job_ids(dep_group, group_name, parent_app_name, ld):
 
 
 def get_children(app_name, job_id, include_dependency_group=True):
-    dg = build_dag()
-    child_apps = [(k, vv) for k, v in dg.succ[app_name].items() for vv in v]
-    for child, group_name in child_apps:
-        depends_on = dg.node[child]['depends_on']
+    tasks_conf = cb.get_tasks_config()
+    for child, group_name in get_dag().children(app_name):
+        depends_on = tasks_conf[child]['depends_on']
         # 2 types of depends_on definitions:
         # 1) dict with app_name
         # 2) named dependency groups:
@@ -32,6 +32,11 @@ class JobAlreadyQueued(StolosException):
     pass
 
 
+class NotTaken(StolosException, UserWarning):
+    """A LockingQueue can't consume() or requeue() an item it didn't get()"""
+    pass
+
+
 class CouldNotObtainLock(StolosException):
     pass
 
@@ -18,13 +18,37 @@ import importlib
 import stolos
 from stolos import argparse_shared as at
 from stolos import log
+from stolos import metrics
+from stolos import profiling
+
+
+# key: argparse.ArgumentParser
+_PARSERS = {}
+
+
+def cached_parser(key, build_parser):
+    """
+    Return the parser that `build_parser()` returns, and reuse it next time
+    this is called with the same key.  If `key` is None, don't cache.
+
+    Parsers are immutable once built.  Options read their defaults from
+    STOLOS_* environment variables when a module's parser is first built.
+    """
+    if key is None:
+        return build_parser()
+    if key not in _PARSERS:
+        _PARSERS[key] = build_parser()
+    return _PARSERS[key]
 
 
 def _get_parent_parsers(objects):
     """Internal function to call m.build_arg_parser() for each m in objects"""
     for m in set(objects):
         if not isinstance(m, argparse.ArgumentParser):
-            p = m.build_arg_parser()
+            if hasattr(m, 'build_arg_parser'):
+                p = m.build_arg_parser()
+            else:
+                p = m()
             if not isinstance(p, argparse.ArgumentParser):
                 msg = (
                     "Failed to initialize Stolos because the initializer"
@@ -67,6 +91,8 @@ def initialize(objects, args=None, parse_known_args=False,
 
     `objects` - is a list of build_arg_parser functions or objects
         (ie Stolos modules) containing a callable build_arg_parser attribute.
+        Parsers built from these are cached, so re-initializing is cheap.
+        Objects may also be parsers, but then nothing is cached.
     `args` - (optional).  Define command-line arguments to use.
         Default to sys.argv (which is what argparse does).
         Explicitly pass args=[] to not read command-line arguments, and instead
@@ -80,26 +106,36 @@ def initialize(objects, args=None, parse_known_args=False,
         command-line is not recognized by the argument parser
     `argument_parser_kwargs` - (optional) passed to the ArgumentParser(...)
     """
+    if any(isinstance(m, argparse.ArgumentParser) for m in objects):
+        key = None
+    else:
+        key = (frozenset(objects),
+               tuple(sorted(argument_parser_kwargs.items())))
+
     # partially initialize a parser to get selected configuration backend
-    parser = at.build_arg_parser(
+    parser = cached_parser(key, lambda: at.build_arg_parser(
         description="Initialize Stolos, whether running it or calling its api",
         parents=list(_get_parent_parsers(objects)),
-        **argument_parser_kwargs)
-    if args is not None:
-        ns, _ = parser.parse_known_args(args)
-    else:
-        ns, _ = parser.parse_known_args()
+        **argument_parser_kwargs))
+    ns, _ = parser.parse_known_args(args)
 
     # get a new parser updated with options for each chosen backend
-    parser = initialize_backend(
-        ns.configuration_backend, parser, add_help=False)
-    parser = initialize_backend(
-        ns.queue_backend, parser, add_help=not bool(parse_known_args))
+    def build_parser():
+        p = initialize_backend(
+            ns.configuration_backend, parser, add_help=False)
+        return initialize_backend(
+            ns.queue_backend, p, add_help=not bool(parse_known_args))
+    parser = cached_parser(
+        key and (key, ns.configuration_backend, ns.queue_backend,
+                 bool(parse_known_args)),
+        build_parser)
 
     if not parse_known_args:
         ns = parser.parse_args(args)
     else:
-        ns, _ = parser.parse_known_args()
+        ns, _ = parser.parse_known_args(args)
+    metrics.setup(ns)
+    profiling.wrap_api(ns)
     stolos.NS = ns
     try:
         del stolos.Uninitialized
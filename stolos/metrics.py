@@ -0,0 +1,421 @@
+"""
+Count and time what Stolos does, in process.
+
+Metrics are recorded in a registry, `REGISTRY`.  With the --metrics option,
+every call to the queue backend is timed, per operation (ie "get" or
+"LockingQueue.is_queued") and per app, in the histogram, qb_latency_seconds.
+Its count is the num calls.
+
+Metrics can be exported in the Prometheus text format from a local port
+(--metrics_port) or periodically sent to a statsd server over UDP
+(--metrics_statsd).
+"""
+import atexit
+import bisect
+import re
+import socket
+import threading
+import time
+
+from stolos import argparse_shared as at
+from stolos import log
+
+
+# upper bounds, in seconds, of the histogram buckets
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5,
+           10, float('inf'))
+# queue backend functions, besides the LockingQueue and Lock classes
+QB_FUNCS = ('get', 'get_many', 'is_locked_many', 'iter_children', 'exists',
+            'delete', 'set', 'create', 'increment')
+
+
+class Histogram(object):
+    """Counts of observed values in buckets, plus their sum and count"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        rv = Histogram(self.buckets)
+        rv.counts = list(self.counts)
+        rv.sum = self.sum
+        rv.count = self.count
+        return rv
+
+
+class Registry(object):
+    """Counters and histograms, identified by a name and labels.
+    It is safe to update from many threads"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """Add a value, like a num seconds, to a histogram"""
+        self._observe((name, tuple(sorted(labels.items()))), value)
+
+    def _observe(self, key, value):
+        with self._lock:
+            try:
+                h = self._histograms[key]
+            except KeyError:
+                h = self._histograms[key] = Histogram(self.buckets)
+            h.observe(value)
+
+    def timer(self, name, **labels):
+        """Return a context manager that observes how many seconds its
+        block took"""
+        return _Timer(self, (name, tuple(sorted(labels.items()))))
+
+    def counters(self):
+        """Return {(name, ((label, value), ...)): count}"""
+        with self._lock:
+            return dict(self._counters)
+
+    def histograms(self):
+        """Return {(name, ((label, value), ...)): Histogram}"""
+        with self._lock:
+            return dict((k, v.copy()) for k, v in self._histograms.items())
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def to_prometheus(self, prefix='stolos_'):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, items in _by_name(self.counters()):
+            lines.append('# TYPE %s%s counter' % (prefix, name))
+            for labels, value in items:
+                lines.append('%s%s%s %s' % (
+                    prefix, name, _prom_labels(labels), value))
+        for name, items in _by_name(self.histograms()):
+            lines.append('# TYPE %s%s histogram' % (prefix, name))
+            for labels, h in items:
+                cumulative = 0
+                for le, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append('%s%s_bucket%s %s' % (
+                        prefix, name,
+                        _prom_labels(labels + (('le', _prom_float(le)), )),
+                        cumulative))
+                lines.append('%s%s_sum%s %r' % (
+                    prefix, name, _prom_labels(labels), h.sum))
+                lines.append('%s%s_count%s %s' % (
+                    prefix, name, _prom_labels(labels), h.count))
+        return '\n'.join(lines) + '\n'
+
+
+class _Timer(object):
+    def __init__(self, registry, key):
+        self._registry = registry
+        self._key = key
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._registry._observe(self._key, time.time() - self._start)
+
+
+def _by_name(metrics):
+    """Group {(name, labels): value} by name.  Yield (name, [(labels, value)])
+    sorted by name and labels"""
+    names = {}
+    for (name, labels), value in metrics.items():
+        names.setdefault(name, []).append((labels, value))
+    for name in sorted(names):
+        yield name, sorted(names[name], key=lambda x: x[0])
+
+
+def _prom_float(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+def _prom_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"'))
+        for k, v in labels)
+
+
+REGISTRY = Registry()
+
+
+def _app_name(path):
+    """Return the app that a queue backend path belongs to"""
+    idx = path.find('/all_subtasks')
+    return path if idx == -1 else path[:idx]
+
+
+class InstrumentedBackend(object):
+    """Wrap a queue backend so that every call to its api is timed and
+    counted, per operation and app, in the registry"""
+    def __init__(self, qbcli, registry=REGISTRY):
+        self._qbcli = qbcli
+        self._registry = registry
+        self.__name__ = qbcli.__name__
+        for name in QB_FUNCS:
+            setattr(self, name, self._wrap(name, getattr(qbcli, name)))
+        self.LockingQueue = self._wrap_class(
+            'LockingQueue', qbcli.LockingQueue)
+        self.Lock = self._wrap_class('Lock', qbcli.Lock)
+
+    def __getattr__(self, name):
+        return getattr(self._qbcli, name)
+
+    def _wrap(self, op, func):
+        observe = self._registry._observe
+        if op in ('get_many', 'is_locked_many'):
+            def wrapped(paths):
+                paths = list(paths)
+                start = time.time()
+                try:
+                    return func(paths)
+                finally:
+                    observe(
+                        _key(op, _app_name(paths[0]) if paths else ''),
+                        time.time() - start)
+            return wrapped
+        if op == 'iter_children':
+            def wrapped(path, *args, **kwargs):
+                return _timed_iter(
+                    func(path, *args, **kwargs), observe,
+                    _key(op, _app_name(path)))
+            return wrapped
+
+        def wrapped(path, *args, **kwargs):
+            start = time.time()
+            try:
+                return func(path, *args, **kwargs)
+            finally:
+                observe(_key(op, _app_name(path)), time.time() - start)
+        return wrapped
+
+    def _wrap_class(self, kls_name, kls):
+        registry = self._registry
+        return lambda path: _InstrumentedObject(
+            kls(path), kls_name, _app_name(path), registry)
+
+
+def _key(op, app):
+    return ('qb_latency_seconds', (('app', app), ('op', op)))
+
+
+def _timed_iter(iterable, observe, key):
+    """Yield from iterable.  Then observe how long it took to produce the
+    items, not counting the time the caller spent on them"""
+    it = iter(iterable)
+    elapsed = 0
+    try:
+        while True:
+            start = time.time()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.time() - start
+            yield item
+    finally:
+        observe(key, elapsed)
+
+
+class _InstrumentedObject(object):
+    """A LockingQueue or Lock whose method calls are timed"""
+    def __init__(self, obj, kls_name, app, registry):
+        self._obj = obj
+        self._kls_name = kls_name
+        self._app = app
+        self._registry = registry
+
+    def __getattr__(self, name):
+        attr = getattr(self._obj, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        observe = self._registry._observe
+        key = _key('%s.%s' % (self._kls_name, name), self._app)
+
+        def wrapped(*args, **kwargs):
+            start = time.time()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                observe(key, time.time() - start)
+        setattr(self, name, wrapped)  # next time, skip __getattr__
+        return wrapped
+
+
+def instrument(qbcli, registry=REGISTRY):
+    """Return the given queue backend, wrapped so that its calls are timed"""
+    if isinstance(qbcli, InstrumentedBackend):
+        return qbcli
+    return InstrumentedBackend(qbcli, registry)
+
+
+class _MetricsHandler:
+    """Mixed into an http request handler at runtime, so the http server
+    modules are only imported if metrics are served.  It is a classic class
+    on python2, like the handler it's mixed into"""
+    registry = REGISTRY
+
+    def do_GET(self):
+        body = self.registry.to_prometheus().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port, host='127.0.0.1', registry=REGISTRY):
+    """Serve the registry's metrics in the Prometheus text format from a
+    background thread.  Return the server, or None if the port is taken"""
+    from six.moves import BaseHTTPServer
+    handler = type('MetricsHandler', (
+        _MetricsHandler, BaseHTTPServer.BaseHTTPRequestHandler, object),
+        dict(registry=registry))
+    try:
+        server = BaseHTTPServer.HTTPServer((host, port), handler)
+    except socket.error as err:
+        log.warn("Could not serve metrics", extra=dict(
+            metrics_port=port, err=err))
+        return None
+    t = threading.Thread(
+        target=server.serve_forever, name='stolos.metrics http server')
+    t.daemon = True
+    t.start()
+    return server
+
+
+def _statsd_name(prefix, name, labels):
+    if name.endswith('_seconds'):
+        name = name[:-len('_seconds')]
+    return '.'.join(
+        [prefix, name] + [re.sub(r'[^\w\-]', '_', str(v)) for _, v in labels])
+
+
+class StatsdEmitter(object):
+    """Send what changed in a registry since the last flush to a statsd
+    server over UDP.  Counters are sent as counts.  Histograms are sent as
+    their mean, in milliseconds, with a sample rate of 1/count, so statsd
+    derives the right num calls"""
+    max_packet_size = 1400
+
+    def __init__(self, address, registry=REGISTRY, prefix='stolos'):
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.registry = registry
+        self.prefix = prefix
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._last = {}
+
+    def _lines(self):
+        for key, value in sorted(self.registry.counters().items()):
+            delta = value - self._last.get(key, 0)
+            self._last[key] = value
+            if delta:
+                yield '%s:%s|c' % (_statsd_name(self.prefix, *key), delta)
+        for key, h in sorted(self.registry.histograms().items()):
+            count, total = self._last.get(key, (0, 0.))
+            self._last[key] = (h.count, h.sum)
+            count, total = h.count - count, h.sum - total
+            if count:
+                yield '%s:%.4f|ms|@%s' % (
+                    _statsd_name(self.prefix, *key),
+                    total / count * 1000, 1. / count)
+
+    def flush(self):
+        packet = []
+        size = 0
+        for line in self._lines():
+            if packet and size + len(line) + 1 > self.max_packet_size:
+                self._send(packet)
+                packet, size = [], 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send(packet)
+
+    def _send(self, lines):
+        try:
+            self._sock.sendto('\n'.join(lines).encode('utf8'), self.address)
+        except socket.error as err:
+            log.warn("Could not send metrics to statsd", extra=dict(
+                metrics_statsd='%s:%s' % self.address, err=err))
+
+
+def start_statsd(address, interval, registry=REGISTRY):
+    """Flush metrics to statsd every `interval` seconds from a background
+    thread, and when the process exits.  Return the emitter"""
+    emitter = StatsdEmitter(address, registry)
+
+    def _flush_forever():
+        while True:
+            time.sleep(interval)
+            emitter.flush()
+    t = threading.Thread(target=_flush_forever, name='stolos.metrics statsd')
+    t.daemon = True
+    t.start()
+    atexit.register(emitter.flush)
+    return emitter
+
+
+# exporters that were started, so re-initializing doesn't start them again
+_EXPORTERS = {}
+
+
+def setup(ns):
+    """Instrument the queue backend and start exporters, as the given
+    options request"""
+    port = getattr(ns, 'metrics_port', None)
+    statsd = getattr(ns, 'metrics_statsd', None)
+    if not (getattr(ns, 'metrics', None) or port or statsd):
+        return
+    ns.queue_backend = instrument(ns.queue_backend)
+    if port and ('http', port) not in _EXPORTERS:
+        _EXPORTERS[('http', port)] = start_http_server(port)
+    if statsd and ('statsd', statsd) not in _EXPORTERS:
+        _EXPORTERS[('statsd', statsd)] = start_statsd(
+            statsd, ns.metrics_flush_interval)
+
+
+build_arg_parser = at.build_arg_parser([at.group(
+    "Metrics",
+    at.add_argument(
+        '--metrics', action='store_true', help=(
+            "Count and time every call to the queue backend, per operation"
+            " and app.  Implied by --metrics_port and --metrics_statsd")),
+    at.add_argument(
+        '--metrics_port', type=int, help=(
+            "Serve metrics in the Prometheus text format from this port"
+            " on localhost")),
+    at.add_argument(
+        '--metrics_statsd', help=(
+            "host:port of a statsd server to periodically send metrics to,"
+            " over UDP")),
+    at.add_argument(
+        '--metrics_flush_interval', type=float, default=10, help=(
+            "Num seconds between sending metrics to statsd.  They are also"
+            " sent when Stolos exits")),
+)])
@@ -3,6 +3,7 @@ import inspect
 import simplejson
 import importlib
 
+from stolos import get_NS
 from stolos.plugins import at, log_and_raise, api, log
 
 from . import pyspark_context
@@ -157,8 +158,11 @@ def build_arg_parser():
     """
     parents = [_build_arg_parser()]
 
-    _ns, _ = parents[0].parse_known_args()
-    _app = get_pymodule(_ns.app_name)
+    try:
+        app_name = get_NS().app_name
+    except Exception:  # Stolos isn't initialized by the runner
+        app_name = parents[0].parse_known_args()[0].app_name
+    _app = get_pymodule(app_name)
     if hasattr(_app, 'build_arg_parser'):
         parents.append(
             _app.build_arg_parser()
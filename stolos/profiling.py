@@ -0,0 +1,181 @@
+"""
+Profile Stolos with cProfile, without changing code.
+
+With --profile DIR, each run of the runner is profiled, and so is each call
+to the api functions named by --profile_api (ie "maybe_add_subtask").
+Stats are written to DIR in the pstats format, one file per job or call:
+    <app_name>.<job_id>.<pid>.<timestamp>.prof
+    api.<function name>.<pid>.<timestamp>.prof
+or, with --profile_aggregate, one file per process, written at exit.
+
+--profile_sample N profiles 1 in N (randomly chosen) jobs or calls, so
+profiling can stay on in production.  To print the slowest functions of
+every profile in a directory:
+
+    python -m stolos.profiling DIR --sort cumulative
+"""
+import atexit
+import cProfile
+import functools
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+
+from stolos import argparse_shared as at
+from stolos import log
+
+
+def is_enabled(ns):
+    return bool(getattr(ns, 'profile', None))
+
+
+def _sampled(ns):
+    return random.randrange(max(ns.profile_sample, 1)) == 0
+
+
+def _filename(ns, *name):
+    name = '.'.join(
+        re.sub(r'[^\w\-]', '_', str(x)) for x in name + (os.getpid(), ))
+    return os.path.join(
+        ns.profile, '%s.%d.prof' % (name, int(time.time() * 1000)))
+
+
+class _Aggregate(object):
+    """One profile per process that every sampled job or call adds to.
+    cProfile can only profile one thread at a time, so calls made while
+    another thread is being profiled are not profiled"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.path = None
+
+    def dump(self):
+        with self.lock:
+            if self.profiler is not None:
+                self.profiler.dump_stats(self.path)
+
+
+_AGGREGATE = _Aggregate()
+# a thread profiles one block at a time, not blocks nested in it
+_ACTIVE = threading.local()
+
+
+def profile(ns, name):
+    """Return a context manager that profiles its block, if profiling is
+    enabled and this block is sampled.  `name` is a function that returns
+    the parts of the file name, evaluated when the block exits:
+
+        with profile(ns, lambda: (ns.app_name, ns.job_id)):
+            ...
+    """
+    return _Profile(ns, name)
+
+
+class _Profile(object):
+    def __init__(self, ns, name):
+        self._ns = ns
+        self._name = name
+        self._profiler = None
+        self._aggregate = False
+
+    def __enter__(self):
+        ns = self._ns
+        if not is_enabled(ns) or getattr(_ACTIVE, 'profile', None) \
+                or not _sampled(ns):
+            return self
+        if not ns.profile_aggregate:
+            self._profiler = cProfile.Profile()
+        elif _AGGREGATE.lock.acquire(False):
+            if _AGGREGATE.profiler is None:
+                _AGGREGATE.profiler = cProfile.Profile()
+                _AGGREGATE.path = _filename(ns, 'aggregate')
+                atexit.register(_AGGREGATE.dump)
+            self._profiler = _AGGREGATE.profiler
+            self._aggregate = True
+        if self._profiler is not None:
+            _ACTIVE.profile = self
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profiler is None:
+            return
+        self._profiler.disable()
+        _ACTIVE.profile = None
+        if self._aggregate:
+            _AGGREGATE.lock.release()
+            return
+        path = _filename(self._ns, *self._name())
+        try:
+            self._profiler.dump_stats(path)
+        except (IOError, OSError) as err:
+            log.warn("Could not write profile", extra=dict(
+                path=path, err=err))
+        else:
+            log.debug("Wrote profile", extra=dict(path=path))
+
+
+def profiled(ns, func):
+    """Wrap a function so each (sampled) call to it is profiled"""
+    @functools.wraps(func)
+    def _profiled(*args, **kwargs):
+        with profile(ns, lambda: ('api', func.__name__)):
+            return func(*args, **kwargs)
+    _profiled.unprofiled = func
+    return _profiled
+
+
+def wrap_api(ns):
+    """Profile the api functions that the given options name"""
+    if not is_enabled(ns) or not ns.profile_api:
+        return
+    from stolos import api
+    for name in ns.profile_api.split(','):
+        func = getattr(api, name.strip())
+        setattr(api, name.strip(), profiled(ns, getattr(
+            func, "unprofiled", func)))
+
+
+def print_stats(paths, sort='cumulative', limit=30, stream=sys.stdout):
+    """Merge the given profiles and print their slowest functions"""
+    stats = pstats.Stats(*paths, stream=stream)
+    stats.sort_stats(sort).print_stats(limit)
+    return stats
+
+
+build_arg_parser = at.build_arg_parser([at.group(
+    "Profiling",
+    at.add_argument(
+        '--profile', metavar='DIR', help=(
+            "Profile the runner and the api functions named by"
+            " --profile_api, and write pstats files to this directory")),
+    at.add_argument(
+        '--profile_sample', type=int, default=1, metavar='N', help=(
+            "Profile only 1 in N randomly chosen jobs or api calls")),
+    at.add_argument(
+        '--profile_api', default='', help=(
+            "Comma separated names of stolos.api functions to profile,"
+            " ie maybe_add_subtask,check_state")),
+    at.add_argument(
+        '--profile_aggregate', action='store_true', help=(
+            "Write one profile per process, at exit, rather than one per"
+            " job or api call")),
+)])
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Print the slowest functions of the profiles in a dir")
+    parser.add_argument('directory')
+    parser.add_argument('--sort', default='cumulative')
+    parser.add_argument('--limit', type=int, default=30)
+    _ns = parser.parse_args()
+    print_stats(
+        [os.path.join(_ns.directory, x) for x in sorted(
+            os.listdir(_ns.directory)) if x.endswith('.prof')],
+        sort=_ns.sort, limit=_ns.limit)
@@ -9,11 +9,13 @@ get_job_path, get_qbclient, get_lock_path
 
 from .modify_job_state import (
     maybe_add_subtask, readd_subtask, set_state, inc_retry_count,
-    ensure_parents_completed,
+    get_retry_count, inc_requeue_count,
+    ensure_parents_completed, park_subtask, block_subtask,
     _set_state_unsafe  # TODO: get rid of _set_state_unsafe
 )
 maybe_add_subtask, readd_subtask, set_state, inc_retry_count,
-ensure_parents_completed, _set_state_unsafe
+get_retry_count, inc_requeue_count,
+ensure_parents_completed, park_subtask, block_subtask, _set_state_unsafe
 
 from .read_job_state import (check_state)
 check_state
@@ -21,6 +23,9 @@ check_state
 from .locking import (obtain_execute_lock, is_execute_locked)
 obtain_execute_lock, is_execute_locked
 
+from .status import record_duration
+record_duration
+
 from .qbcli_baseapi import Lock as BaseLock
 BaseLock
 
@@ -32,7 +37,10 @@ build_arg_parser = at.build_arg_parser([at.group(
         default='redis',
         known_backends={
             "zookeeper": "stolos.queue_backend.qbcli_zookeeper",
-            "redis": "stolos.queue_backend.qbcli_redis"},
+            "redis": "stolos.queue_backend.qbcli_redis",
+            "sqlite": "stolos.queue_backend.qbcli_sqlite",
+            "file": "stolos.queue_backend.qbcli_file",
+            "memory": "stolos.queue_backend.qbcli_memory"},
         help=(
             'Select a database that stores job state.'
             ' This option defines which queue backend Stolos uses.'
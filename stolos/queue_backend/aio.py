@@ -0,0 +1,215 @@
+"""
+Asyncio versions of the queue backend api, so one process can keep many
+backend operations in flight at once (ie to add or check thousands of jobs)
+without a thread per operation.  This module requires Python 3.
+
+    from stolos.queue_backend import aio
+
+    async def add(app_name, job_ids):
+        return await aio.gather(
+            (aio.maybe_add_subtask(app_name, x) for x in job_ids), limit=1000)
+
+get_qbclient() returns an async client of the configured queue backend.  It
+has the api of qbcli_baseapi (LockingQueue, Lock, get, get_many, exists,
+delete, set, create and increment), except every function and method is a
+coroutine.  Redis uses redis.asyncio (redis-py 4.2+), and ZooKeeper uses
+kazoo's async calls.  Other queue backends, or redis without redis.asyncio,
+run their usual client in the event loop's thread pool, which is correct but
+only as concurrent as the pool.
+"""
+import asyncio
+import functools
+import importlib
+
+from stolos import dag_tools as dt
+from stolos import exceptions
+from stolos import util
+from . import log
+from . import shared
+from . import status
+from .read_job_state import validate_state
+
+
+# queue backends that have a native async client
+_ASYNC_BACKENDS = {
+    'stolos.queue_backend.qbcli_redis': 'stolos.queue_backend.aio_redis',
+    'stolos.queue_backend.qbcli_zookeeper':
+    'stolos.queue_backend.aio_zookeeper',
+}
+# queue backend: its async client
+_CLIENTS = {}
+
+
+def get_qbclient():
+    """Return an async client of the configured queue backend"""
+    qbcli = shared.get_qbclient()
+    if qbcli not in _CLIENTS:
+        name = _ASYNC_BACKENDS.get(getattr(qbcli, '__name__', None))
+        try:
+            _CLIENTS[qbcli] = importlib.import_module(name) if name else None
+        except ImportError as err:
+            log.warn(
+                "Could not load the async queue backend client."
+                "  Running the queue backend in threads instead",
+                extra=dict(async_client=name, err=err))
+            _CLIENTS[qbcli] = None
+        if _CLIENTS[qbcli] is None:
+            _CLIENTS[qbcli] = ThreadedClient(qbcli)
+    return _CLIENTS[qbcli]
+
+
+async def run_in_thread(func, *args, **kwargs):
+    """Call a blocking function in the event loop's thread pool"""
+    return await asyncio.get_event_loop().run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+class ThreadedObject(object):
+    """A queue backend's Lock or LockingQueue whose methods are coroutines
+    that run in the event loop's thread pool.  The object itself is created
+    in the calling thread, because some backends (ie redis) set up signal
+    handlers, which only works in the main thread"""
+    def __init__(self, kls, path):
+        self._obj = kls(path)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return functools.partial(run_in_thread, getattr(self._obj, name))
+
+
+class ThreadedClient(object):
+    """An async client of any queue backend that runs its calls in the event
+    loop's thread pool"""
+    def __init__(self, qbcli):
+        self._qbcli = qbcli
+
+    def LockingQueue(self, path):
+        return ThreadedObject(self._qbcli.LockingQueue, path)
+
+    def Lock(self, path):
+        return ThreadedObject(self._qbcli.Lock, path)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return functools.partial(run_in_thread, getattr(self._qbcli, name))
+
+
+async def gather(aws, limit=1000):
+    """Await the given awaitables (ie coroutines), with at most `limit` of
+    them in flight at a time.  Return their results in order"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def _bounded(aw):
+        async with semaphore:
+            return await aw
+    return await asyncio.gather(*[_bounded(x) for x in aws])
+
+
+async def check_state(app_name, job_id, raise_if_not_exists=False,
+                      pending=False, completed=False, failed=False,
+                      skipped=False, all=False, _get=False):
+    """Determine whether a specific job is in one or more specific state(s).
+    The states of many job_ids are read in one batch.
+
+    See read_job_state.check_state for the arguments and return value.
+    """
+    if isinstance(job_id, str):
+        job_ids = [job_id]
+    else:
+        job_ids = job_id
+    paths = [shared.get_job_path(app_name, x) for x in job_ids]
+    states = await get_qbclient().get_many(paths)
+    rv = []
+    for path, state in zip(paths, states):
+        if state is None:
+            if raise_if_not_exists:
+                raise exceptions.NoNodeError(path)
+            rv.append(False)
+        elif _get:
+            rv.append(state)
+        else:
+            rv.append(state in validate_state(
+                pending, completed, failed, skipped, all=all, multi=True))
+    if isinstance(job_id, str):
+        return rv[0]
+    return rv
+
+
+async def _set_state(app_name, job_id, state):
+    """Set the state of a job that isn't completed, and so has no children to
+    queue (see modify_job_state._set_state_unsafe)"""
+    aqbcli = get_qbclient()
+    job_path = shared.get_job_path(app_name, job_id)
+    try:
+        old_state = await aqbcli.get(job_path)
+    except exceptions.NoNodeError:
+        old_state = None
+        await aqbcli.create(job_path, state)
+    else:
+        await aqbcli.set(job_path, state)
+    await asyncio.gather(*[
+        aqbcli.increment(status.get_counter_path(app_name, name), value)
+        for name, value in status.get_state_counter_changes(
+            old_state, state)])
+    log.debug(
+        "Set task state",
+        extra=dict(state=state, app_name=app_name, job_id=job_id))
+
+
+async def _set_priority(app_name, job_id, priority):
+    aqbcli = get_qbclient()
+    path = shared.get_job_path(app_name, job_id, 'priority')
+    try:
+        await aqbcli.create(path, str(priority))
+    except exceptions.NodeExistsError:
+        await aqbcli.set(path, str(priority))
+
+
+async def _queue(app_name, job_id, queue=True, priority=None):
+    """Calling code should obtain a lock first!
+    See modify_job_state._queue"""
+    log.info(
+        'Creating and queueing new subtask',
+        extra=dict(app_name=app_name, job_id=job_id, priority=priority))
+    if not dt.passes_filter(app_name, job_id):
+        log.info(
+            'job invalid.  marking as skipped so it does not run',
+            extra=dict(app_name=app_name, job_id=job_id))
+        await _set_state(app_name, job_id, shared.SKIPPED)
+        return
+    await _set_state(app_name, job_id, shared.PENDING)
+    if not queue:
+        log.warn(
+            'create a subtask but not actually queueing it', extra=dict(
+                app_name=app_name, job_id=job_id, priority=priority))
+    elif priority:
+        await _set_priority(app_name, job_id, priority)
+        await get_qbclient().LockingQueue(app_name).put(
+            job_id, priority=priority)
+    else:
+        await get_qbclient().LockingQueue(app_name).put(job_id)
+
+
+@util.pre_condition(dt.parse_job_id)
+async def maybe_add_subtask(app_name, job_id, queue=True, priority=None):
+    """Add a subtask to the queue if it hasn't been added yet.
+
+    See modify_job_state.maybe_add_subtask for the arguments
+    """
+    aqbcli = get_qbclient()
+    if await aqbcli.exists(shared.get_job_path(app_name, job_id)):
+        return False
+    # get a lock so we guarantee this task isn't being added twice concurrently
+    lock = aqbcli.Lock(shared.get_lock_path('add', app_name, job_id))
+    if not await lock.acquire(blocking=False):
+        log.debug(
+            "add Lock already acquired.",
+            extra=dict(app_name=app_name, job_id=job_id))
+        return False
+    try:
+        await _queue(app_name, job_id, queue=queue, priority=priority)
+    finally:
+        await lock.release()
+    return True
@@ -0,0 +1,348 @@
+"""
+The redis queue backend (see qbcli_redis) for asyncio.  See aio.
+
+It uses the same keys and lua scripts as qbcli_redis, so sync and async
+clients can share queues and locks.  Each event loop gets its own
+connection pool, and each lock, or item gotten from a queue, is kept alive
+by its own task until it is released.
+"""
+import asyncio
+import hashlib
+import random
+import sys
+import time
+import weakref
+
+import redis.asyncio
+import redis.exceptions
+
+from stolos import get_NS
+import stolos.exceptions
+
+from . import log
+from . import qbcli_redis
+
+
+# event loop: client
+_CLIENTS = weakref.WeakKeyDictionary()
+
+
+def raw_client():
+    loop = asyncio.get_event_loop()
+    if loop not in _CLIENTS:
+        NS = get_NS()
+        _CLIENTS[loop] = redis.asyncio.StrictRedis(
+            host=NS.qb_redis_host,
+            port=NS.qb_redis_port,
+            socket_timeout=NS.qb_redis_socket_timeout)
+    return _CLIENTS[loop]
+
+
+class BaseStolosRedis(object):
+    """
+    Base Class for Lock and LockingQueue that
+    - runs the lua scripts of its qbcli_redis counterpart
+    - extends the lock it holds in the background, using the script named by
+      _EXTEND_LOCK_SCRIPT_NAME
+    """
+    SCRIPTS = dict()  # filled out by child classes
+
+    def __init__(self, path):
+        assert self.SCRIPTS, 'child class must define SCRIPTS'
+        assert self._EXTEND_LOCK_SCRIPT_NAME, (
+            'child class must define _EXTEND_LOCK_SCRIPT_NAME')
+
+        self._client_id = str(random.randint(0, sys.maxsize))
+        self._path = path
+
+        self._lock_timeout = get_NS().qb_redis_lock_timeout
+        self._max_network_delay = get_NS().qb_redis_max_network_delay
+        self._extender = None
+
+    async def _evalsha(self, name, *keys_and_args):
+        script = self.SCRIPTS[name]['script']
+        sha = hashlib.sha1(script.encode('utf8')).hexdigest()
+        numkeys = len(self.SCRIPTS[name]['keys'])
+        try:
+            return await raw_client().evalsha(sha, numkeys, *keys_and_args)
+        except redis.exceptions.NoScriptError:
+            await raw_client().script_load(script)
+            return await raw_client().evalsha(sha, numkeys, *keys_and_args)
+
+    def _keep_lock(self, key):
+        self._extender = asyncio.ensure_future(self._extend_lock(key))
+
+    def _drop_lock(self):
+        if self._extender is not None:
+            self._extender.cancel()
+            self._extender = None
+
+    async def _extend_lock(self, key):
+        """Keep the lock on the given key until cancelled.  If the lock can't
+        be extended, forget it, so releasing it raises UserWarning"""
+        while True:
+            await asyncio.sleep(self._lock_timeout - self._max_network_delay)
+            try:
+                rv = await self._evalsha(
+                    self._EXTEND_LOCK_SCRIPT_NAME, key, self._client_id,
+                    int(time.time() + self._lock_timeout) + 1)
+            except redis.exceptions.RedisError as err:
+                rv = err
+            if rv != 1:
+                log.error("Failed to extend lock", extra=dict(
+                    path=key, redis_msg=rv))
+                self._extender = None
+                return
+
+
+class LockingQueue(BaseStolosRedis):
+    _EXTEND_LOCK_SCRIPT_NAME = 'lq_extend_lock'
+    SCRIPTS = qbcli_redis.LockingQueue.SCRIPTS
+    _score = qbcli_redis.LockingQueue._score
+
+    def __init__(self, path):
+        super(LockingQueue, self).__init__(path)
+        self._q_lookup = ".%s" % path
+        self._q_delayed = "..%s" % path
+        self._priority_aging = get_NS().qb_redis_priority_aging
+
+        self._item = None
+        self._h_k = None
+
+    async def put(self, value, priority=100, delay=0):
+        """Add item onto queue.
+        Rank items by priority.  Get low priority items before high priority
+        If given a `delay` in seconds, hide the item from get() until it's due
+        """
+        not_before = time.time() + delay
+        h_k = "%d:%f:%s" % (priority, not_before, value)
+        if delay > 0:
+            rv = await self._evalsha(
+                'lq_put_delayed', self._q_delayed, h_k, not_before)
+        else:
+            rv = await self._evalsha(
+                'lq_put', self._path, h_k,
+                self._score(priority, not_before))
+        assert rv == 1
+
+    async def consume(self):
+        """Consume value gotten from queue.
+        Raise exceptions.NotTaken if consume() called before get()
+        """
+        if self._item is None:
+            raise stolos.exceptions.NotTaken(
+                "Must call get() before consume()")
+        self._drop_lock()
+        rv = await self._evalsha(
+            'lq_consume', self._h_k, self._path, self._q_lookup,
+            self._client_id)
+        assert rv == 1
+        self._h_k = None
+        self._item = None
+
+    async def requeue(self, priority=None, delay=0):
+        """Atomically move the value gotten from queue to the back of the queue
+        and unlock it.  The value keeps its priority unless given `priority`.
+        If given a `delay` in seconds, hide the item from get() until it's due
+        Raise exceptions.NotTaken if requeue() called before get()
+        """
+        if self._item is None:
+            raise stolos.exceptions.NotTaken(
+                "Must call get() before requeue()")
+        if priority is None:
+            priority = int(self._h_k.decode().split(':', 1)[0])
+        not_before = time.time() + delay
+        h_k = "%d:%f:%s" % (priority, not_before, self._item)
+        self._drop_lock()
+        rv = await self._evalsha(
+            'lq_requeue', self._h_k, self._path, h_k, self._q_delayed,
+            self._client_id, not_before if delay > 0 else 0,
+            self._score(priority, not_before))
+        assert rv == 1
+        self._h_k = None
+        self._item = None
+
+    async def get(self, timeout=None):
+        """Get an item from the queue or return None.  Do not block forever."""
+        if self._item is not None:
+            return self._item
+        expire_at = int(time.time() + self._lock_timeout)
+        try:
+            self._h_k = await asyncio.wait_for(self._evalsha(
+                'lq_get', self._path, self._q_delayed, self._client_id,
+                expire_at, time.time(), self._priority_aging), timeout)
+        except redis.exceptions.ResponseError as err:
+            if str(err) not in ['queue empty', 'already locked']:
+                raise err
+        except asyncio.TimeoutError:
+            pass
+        if self._h_k:
+            priority, insert_time, item = self._h_k.decode().split(':', 2)
+            self._item = item
+            self._keep_lock(self._h_k)
+            return self._item
+
+    async def size(self, queued=True, taken=True):
+        """
+        Find the number of jobs in the queue
+
+        `queued` - Include the entries in the queue that are not currently
+            being processed or otherwise locked
+        `taken` - Include the entries in the queue that are currently being
+            processed or are otherwise locked
+
+        Raise AttributeError if all kwargs are False
+        """
+        if not queued and not taken:
+            raise AttributeError("either `taken` or `queued` must be True")
+        if taken and queued:
+            n_queued_and_taken, _ = await self._evalsha(
+                'lq_qsize_fast', self._path, self._q_lookup, self._q_delayed)
+            return n_queued_and_taken
+        nqueued, ntaken, _ = await self._evalsha(
+            'lq_qsize_slow', self._path, self._q_lookup, self._q_delayed)
+        return nqueued if queued else ntaken
+
+    async def is_queued(self, value):
+        """
+        Return True if item is in queue or currently being processed.
+        False otherwise
+
+        Redis will not like this operation.  Use sparingly with large queues.
+        """
+        if value == self._item:
+            taken, queued, completed = await self._evalsha(
+                'lq_is_queued_h_k', self._path, self._h_k)
+        else:
+            taken, queued, completed = await self._evalsha(
+                'lq_is_queued_item', self._path, value, self._q_delayed)
+        return bool(taken or queued)
+
+
+class Lock(BaseStolosRedis):
+    _EXTEND_LOCK_SCRIPT_NAME = 'l_extend_lock'
+    SCRIPTS = qbcli_redis.Lock.SCRIPTS
+
+    async def acquire(self, blocking=False, timeout=None):
+        """
+        Acquire a lock at the Lock's path.
+        Return True if acquired, False otherwise
+
+        `blocking` (bool) If False, return immediately if we got lock.
+            If True, wait up to `timeout` seconds to acquire a lock
+        `timeout` (int) number of seconds.  By default, wait indefinitely
+        """
+        expireat = int(time.time() + self._lock_timeout)
+        try:
+            acquired = 1 == await asyncio.wait_for(self._evalsha(
+                'l_lock', self._path, self._client_id, expireat),
+                timeout if blocking else None)
+        except asyncio.TimeoutError:
+            acquired = False
+        if acquired:
+            self._keep_lock(self._path)
+        return acquired
+
+    async def release(self):
+        """
+        Release a lock at the Lock's path.
+        Return True if success.  Raise UserWarning otherwise, possibly due to:
+            - did not release a lock
+            - lock already released
+            - lock does not exist (perhaps it was never acquired)
+        """
+        if self._extender is None:
+            raise UserWarning("You must acquire lock before releasing it")
+        self._drop_lock()
+        try:
+            rv = await self._evalsha('l_unlock', self._path, self._client_id)
+            assert rv == 1
+        except AssertionError:
+            raise UserWarning("Lock did not exist on Redis server")
+        except Exception as err:
+            msg = "Could not release lock.  Got error: %s" % err
+            log.error(msg, extra=dict(lock_path=self._path))
+            raise UserWarning(msg)
+
+    async def is_locked(self):
+        """
+        Return True if path is currently locked by anyone, and False otherwise
+        """
+        return bool(await raw_client().exists(self._path))
+
+
+def _decode(value):
+    if value is not None:
+        value = value.decode()
+        if value == '--STOLOSEMPTYSTRING--':
+            value = ''
+    return value
+
+
+async def get(path):
+    """Get value at given path.
+    If path does not exist, throw stolos.exceptions.NoNodeError
+    """
+    rv = await raw_client().get(path)
+    if rv is None:
+        raise stolos.exceptions.NoNodeError(path)
+    return _decode(rv)
+
+
+async def get_many(paths):
+    """Get values at the given paths in as few round trips as possible.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    n = qbcli_redis._SCAN_COUNT
+    batches = await asyncio.gather(*[
+        raw_client().mget(paths[i:i + n]) for i in range(0, len(paths), n)])
+    return [_decode(val) for batch in batches for val in batch]
+
+
+async def exists(path):
+    """Return True if path exists (value can be ''), False otherwise"""
+    return bool(await raw_client().exists(path))
+
+
+async def delete(path, _recursive=False):
+    """Remove path from queue backend.
+
+    `_recursive` - This is only for tests
+    """
+    mr = raw_client()
+    if _recursive:
+        # For tests only
+        keys = await mr.keys('*%s*' % path)
+        if not keys:
+            return True
+        return await mr.delete(*keys) == len(keys)
+    else:
+        return await mr.delete(path)
+
+
+async def set(path, value):
+    """Set value at given path
+    If the path does not already exist, raise stolos.exceptions.NoNodeError
+    """
+    if value == '':
+        value = '--STOLOSEMPTYSTRING--'
+    if not await raw_client().set(path, value, xx=True):
+        raise stolos.exceptions.NoNodeError("Could not set path: %s" % path)
+
+
+async def create(path, value):
+    """Set value at given path.
+    If path already exists, raise stolos.exceptions.NodeExistsError
+    """
+    if value == '':
+        value = '--STOLOSEMPTYSTRING--'
+    if not await raw_client().set(path, value, nx=True):
+        raise stolos.exceptions.NodeExistsError(
+            "Could not create path: %s" % path)
+
+
+async def increment(path, value=1):
+    """Increment the counter at given path
+    Return the incremented count as an int
+    """
+    return await raw_client().incrby(path, value)
@@ -0,0 +1,104 @@
+"""
+The zookeeper queue backend (see qbcli_zookeeper) for asyncio.  See aio.
+
+Reads and writes use kazoo's async calls, wrapped in asyncio futures.
+Kazoo's lock, queue and counter recipes only block, so Lock, LockingQueue
+and increment run in the event loop's thread pool.
+"""
+import asyncio
+import functools
+
+from kazoo.exceptions import NoNodeError, NodeExistsError, NotEmptyError
+
+from stolos import exceptions
+from stolos import util
+from . import aio
+from . import qbcli_zookeeper
+from .qbcli_zookeeper import raw_client
+
+
+LockingQueue = functools.partial(
+    aio.ThreadedObject, qbcli_zookeeper.LockingQueue)
+Lock = functools.partial(aio.ThreadedObject, qbcli_zookeeper.Lock)
+
+
+def _copy_result(async_result, future):
+    if future.cancelled():
+        return
+    if async_result.successful():
+        future.set_result(async_result.value)
+    else:
+        future.set_exception(async_result.exception)
+
+
+def wrap(async_result):
+    """Return an asyncio future of the given kazoo IAsyncResult"""
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+    # kazoo calls back from its own thread
+    async_result.rawlink(
+        lambda rv: loop.call_soon_threadsafe(_copy_result, rv, future))
+    return future
+
+
+async def get(path):
+    try:
+        return util.frombytes((await wrap(raw_client().get_async(path)))[0])
+    except NoNodeError as err:
+        raise exceptions.NoNodeError("%s: %s" % (path, err))
+
+
+async def _get_or_none(path):
+    try:
+        return util.frombytes((await wrap(raw_client().get_async(path)))[0])
+    except NoNodeError:
+        return None
+
+
+async def get_many(paths):
+    """Get values at the given paths in as few round trips as possible.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    return await aio.gather(
+        (_get_or_none(p) for p in paths), limit=qbcli_zookeeper._BATCH_SIZE)
+
+
+async def exists(path):
+    return bool(await wrap(raw_client().exists_async(path)))
+
+
+async def delete(path, _recursive=False):
+    """Remove path from queue backend.
+
+    `_recursive` - This is only for tests
+    """
+    if _recursive:
+        return await aio.run_in_thread(qbcli_zookeeper.delete, path, True)
+    try:
+        await wrap(raw_client().delete_async(path))
+        return True
+    except (NoNodeError, NotEmptyError):
+        return False
+
+
+async def set(path, value):
+    try:
+        return await wrap(raw_client().set_async(path, util.tobytes(value)))
+    except NoNodeError as err:
+        raise exceptions.NoNodeError(
+            "Must first create node before setting a new value. %s" % err)
+
+
+async def create(path, value):
+    try:
+        return await wrap(raw_client().create_async(
+            path, util.tobytes(value), makepath=True))
+    except NodeExistsError as err:
+        raise exceptions.NodeExistsError("%s: %s" % (path, err))
+
+
+async def increment(path, value=1):
+    """Increment the counter at given path
+    Return the incremented count as an int
+    """
+    return await aio.run_in_thread(qbcli_zookeeper.increment, path, value)
@@ -0,0 +1,92 @@
+"""
+Code that queue backends share: aging the priority of queued items, and
+keeping alive the leases (ie locks and taken queue items) that a process
+holds in a backend with no server to notice that the process died.
+"""
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+
+from stolos import argparse_shared as at
+
+
+def priority_aging(backend_name):
+    """Add the --qb_<backend_name>_priority_aging option"""
+    return at.add_argument(
+        '--qb_%s_priority_aging' % backend_name, default=0, type=float, help=(
+            "Prevent starvation of low priority jobs by raising the priority"
+            " of queued jobs by 1 for every N seconds they wait in the queue."
+            "  By default, jobs do not age."))
+
+
+def aged_score(priority, insert_time, aging):
+    """Rank of an item in the queue.  If the queue ages its items, an item's
+    score is its priority less 1 unit for every `aging` seconds it has waited
+    in the queue.  Scores are relative, so they don't change as time passes"""
+    if not aging:
+        return priority
+    return priority + insert_time / aging
+
+
+class Leases(object):
+    """
+    The leases that this process holds in a queue backend.  Once the process
+    asks for a key, a background thread calls `extend(process_key, leases)`
+    every third of `lock_timeout()` seconds to push back the expiry of the
+    leases, so if the process dies, its leases expire.
+
+    `name` - the name of the background thread
+    `extend` - a function that receives this process's key and a list of the
+        leases that were given to hold()
+    `lock_timeout` - a function that returns the number of seconds a lease
+        lasts
+    """
+    def __init__(self, name, extend, lock_timeout):
+        self._name = name
+        self._extend = extend
+        self._lock_timeout = lock_timeout
+        self._process_key = None
+        self._leases = set()
+        self._mutex = threading.Lock()
+        self._seq = itertools.count()
+
+    def process_key(self):
+        """Return a key that identifies this process, and start extending
+        this process's leases.  A forked child gets a new key, and does not
+        extend the leases of its parent"""
+        pid = os.getpid()
+        if self._process_key is None or self._process_key[0] != pid:
+            self._process_key = (
+                pid, "%s.%s" % (pid, random.randint(0, sys.maxsize)))
+            self._leases = set()
+            self._mutex = threading.Lock()
+            t = threading.Thread(
+                name="%s Extender" % self._name,
+                target=self._extend_leases, args=(self._process_key[1], ))
+            t.daemon = True
+            t.start()
+        return self._process_key[1]
+
+    def unique(self):
+        """Return a name that's unique across processes and time.  It starts
+        with this process's key"""
+        return "%s.%s" % (self.process_key(), next(self._seq))
+
+    def hold(self, lease):
+        with self._mutex:
+            self._leases.add(lease)
+
+    def release(self, lease):
+        with self._mutex:
+            self._leases.discard(lease)
+
+    def _extend_leases(self, process_key):
+        lock_timeout = self._lock_timeout()
+        while self._process_key[1] == process_key:
+            time.sleep(lock_timeout / 3.)
+            with self._mutex:
+                leases = list(self._leases)
+            self._extend(process_key, leases)
@@ -0,0 +1,153 @@
+"""
+Estimate when a job will complete, given how long jobs took in the past.
+
+A job can't start until its parents complete, so it completes at the
+earliest after the slowest chain of incomplete ancestors (its critical path)
+has run.  The jobs on that path are the stragglers to prioritize.
+
+For each incomplete job, `finish(job) = duration(job) + max(finish(parent))`
+over its incomplete parents.  `analyze` expands the graph of jobs from the
+targets to their incomplete ancestors, reading job states from the queue
+backend in batches, and computes finish for every job once, so the cost is
+linear in the num jobs.  It is iterative, so deep graphs are fine.
+
+Durations are recorded as jobs complete (see status.record_duration).  A job
+that never ran is assumed to take as long as its app's jobs took on average.
+The estimate assumes every runnable job runs immediately, so it is a lower
+bound.
+"""
+import itertools
+import time
+
+from stolos import dag_tools as dt
+from . import shared
+from . import status
+
+
+# states of jobs that won't run (again)
+_DONE = (shared.COMPLETED, shared.SKIPPED)
+
+
+def _batches(seq, batch_size):
+    it = iter(seq)
+    while True:
+        batch = list(itertools.islice(it, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _get_app_durations(app_names, batch_size):
+    """Return {app_name: mean seconds per job, or None if never recorded}"""
+    qbcli = shared.get_qbclient()
+    rv = {}
+    for batch in _batches(app_names, batch_size // 2 or 1):
+        values = qbcli.get_many([
+            status.get_counter_path(app_name, name)
+            for app_name in batch
+            for name in ('duration_ms', 'num_durations')])
+        for app_name, total, count in zip(batch, values[::2], values[1::2]):
+            count = int(count or 0)
+            rv[app_name] = int(total or 0) / 1000. / count if count else None
+    return rv
+
+
+def _get_jobs(nodes, batch_size):
+    """Return {(app_name, job_id): (state, recorded seconds)}"""
+    qbcli = shared.get_qbclient()
+    rv = {}
+    for batch in _batches(nodes, batch_size // 2 or 1):
+        values = qbcli.get_many([
+            path for app_name, job_id in batch for path in (
+                shared.get_job_path(app_name, job_id),
+                status.get_duration_path(app_name, job_id))])
+        for node, state, seconds in zip(batch, values[::2], values[1::2]):
+            rv[node] = (state, float(seconds) if seconds else None)
+    return rv
+
+
+def analyze(targets, default_duration=0, batch_size=1000):
+    """Compute when each of the given (app_name, job_id) targets, and every
+    incomplete job they depend on, will complete.
+
+    Return {(app_name, job_id): dict(finish, duration, state, parent)} where
+        `finish` - num seconds from now until the job completes
+        `duration` - num seconds the job is expected to run
+        `state` - the job's state, or None if it doesn't exist yet
+        `parent` - the incomplete parent that completes last, if any.  This
+            is the next job on the critical path
+    Completed (or skipped) jobs are left out, as they are finished.
+
+    `default_duration` - num seconds that jobs of apps without recorded
+        durations are expected to take
+    `batch_size` - max num paths to read from the queue backend at a time
+    """
+    targets = [tuple(x) for x in targets]
+    jobs = {}
+    parents = {}
+    app_durations = {}
+    frontier = targets
+    # expand the graph one level of ancestors at a time, so job states are
+    # read in batches and completed jobs aren't expanded
+    while frontier:
+        frontier = list(set(x for x in frontier if x not in jobs))
+        jobs.update(_get_jobs(frontier, batch_size))
+        app_durations.update(_get_app_durations(
+            set(x[0] for x in frontier).difference(app_durations),
+            batch_size))
+        nxt = []
+        for node in frontier:
+            if jobs[node][0] in _DONE:
+                continue
+            parents[node] = [tuple(x) for x in dt.get_parents(*node)]
+            nxt.extend(x for x in parents[node] if x not in jobs)
+        frontier = nxt
+
+    rv = {}
+    for target in targets:
+        stack = [(target, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node in rv or node not in parents:
+                continue
+            if not expanded:
+                stack.append((node, True))
+                stack.extend((x, False) for x in parents[node]
+                             if x not in rv and x in parents)
+                continue
+            parent, finish = None, 0
+            for x in parents[node]:
+                if x in rv and rv[x]['finish'] > finish:
+                    parent, finish = x, rv[x]['finish']
+            state, duration = jobs[node]
+            if duration is None:
+                duration = app_durations.get(node[0])
+            if duration is None:
+                duration = default_duration
+            rv[node] = dict(
+                finish=finish + duration, duration=duration, state=state,
+                parent=parent)
+    return rv
+
+
+def get_eta(app_name, job_id, default_duration=0, batch_size=1000):
+    """Estimate when the given job will complete.  Return a dict:
+        `seconds` - num seconds from now until it completes (0 if it has)
+        `eta` - unix timestamp of when it completes
+        `critical_path` - list of (app_name, job_id, expected seconds) of
+            the jobs that must run one after the other, first job first
+        `num_jobs` - num incomplete jobs the job depends on, including itself
+    """
+    rv = analyze(
+        [(app_name, job_id)], default_duration=default_duration,
+        batch_size=batch_size)
+    path = []
+    node = (app_name, job_id)
+    while node is not None and node in rv:
+        path.append(node + (rv[node]['duration'], ))
+        node = rv[node]['parent']
+    path.reverse()
+    seconds = rv[(app_name, job_id)]['finish'] if path else 0
+    return dict(
+        seconds=seconds, eta=time.time() + seconds, critical_path=path,
+        num_jobs=len(rv))
@@ -1,3 +1,4 @@
+import logging
 from os.path import join
 import six
 
@@ -8,6 +9,7 @@ from stolos import exceptions
 from .locking import obtain_add_lock, obtain_execute_lock
 from .read_job_state import check_state, validate_state
 from . import shared
+from . import status
 from . import log
 
 
@@ -22,9 +24,11 @@ def _queue(app_name, job_id, queue=True, priority=None):
         # hack: zookeeper doesn't like unicode
         if isinstance(job_id, six.string_types):
             job_id = str(job_id)
+        _reset_requeue_count(app_name, job_id)
         set_state(app_name, job_id, pending=True)
         if queue:
             if priority:
+                _set_priority(app_name, job_id, priority)
                 qbcli.LockingQueue(app_name).put(job_id, priority=priority)
             else:
                 qbcli.LockingQueue(app_name).put(job_id)
@@ -86,9 +90,39 @@ def _recursively_reset_child_task_state(parent_app_name, job_id, so_far=None):
             pass  # no need to recurse further down the tree
 
 
+def _path_priority(app_name, job_id):
+    return shared.get_job_path(app_name, job_id, 'priority')
+
+
+def _set_priority(app_name, job_id, priority):
+    """Remember the priority a job was queued with so its children can
+    inherit it"""
+    qbcli = shared.get_qbclient()
+    path = _path_priority(app_name, job_id)
+    try:
+        qbcli.create(path, str(priority))
+    except exceptions.NodeExistsError:
+        qbcli.set(path, str(priority))
+
+
+def _get_inherited_priority(parents):
+    """Return the most urgent (ie lowest) priority that any of the given
+    (app_name, job_id) parents were queued with, or None"""
+    qbcli = shared.get_qbclient()
+    priorities = []
+    for parent_app_name, pjob_id in parents:
+        try:
+            priorities.append(
+                int(qbcli.get(_path_priority(parent_app_name, pjob_id))))
+        except exceptions.NoNodeError:
+            pass
+    return min(priorities) if priorities else None
+
+
 @util.pre_condition(dt.parse_job_id)
 def readd_subtask(app_name, job_id, _force=False,
-                  _reset_descendants=True, _ignore_if_queued=False):
+                  _reset_descendants=True, _ignore_if_queued=False,
+                  priority=None):
     """
     Queue a new task if it isn't already in the queue.
 
@@ -102,6 +136,8 @@ def readd_subtask(app_name, job_id, _force=False,
     `_ignore_if_queued` (bool)  If the job_id is previously queued,
         don't re-queue it, but possibly _reset_descendants.
         If False, just raise an error
+    `priority` (int, optional) - prioritize this item in the queue.
+        1 is highest priority 100 is lowest priority.
 
     In an atomic transaction (ie atomic to this job_id),
     First, validate that the job isn't already queued.
@@ -126,7 +162,7 @@ def readd_subtask(app_name, job_id, _force=False,
                 app_name, job_id, blocking=False, raise_on_error=True)
     except exceptions.CouldNotObtainLock:
         # call maybe_add_subtask(...) and return
-        added = maybe_add_subtask(app_name, job_id)
+        added = maybe_add_subtask(app_name, job_id, priority=priority)
         if not added:
             raise exceptions.CodeError(
                 "wtf?  If I can't obtain a lock on a job_id, then I should"
@@ -163,7 +199,7 @@ def readd_subtask(app_name, job_id, _force=False,
             _recursively_reset_child_task_state(app_name, job_id)
 
         if not queued:
-            _queue(app_name, job_id)
+            _queue(app_name, job_id, priority=priority)
     finally:
         lock.release()
     return True
@@ -181,22 +217,29 @@ def _maybe_queue_children(parent_app_name, parent_job_id):
 
     We track the "score" of a child by counting files in the job path:
         .../parents/dependency_name/parent_app_name/parent_job_id
+
+    A queued child inherits the most urgent priority of its parents
     """
     qbcli = shared.get_qbclient()
+    # a parent may have many children.  Don't build log details for
+    # messages that won't be logged
+    log_info = log.isEnabledFor(logging.INFO)
     gen = dt.get_children(parent_app_name, parent_job_id, True)
     for child_app_name, cjob_id, dep_grp in gen:
-        ld = dict(
-            child_app_name=child_app_name,
-            child_job_id=cjob_id,
-            app_name=parent_app_name,
-            job_id=parent_job_id)
-        ptotal = len(list(dt.get_parents(child_app_name, cjob_id)))
+        parents = list(dt.get_parents(child_app_name, cjob_id))
+        ptotal = len(parents)
         pcomplete = qbcli.increment(
             _path_num_complete_parents(child_app_name, cjob_id))
 
         if (pcomplete >= ptotal):
-            log.info(
-                "Parent is queuing a child task", extra=ld)
+            ld = dict(
+                child_app_name=child_app_name,
+                child_job_id=cjob_id,
+                app_name=parent_app_name,
+                job_id=parent_job_id)
+            if log_info:
+                log.info(
+                    "Parent is queuing a child task", extra=ld)
             if pcomplete > ptotal:
                 log.warn(
                     "For some reason, I calculated that more parents"
@@ -206,6 +249,8 @@ def _maybe_queue_children(parent_app_name, parent_job_id):
                     extra=dict(
                         num_complete_dependencies=pcomplete,
                         num_total_dependencies=ptotal, **ld))
+            # the child may have parked itself to wait on its parents
+            _unblock_subtask(child_app_name, cjob_id)
             if check_state(child_app_name, cjob_id, completed=True):
                 log.warn(
                     "Queuing a previously completed child task"
@@ -221,16 +266,19 @@ def _maybe_queue_children(parent_app_name, parent_job_id):
                 readd_subtask(
                     child_app_name, cjob_id,
                     _reset_descendants=False,  # descendants previously handled
-                    _ignore_if_queued=True)
+                    _ignore_if_queued=True,
+                    priority=_get_inherited_priority(parents))
             except exceptions.JobAlreadyQueued:
                 log.info("Child already in queue", extra=dict(**ld))
                 raise
-        elif (pcomplete < ptotal):
+        elif log_info:
             log.info(
                 "Child job one step closer to being queued!",
                 extra=dict(
                     num_complete_dependencies=pcomplete,
-                    num_total_dependencies=ptotal, **ld))
+                    num_total_dependencies=ptotal,
+                    child_app_name=child_app_name, child_job_id=cjob_id,
+                    app_name=parent_app_name, job_id=parent_job_id))
 
 
 def _path_num_complete_parents(app_name, job_id, value=1):
@@ -238,6 +286,79 @@ def _path_num_complete_parents(app_name, job_id, value=1):
         app_name, job_id, 'num_complete_parents')
 
 
+def _get_num_complete_parents(app_name, job_id):
+    qbcli = shared.get_qbclient()
+    try:
+        return int(qbcli.get(_path_num_complete_parents(app_name, job_id)))
+    except exceptions.NoNodeError:
+        return 0
+
+
+def _path_blocked(app_name, job_id):
+    return shared.get_job_path(app_name, job_id, 'blocked')
+
+
+def block_subtask(app_name, job_id):
+    """Mark a job as blocked, meaning it was removed from its queue to wait
+    on its parents.  The last parent to complete will queue it again."""
+    qbcli = shared.get_qbclient()
+    try:
+        qbcli.create(_path_blocked(app_name, job_id), '')
+    except exceptions.NodeExistsError:
+        pass
+    else:
+        status.update_blocked_counter(app_name, 1)
+
+
+def _unblock_subtask(app_name, job_id):
+    removed = shared.get_qbclient().delete(_path_blocked(app_name, job_id))
+    if removed:
+        status.update_blocked_counter(app_name, -1)
+    return removed
+
+
+@util.pre_condition(dt.parse_job_id)
+def park_subtask(app_name, job_id, q):
+    """
+    Assume that given job_id was pulled from the app_name's queue, `q`, and
+    that its parents have not completed.
+
+    Rather than cycle the job through its queue until the parents complete,
+    remove it from the queue and mark it as blocked.  The parent that
+    completes last will queue it again (see _maybe_queue_children).
+
+    Return True if the job was parked.  Return False if it isn't safe to park
+    the job, in which case the calling code should requeue it.
+    """
+    ptotal = len(list(dt.get_parents(app_name, job_id)))
+    if _get_num_complete_parents(app_name, job_id) >= ptotal:
+        # The counter says all parents completed, but they haven't.  ie. a
+        # parent may have been re-added.  We can't know who will wake us up.
+        return False
+    block_subtask(app_name, job_id)
+    q.consume()
+
+    # A parent may have completed after we checked its state but before we
+    # left the queue.  That parent didn't queue us because we were still
+    # queued, so we need to wake ourselves up.
+    if _get_num_complete_parents(app_name, job_id) >= ptotal:
+        _unblock_subtask(app_name, job_id)
+        try:
+            readd_subtask(
+                app_name, job_id,
+                _reset_descendants=False, _ignore_if_queued=True)
+        except exceptions.LockAlreadyAcquired:
+            pass  # the parent is queueing us right now
+        log.info(
+            "A parent completed while parking the job. Requeued the job.",
+            extra=dict(app_name=app_name, job_id=job_id))
+    else:
+        log.info(
+            "Parked the job until its parents complete",
+            extra=dict(app_name=app_name, job_id=job_id))
+    return True
+
+
 def _set_state_unsafe(
         app_name, job_id,
         pending=False, completed=False, failed=False, skipped=False,
@@ -257,10 +378,16 @@ def _set_state_unsafe(
             _maybe_queue_children(
                 parent_app_name=app_name, parent_job_id=job_id)
 
-    if qbcli.exists(job_path):
-        qbcli.set(job_path, state)
-    else:
+    try:
+        old_state = qbcli.get(job_path)
+    except exceptions.NoNodeError:
+        old_state = None
         qbcli.create(job_path, state)
+    else:
+        qbcli.set(job_path, state)
+    status.update_state_counters(app_name, old_state, state)
+    if completed or failed or skipped:
+        _reset_requeue_count(app_name, job_id)
 
     log.debug(
         "Set task state",
@@ -270,6 +397,38 @@ set_state = util.pre_condition(dt.parse_job_id)(
     _set_state_unsafe)
 
 
+def _path_retry_count(app_name, job_id):
+    return join(shared.get_job_path(app_name, job_id), 'retry_count')
+
+
+@util.pre_condition(dt.parse_job_id)
+def get_retry_count(app_name, job_id):
+    """Return the number of times the given task has failed"""
+    try:
+        return int(shared.get_qbclient().get(
+            _path_retry_count(app_name, job_id)))
+    except exceptions.NoNodeError:
+        return 0
+
+
+def _path_requeue_count(app_name, job_id):
+    return join(shared.get_job_path(app_name, job_id), 'requeue_count')
+
+
+@util.pre_condition(dt.parse_job_id)
+def inc_requeue_count(app_name, job_id):
+    """Increment the number of times the given task was sent to the back of
+    its queue because it could not run yet.  Return the incremented count"""
+    return shared.get_qbclient().increment(
+        _path_requeue_count(app_name, job_id))
+
+
+def _reset_requeue_count(app_name, job_id):
+    """Forget how many times the task was sent to the back of its queue, so
+    the next time it can't run, it waits the shortest delay again"""
+    shared.get_qbclient().delete(_path_requeue_count(app_name, job_id))
+
+
 @util.pre_condition(dt.parse_job_id)
 def inc_retry_count(app_name, job_id, max_retry):
     """Increment the retry count for the given task.  If the retry count is
@@ -280,7 +439,7 @@ def inc_retry_count(app_name, job_id, max_retry):
     fine
     """
     qbcli = shared.get_qbclient()
-    path = join(shared.get_job_path(app_name, job_id), 'retry_count')
+    path = _path_retry_count(app_name, job_id)
     if not qbcli.exists(path):
         qbcli.create(path, '0')
         cnt = 0
@@ -333,8 +492,9 @@ def ensure_parents_completed(app_name, job_id):
         # The question at this point is whether to requeue myself or assume the
         # parent will.
 
-        # Assume the default is I requeue myself.  Sometimes, this might result
-        # in me cycling through the queue a couple times until parent finishes.
+        # Assume the default is I park myself (see park_subtask) or requeue
+        # myself if I can't park.  Requeueing might result in me cycling
+        # through the queue a couple times until parent finishes.
 
         # If parent is running, it will be able to requeue me if I exit in
         # time.  If it doesn't, either I'll requeue myself by default or
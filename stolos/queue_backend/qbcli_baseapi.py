@@ -5,16 +5,18 @@ class LockingQueue(object):
     def __init__(self, path):
         raise NotImplemented()
 
-    def put(self, value, priority=100):
+    def put(self, value, priority=100, delay=0):
         """Add item onto queue.
         Rank items by priority.  Get low priority items before high priority
+        If given a `delay` in seconds, hide the item from get() until it's due
         """
         # TODO: Return values?
         raise NotImplemented()
 
     def consume(self):
         """Consume value gotten from queue.
-        Raise UserWarning if consume() called before get()
+        Raise exceptions.NotTaken (a UserWarning) if consume() called before
+        get()
         """
         raise NotImplemented()
 
@@ -22,6 +24,15 @@ class LockingQueue(object):
         """Get an item from the queue or return None.  Do not block forever."""
         raise NotImplemented()
 
+    def requeue(self, priority=None, delay=0):
+        """Atomically move the value gotten from queue to the back of the queue
+        and unlock it.  The value keeps its priority unless given `priority`.
+        If given a `delay` in seconds, hide the item from get() until it's due
+        Raise exceptions.NotTaken (a UserWarning) if requeue() called before
+        get()
+        """
+        raise NotImplemented()
+
     def size(self, queued=True, taken=True):
         """
         Find the number of jobs in the queue
@@ -42,6 +53,13 @@ class LockingQueue(object):
         """
         raise NotImplemented()
 
+    def iter_items(self):
+        """
+        Yield (value, is_taken) for every item in the queue, including delayed
+        items, in no particular order
+        """
+        raise NotImplemented()
+
 
 class Lock(object):
     def __init__(self, path):
@@ -84,6 +102,27 @@ def get(path):
     raise NotImplementedError()
 
 
+def get_many(paths):
+    """Get values at the given paths in as few round trips as possible.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    raise NotImplementedError()
+
+
+def is_locked_many(paths):
+    """Return a list of whether the Lock at each of the given paths is
+    currently locked by anyone, in as few round trips as possible
+    """
+    raise NotImplementedError()
+
+
+def iter_children(path):
+    """Yield names of the nodes directly beneath the given path, in no
+    particular order.  A name may rarely be yielded twice.
+    """
+    raise NotImplementedError()
+
+
 def exists(path):
     """Return True if path exists (value can be ''), False otherwise"""
     raise NotImplementedError()
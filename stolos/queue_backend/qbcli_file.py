@@ -0,0 +1,568 @@
+"""
+A queue backend stored in a local directory.  Processes on one host share
+state through the filesystem, so Stolos can run without any daemons.
+
+Each path is a directory beneath --qb_file_dir:
+
+    <path>/.value - the node's value
+    <path>/.queue/ - one file per queued item, named so that they sort by
+        score (priority, possibly aged) and then by time of insertion
+    <path>/.delayed/ - one file per delayed item, named so that they sort by
+        the time they are due
+    (names of queued and delayed items include a hash of the item, so
+    is_queued() only lists directories)
+    <path>/.taken/ - queued items that a consumer got, named like the entry
+        in .queue/ followed by @<owner>
+    <path>/.lock - an exclusive lock, containing the name of its owner
+
+Every change is a rename, an exclusive create or a file lock, so it's atomic.
+Locks and taken queue items are leases: a background thread in each process
+touches the files it holds, and another process may take over a file that
+wasn't touched for --qb_file_lock_timeout seconds.
+"""
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import time
+
+import six
+
+from stolos import log
+from stolos import get_NS
+from stolos import argparse_shared as at
+from stolos import util
+from stolos import exceptions
+from .backend_tools import Leases, aged_score, priority_aging
+from .qbcli_baseapi import Lock as BaseLock, LockingQueue as BaseLockingQueue
+
+
+_VALUE = '.value'
+_QUEUE = '.queue'
+_DELAYED = '.delayed'
+_TAKEN = '.taken'
+_LOCK = '.lock'
+_LOCK_GUARD = '.lock.guard'
+_COUNTER_GUARD = '.increment'
+
+
+def _dir(path):
+    return os.path.join(get_NS().qb_file_dir, path)
+
+
+def _makedirs(dirpath):
+    try:
+        os.makedirs(dirpath)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+def _listdir(dirpath):
+    try:
+        return os.listdir(dirpath)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return []
+
+
+def _read(fp):
+    """Return the file's contents or None if it doesn't exist"""
+    try:
+        with open(fp, 'rb') as fin:
+            return util.frombytes(fin.read())
+    except IOError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+
+def _write_tmp(dirpath, value):
+    """Write value to a new temporary file in dirpath and return its path"""
+    _makedirs(dirpath)
+    fp = os.path.join(dirpath, '.tmp-%s' % _LEASES.unique())
+    with open(fp, 'wb') as fout:
+        fout.write(util.tobytes(
+            value if isinstance(value, bytes) else six.text_type(value)))
+    return fp
+
+
+def _extend_leases(process_key, leases):
+    """Touch the lock and taken files this process holds"""
+    for fp in leases:
+        try:
+            os.utime(fp, None)
+        except OSError:
+            log.warn("File queue backend lost a lease", extra=dict(
+                lease_path=fp))
+            _LEASES.release(fp)
+
+
+_LEASES = Leases(
+    "stolos.queue_backend.qbcli_file", _extend_leases,
+    lambda: get_NS().qb_file_lock_timeout)
+
+
+def _expire_leases(path):
+    """Pretend that the owners of all locks and taken items at or beneath
+    the given path died.  This is only for tests"""
+    past = time.time() - get_NS().qb_file_lock_timeout - 1
+    for dirpath, _, names in os.walk(_dir(path)):
+        for name in names:
+            if name == _LOCK or os.path.basename(dirpath) == _TAKEN:
+                os.utime(os.path.join(dirpath, name), (past, past))
+
+
+def _is_expired(fp, now=None):
+    """Return True if the lease file wasn't touched recently.
+    Return None if it doesn't exist"""
+    try:
+        mtime = os.stat(fp).st_mtime
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return None
+    return mtime < (now or time.time()) - get_NS().qb_file_lock_timeout
+
+
+def _rename(src, dst):
+    """Atomically move src to dst.  Return False if src no longer exists,
+    probably because another process moved it first"""
+    try:
+        os.rename(src, dst)
+        return True
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return False
+
+
+def _entry_name(priority, insert_time, digest):
+    """Entries are named like:
+        <score>-<insert_time>-<priority>-<digest>-<unique>
+    See backend_tools.aged_score"""
+    score = aged_score(
+        priority, insert_time, get_NS().qb_file_priority_aging)
+    return "%024.6f-%017.6f-%d-%s-%s" % (
+        score, insert_time, priority, digest, _LEASES.unique())
+
+
+def _delayed_name(priority, not_before, digest):
+    return "%017.6f-%d-%s-%s" % (
+        not_before, priority, digest, _LEASES.unique())
+
+
+def _digest(value):
+    return hashlib.sha1(util.tobytes(
+        value if isinstance(value, bytes) else six.text_type(value))
+    ).hexdigest()
+
+
+def _name_digest(name):
+    """Return the digest in the name of a queued, delayed or taken entry,
+    or None if it was named by an older version of Stolos"""
+    digest = name.split('@', 1)[0].split('-')[-2]
+    return digest if len(digest) == 40 else None
+
+
+class LockingQueue(BaseLockingQueue):
+    def __init__(self, path):
+        self._path = path
+        self._dir = _dir(path)
+        self._taken_fp = None
+        self._item = None
+        self._entries = []  # cached names of queued entries, last is next
+        self._listed_at = 0
+
+    def _subdir(self, name):
+        return os.path.join(self._dir, name)
+
+    def _enqueue(self, src, priority, delay, digest):
+        """Atomically move the file at src into the queue"""
+        if digest is None:
+            digest = _digest(_read(src) or '')
+        now = time.time()
+        if delay > 0:
+            dirpath = self._subdir(_DELAYED)
+            name = _delayed_name(priority, now + delay, digest)
+        else:
+            dirpath = self._subdir(_QUEUE)
+            name = _entry_name(priority, now, digest)
+        _makedirs(dirpath)
+        self._listed_at = 0  # the cached listing is out of date
+        return _rename(src, os.path.join(dirpath, name))
+
+    def put(self, value, priority=100, delay=0):
+        """Add item onto queue.
+        Rank items by priority.  Get low priority items before high priority
+        If given a `delay` in seconds, hide the item from get() until it's due
+        """
+        self._enqueue(
+            _write_tmp(self._dir, value), priority, delay, _digest(value))
+
+    def consume(self):
+        """Consume value gotten from queue.
+        Raise exceptions.NotTaken if consume() called before get()
+        """
+        if self._item is None:
+            raise exceptions.NotTaken("Must call get() before consume()")
+        _LEASES.release(self._taken_fp)
+        try:
+            os.remove(self._taken_fp)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            log.warn(
+                "Consumed a queue item whose lease had expired",
+                extra=dict(queue_path=self._path, item=self._item))
+        self._taken_fp = self._item = None
+
+    def requeue(self, priority=None, delay=0):
+        """Atomically move the value gotten from queue to the back of the queue
+        and unlock it.  The value keeps its priority unless given `priority`.
+        If given a `delay` in seconds, hide the item from get() until it's due
+        Raise exceptions.NotTaken if requeue() called before get()
+        """
+        if self._item is None:
+            raise exceptions.NotTaken("Must call get() before requeue()")
+        if priority is None:
+            priority = int(os.path.basename(self._taken_fp).split('-')[2])
+        _LEASES.release(self._taken_fp)
+        if not self._enqueue(self._taken_fp, priority, delay, _name_digest(
+                os.path.basename(self._taken_fp))):
+            # the lease expired and another consumer has the item
+            log.warn(
+                "Requeued a queue item whose lease had expired",
+                extra=dict(queue_path=self._path, item=self._item))
+        self._taken_fp = self._item = None
+
+    def _promote_delayed(self):
+        """Move delayed entries that are due onto the queue"""
+        dirpath = self._subdir(_DELAYED)
+        now = time.time()
+        for name in sorted(_listdir(dirpath)):
+            not_before, priority, _ = name.split('-', 2)
+            if float(not_before) > now:
+                break
+            self._enqueue(
+                os.path.join(dirpath, name), int(priority), 0,
+                _name_digest(name))
+
+    def _reclaim_expired(self):
+        """Move taken entries whose owner died back onto the queue"""
+        dirpath = self._subdir(_TAKEN)
+        now = time.time()
+        for name in _listdir(dirpath):
+            fp = os.path.join(dirpath, name)
+            if _is_expired(fp, now) and _rename(fp, os.path.join(
+                    self._subdir(_QUEUE), name.rsplit('@', 1)[0])):
+                self._listed_at = 0
+
+    def _list_entries(self):
+        """Cache the names of queued entries, in the order we get them"""
+        self._entries = sorted(_listdir(self._subdir(_QUEUE)), reverse=True)
+        self._listed_at = time.time()
+
+    def _take_next(self):
+        """Take the first cached entry that no other consumer got first.
+        Return its path in .taken/ or None"""
+        qdir = self._subdir(_QUEUE)
+        tdir = self._subdir(_TAKEN)
+        if self._entries:
+            _makedirs(tdir)
+        while self._entries:
+            name = self._entries.pop()
+            src = os.path.join(qdir, name)
+            dst = os.path.join(tdir, '%s@%s' % (name, _LEASES.unique()))
+            try:
+                # start the lease before the item is visible as taken
+                os.utime(src, None)
+            except OSError:
+                continue  # another consumer got it
+            if _rename(src, dst):
+                return dst
+
+    def get(self, timeout=None):
+        """Get an item from the queue or return None.  Do not block forever.
+
+        Listing a large queue is slow, so a LockingQueue reuses the listing
+        for up to --qb_file_scan_interval seconds.  Until it lists again, it
+        doesn't see items that other processes put, unless it runs out of
+        items."""
+        if self._item is not None:
+            return self._item
+        self._promote_delayed()
+        self._reclaim_expired()
+        listed = time.time() - self._listed_at > \
+            get_NS().qb_file_scan_interval
+        if listed:
+            self._list_entries()
+        fp = self._take_next()
+        if fp is None and not listed:
+            self._list_entries()
+            fp = self._take_next()
+        if fp is None:
+            return
+        _LEASES.hold(fp)
+        self._taken_fp = fp
+        self._item = _read(fp)
+        return self._item
+
+    def size(self, queued=True, taken=True):
+        """
+        Find the number of jobs in the queue
+
+        `queued` - Include the entries in the queue that are not currently
+            being processed or otherwise locked
+        `taken` - Include the entries in the queue that are currently being
+            processed or are otherwise locked
+
+        Raise AttributeError if all kwargs are False
+        """
+        if not queued and not taken:
+            raise AttributeError("either `taken` or `queued` must be True")
+        n = 0
+        if queued:
+            n += len(_listdir(self._subdir(_QUEUE)))
+            n += len(_listdir(self._subdir(_DELAYED)))
+        if taken:
+            n += len(_listdir(self._subdir(_TAKEN)))
+        return n
+
+    def is_queued(self, value):
+        """
+        Return True if item is in queue or currently being processed.
+        False otherwise
+        """
+        value = util.frombytes(util.tobytes(value))
+        digest = _digest(value)
+        for subdir in [_QUEUE, _DELAYED, _TAKEN]:
+            dirpath = self._subdir(subdir)
+            for name in _listdir(dirpath):
+                name_digest = _name_digest(name)
+                if name_digest == digest:
+                    return True
+                if name_digest is None \
+                        and _read(os.path.join(dirpath, name)) == value:
+                    return True
+        return False
+
+    def iter_items(self):
+        """
+        Yield (value, is_taken) for every item in the queue, including delayed
+        items, in no particular order
+        """
+        for subdir in [_QUEUE, _DELAYED, _TAKEN]:
+            dirpath = self._subdir(subdir)
+            for name in _listdir(dirpath):
+                value = _read(os.path.join(dirpath, name))
+                if value is not None:
+                    yield (value, subdir == _TAKEN)
+
+
+class Lock(BaseLock):
+    # num seconds between attempts to acquire a lock held by someone else
+    _POLL_INTERVAL = .05
+
+    def __init__(self, path):
+        self._path = path
+        self._fp = os.path.join(_dir(path), _LOCK)
+        self._owner = _LEASES.unique()
+
+    def _create(self):
+        try:
+            fd = os.open(self._fp, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+            return False
+        try:
+            os.write(fd, util.tobytes(self._owner))
+        finally:
+            os.close(fd)
+        _LEASES.hold(self._fp)
+        return True
+
+    def _break_if_expired(self):
+        """Remove the lock if its owner died.  The guard file prevents two
+        processes from removing a lock that one of them just created"""
+        with open(os.path.join(_dir(self._path), _LOCK_GUARD), 'a') as guard:
+            fcntl.flock(guard, fcntl.LOCK_EX)
+            try:
+                if _is_expired(self._fp):
+                    os.remove(self._fp)
+            finally:
+                fcntl.flock(guard, fcntl.LOCK_UN)
+
+    def _acquire(self):
+        _makedirs(os.path.dirname(self._fp))
+        if self._create():
+            return True
+        if _read(self._fp) == self._owner:
+            os.utime(self._fp, None)
+            return True
+        self._break_if_expired()
+        return self._create()
+
+    def acquire(self, blocking=False, timeout=None):
+        """
+        Acquire a lock at the Lock's path.
+        Return True if acquired, False otherwise
+
+        `blocking` (bool) If False, return immediately if we got lock.
+            If True, wait up to `timeout` seconds to acquire a lock
+        `timeout` (int) number of seconds.  By default, wait indefinitely
+        """
+        if blocking and timeout is not None:
+            expire_at = time.time() + timeout
+        while not self._acquire():
+            if not blocking:
+                return False
+            if timeout is not None and time.time() >= expire_at:
+                return False
+            time.sleep(self._POLL_INTERVAL)
+        return True
+
+    def release(self):
+        """
+        Release a lock at the Lock's path.
+        Raise UserWarning if the lock isn't held by this Lock instance
+        """
+        if _read(self._fp) != self._owner:
+            raise UserWarning("You must acquire lock before releasing it")
+        _LEASES.release(self._fp)
+        os.remove(self._fp)
+
+    def is_locked(self):
+        """
+        Return True if path is currently locked by anyone, and False otherwise
+        """
+        return _is_expired(self._fp) is False
+
+
+def get(path):
+    """Get value at given path.
+    If path does not exist, throw stolos.exceptions.NoNodeError
+    """
+    rv = _read(os.path.join(_dir(path), _VALUE))
+    if rv is None:
+        raise exceptions.NoNodeError(path)
+    return rv
+
+
+def get_many(paths):
+    """Get values at the given paths.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    return [_read(os.path.join(_dir(path), _VALUE)) for path in paths]
+
+
+def is_locked_many(paths):
+    """Return a list of whether the Lock at each of the given paths is
+    currently locked by anyone
+    """
+    now = time.time()
+    return [
+        _is_expired(os.path.join(_dir(path), _LOCK), now) is False
+        for path in paths]
+
+
+def iter_children(path):
+    """Yield names of the nodes directly beneath the given path, in no
+    particular order.
+    """
+    dirpath = _dir(path)
+    for name in _listdir(dirpath):
+        if os.path.exists(os.path.join(dirpath, name, _VALUE)):
+            yield name
+
+
+def exists(path):
+    """Return True if path exists (value can be ''), False otherwise"""
+    return os.path.exists(os.path.join(_dir(path), _VALUE))
+
+
+def delete(path, _recursive=False):
+    """Remove path from queue backend.
+    Return True if anything was removed, False otherwise
+
+    `_recursive` - Also remove everything beneath the path.  For tests only
+    """
+    dirpath = _dir(path)
+    if _recursive:
+        if not os.path.isdir(dirpath):
+            return False
+        shutil.rmtree(dirpath, ignore_errors=True)
+        return True
+    try:
+        os.remove(os.path.join(dirpath, _VALUE))
+        return True
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+        return False
+
+
+def set(path, value):
+    """Set value at given path
+    If the path does not already exist, raise stolos.exceptions.NoNodeError
+    """
+    fp = os.path.join(_dir(path), _VALUE)
+    if not os.path.exists(fp):
+        raise exceptions.NoNodeError("Could not set path: %s" % path)
+    os.rename(_write_tmp(_dir(path), value), fp)
+
+
+def create(path, value):
+    """Set value at given path.
+    If path already exists, raise stolos.exceptions.NodeExistsError
+    """
+    tmp = _write_tmp(_dir(path), value)
+    try:
+        # unlike rename, link fails if the destination exists
+        os.link(tmp, os.path.join(_dir(path), _VALUE))
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+        raise exceptions.NodeExistsError("Could not create path: %s" % path)
+    finally:
+        os.remove(tmp)
+
+
+def increment(path, value=1):
+    """Increment the counter at given path
+    Return the incremented count as an int
+    """
+    dirpath = _dir(path)
+    _makedirs(dirpath)
+    with open(os.path.join(dirpath, _COUNTER_GUARD), 'a') as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX)
+        try:
+            rv = int(_read(os.path.join(dirpath, _VALUE)) or 0) + value
+            os.rename(
+                _write_tmp(dirpath, str(rv)), os.path.join(dirpath, _VALUE))
+        finally:
+            fcntl.flock(guard, fcntl.LOCK_UN)
+    return rv
+
+
+build_arg_parser = at.build_arg_parser([
+    at.add_argument(
+        '--qb_file_dir', default='stolos-queue', help=(
+            "Directory that stores job state.  Every Stolos process that"
+            " shares state must use the same directory on a local"
+            " filesystem")),
+    at.add_argument(
+        '--qb_file_lock_timeout', default=60, type=float, help=(
+            "Locks and taken queue items held by a process that died become"
+            " available after this many seconds")),
+    at.add_argument(
+        '--qb_file_scan_interval', default=1, type=float, help=(
+            "A process that gets many items from a queue lists the queue at"
+            " most once every N seconds, unless it runs out of items.  Lower"
+            " values respect the priority of newly queued items sooner but"
+            " make large queues slower")),
+    priority_aging('file'),
+], description=(
+    "These options specify which queue to use to store state about your jobs"))
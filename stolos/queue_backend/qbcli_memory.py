@@ -0,0 +1,351 @@
+"""
+An in-process queue backend.  State lives in this process's memory, so it
+needs no external service and disappears when the process exits.
+
+Useful for tests and for single-process deployments.  Every consumer of
+a queue or lock lives in this process, so locks and taken queue items never
+outlive their owner and don't need to expire.  Use qbcli_sqlite to share
+state between processes on one host.
+"""
+import collections
+import heapq
+import itertools
+import random
+import sys
+import threading
+import time
+
+import six
+
+from stolos import get_NS
+from stolos import argparse_shared as at
+from stolos import exceptions
+from .backend_tools import aged_score, priority_aging
+from .qbcli_baseapi import Lock as BaseLock, LockingQueue as BaseLockingQueue
+
+
+# guards all module state.  Lock waiters sleep on _CHANGED
+_MUTEX = threading.RLock()
+_CHANGED = threading.Condition(_MUTEX)
+_NODES = {}  # path: value
+_QUEUES = {}  # path: _Queue
+_LOCKS = {}  # path: owner
+_SEQ = itertools.count()  # preserves insertion order between equal scores
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf8')
+    return six.text_type(value)
+
+
+def _new_owner():
+    return str(random.randint(0, sys.maxsize))
+
+
+class _Queue(object):
+    """The items of one queue.  Available items are in a heap ordered by
+    (score, insertion order), delayed items in a heap ordered by when they
+    are due, and taken items are keyed by the owner that got them"""
+    __slots__ = ['ready', 'delayed', 'taken', 'counts']
+
+    def __init__(self):
+        self.ready = []  # (score, seq, priority, value)
+        self.delayed = []  # (not_before, seq, priority, value)
+        self.taken = {}  # owner: (priority, value)
+        self.counts = collections.Counter()  # value: num entries
+
+    def __len__(self):
+        return len(self.ready) + len(self.delayed) + len(self.taken)
+
+    def push(self, value, priority, delay):
+        not_before = time.time() + delay
+        if delay > 0:
+            heapq.heappush(
+                self.delayed, (not_before, next(_SEQ), priority, value))
+        else:
+            heapq.heappush(
+                self.ready,
+                (_score(priority, not_before), next(_SEQ), priority, value))
+
+    def promote_delayed(self):
+        """Move delayed items that are due onto the queue"""
+        now = time.time()
+        while self.delayed and self.delayed[0][0] <= now:
+            not_before, seq, priority, value = heapq.heappop(self.delayed)
+            heapq.heappush(
+                self.ready,
+                (_score(priority, not_before), seq, priority, value))
+
+
+def _score(priority, insert_time):
+    return aged_score(
+        priority, insert_time, get_NS().qb_memory_priority_aging)
+
+
+def _get_queue(path, create=False):
+    q = _QUEUES.get(path)
+    if q is None and create:
+        q = _QUEUES[path] = _Queue()
+    return q
+
+
+class LockingQueue(BaseLockingQueue):
+    def __init__(self, path):
+        self._path = path
+        self._owner = _new_owner()
+        self._item = None
+
+    def put(self, value, priority=100, delay=0):
+        """Add item onto queue.
+        Rank items by priority.  Get low priority items before high priority
+        If given a `delay` in seconds, hide the item from get() until it's due
+        """
+        value = _text(value)
+        with _MUTEX:
+            q = _get_queue(self._path, create=True)
+            q.push(value, priority, delay)
+            q.counts[value] += 1
+
+    def consume(self):
+        """Consume value gotten from queue.
+        Raise exceptions.NotTaken if consume() called before get()
+        """
+        if self._item is None:
+            raise exceptions.NotTaken("Must call get() before consume()")
+        with _MUTEX:
+            q = _get_queue(self._path)
+            if q is not None and q.taken.pop(self._owner, None):
+                q.counts[self._item] -= 1
+                if not q.counts[self._item]:
+                    del q.counts[self._item]
+        self._item = None
+
+    def requeue(self, priority=None, delay=0):
+        """Atomically move the value gotten from queue to the back of the queue
+        and unlock it.  The value keeps its priority unless given `priority`.
+        If given a `delay` in seconds, hide the item from get() until it's due
+        Raise exceptions.NotTaken if requeue() called before get()
+        """
+        if self._item is None:
+            raise exceptions.NotTaken("Must call get() before requeue()")
+        with _MUTEX:
+            q = _get_queue(self._path, create=True)
+            old_priority, value = q.taken.pop(
+                self._owner, (None, self._item))
+            if priority is None:
+                priority = old_priority
+            if old_priority is None:
+                q.counts[value] += 1  # the queue was deleted while taken
+            q.push(value, priority, delay)
+        self._item = None
+
+    def get(self, timeout=None):
+        """Get an item from the queue or return None.  Do not block forever."""
+        if self._item is not None:
+            return self._item
+        with _MUTEX:
+            q = _get_queue(self._path)
+            if q is None:
+                return
+            q.promote_delayed()
+            if not q.ready:
+                return
+            _, _, priority, value = heapq.heappop(q.ready)
+            q.taken[self._owner] = (priority, value)
+        self._item = value
+        return value
+
+    def size(self, queued=True, taken=True):
+        """
+        Find the number of jobs in the queue
+
+        `queued` - Include the entries in the queue that are not currently
+            being processed or otherwise locked
+        `taken` - Include the entries in the queue that are currently being
+            processed or are otherwise locked
+
+        Raise AttributeError if all kwargs are False
+        """
+        if not queued and not taken:
+            raise AttributeError("either `taken` or `queued` must be True")
+        with _MUTEX:
+            q = _get_queue(self._path)
+            if q is None:
+                return 0
+            ntaken = len(q.taken)
+            if queued and taken:
+                return len(q)
+            elif queued:
+                return len(q) - ntaken
+            return ntaken
+
+    def is_queued(self, value):
+        """
+        Return True if item is in queue or currently being processed.
+        False otherwise
+        """
+        with _MUTEX:
+            q = _get_queue(self._path)
+            return q is not None and _text(value) in q.counts
+
+    def iter_items(self):
+        """
+        Yield (value, is_taken) for every item in the queue, including delayed
+        items, in no particular order
+        """
+        with _MUTEX:
+            q = _get_queue(self._path)
+            if q is None:
+                return
+            items = [(x[3], False) for x in q.ready]
+            items.extend((x[3], False) for x in q.delayed)
+            items.extend((x[1], True) for x in q.taken.values())
+        for item in items:
+            yield item
+
+
+class Lock(BaseLock):
+    def __init__(self, path):
+        self._path = path
+        self._owner = _new_owner()
+
+    def acquire(self, blocking=False, timeout=None):
+        """
+        Acquire a lock at the Lock's path.
+        Return True if acquired, False otherwise
+
+        `blocking` (bool) If False, return immediately if we got lock.
+            If True, wait up to `timeout` seconds to acquire a lock
+        `timeout` (int) number of seconds.  By default, wait indefinitely
+        """
+        if blocking and timeout is not None:
+            expire_at = time.time() + timeout
+        with _CHANGED:
+            while _LOCKS.setdefault(self._path, self._owner) != self._owner:
+                if not blocking:
+                    return False
+                if timeout is None:
+                    _CHANGED.wait()
+                else:
+                    remaining = expire_at - time.time()
+                    if remaining <= 0:
+                        return False
+                    _CHANGED.wait(remaining)
+        return True
+
+    def release(self):
+        """
+        Release a lock at the Lock's path.
+        Raise UserWarning if the lock isn't held by this Lock instance
+        """
+        with _CHANGED:
+            if _LOCKS.get(self._path) != self._owner:
+                raise UserWarning("You must acquire lock before releasing it")
+            del _LOCKS[self._path]
+            _CHANGED.notify_all()
+
+    def is_locked(self):
+        """
+        Return True if path is currently locked by anyone, and False otherwise
+        """
+        return self._path in _LOCKS
+
+
+def get(path):
+    """Get value at given path.
+    If path does not exist, throw stolos.exceptions.NoNodeError
+    """
+    try:
+        return _NODES[path]
+    except KeyError:
+        raise exceptions.NoNodeError(path)
+
+
+def get_many(paths):
+    """Get values at the given paths.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    with _MUTEX:
+        return [_NODES.get(path) for path in paths]
+
+
+def is_locked_many(paths):
+    """Return a list of whether the Lock at each of the given paths is
+    currently locked by anyone
+    """
+    with _MUTEX:
+        return [path in _LOCKS for path in paths]
+
+
+def iter_children(path):
+    """Yield names of the nodes directly beneath the given path, in no
+    particular order.
+    """
+    prefix = path.rstrip('/') + '/'
+    with _MUTEX:
+        paths = list(_NODES)
+    for k in paths:
+        if k.startswith(prefix) and '/' not in k[len(prefix):]:
+            yield k[len(prefix):]
+
+
+def exists(path):
+    """Return True if path exists (value can be ''), False otherwise"""
+    return path in _NODES
+
+
+def delete(path, _recursive=False):
+    """Remove path from queue backend.
+    Return True if anything was removed, False otherwise
+
+    `_recursive` - Also remove everything beneath the path.  For tests only
+    """
+    with _CHANGED:
+        if not _recursive:
+            return _NODES.pop(path, None) is not None
+        prefix = path.rstrip('/') + '/'
+        removed = False
+        for dct in [_NODES, _QUEUES, _LOCKS]:
+            for k in [k for k in dct if k == path or k.startswith(prefix)]:
+                del dct[k]
+                removed = True
+        _CHANGED.notify_all()
+        return removed
+
+
+def set(path, value):
+    """Set value at given path
+    If the path does not already exist, raise stolos.exceptions.NoNodeError
+    """
+    with _MUTEX:
+        if path not in _NODES:
+            raise exceptions.NoNodeError("Could not set path: %s" % path)
+        _NODES[path] = _text(value)
+
+
+def create(path, value):
+    """Set value at given path.
+    If path already exists, raise stolos.exceptions.NodeExistsError
+    """
+    with _MUTEX:
+        if path in _NODES:
+            raise exceptions.NodeExistsError(
+                "Could not create path: %s" % path)
+        _NODES[path] = _text(value)
+
+
+def increment(path, value=1):
+    """Increment the counter at given path
+    Return the incremented count as an int
+    """
+    with _MUTEX:
+        rv = int(_NODES.get(path) or 0) + value
+        _NODES[path] = _text(rv)
+    return rv
+
+
+build_arg_parser = at.build_arg_parser([
+    priority_aging('memory'),
+], description=(
+    "These options specify which queue to use to store state about your jobs"))
@@ -1,5 +1,6 @@
 from contextlib import contextmanager
 import random
+import re
 import time
 import threading
 import os
@@ -13,6 +14,7 @@ from stolos import argparse_shared as at
 from stolos import util
 import stolos.exceptions
 
+from .backend_tools import aged_score, priority_aging
 from .qbcli_baseapi import Lock as BaseLock, LockingQueue as BaseLockingQueue
 
 
@@ -163,27 +165,56 @@ class LockingQueue(BaseStolosRedis, BaseLockingQueue):
     # h_k = ordered hash of key in form:  priority:insert_time_since_epoch:key
     # Q = sorted set of queued keys, h_k
     # Qi = sorted mapping (h_k -> key) for all known queued or completed items
+    # Qd = sorted set of delayed keys, h_k, scored by when they become due
     #
     # args:
     # expireat = seconds_since_epoch, presumably in the future
+    # now, not_before = seconds_since_epoch
+    # score = rank of a new h_k in Q.  0 unless the queue ages its items.
+    #   Taken items are ranked behind every queued item, however it aged:
+    #   their score is 1e15 + the num times they were taken
+    # priority_aging = num seconds for a queued item to gain 1 unit of priority
     # client_id = unique owner of the lock
     # randint = a random integer that changes every time script is called
     SCRIPTS = dict(
 
         # returns 1
-        lq_put=dict(keys=('Q', 'h_k'), args=(), script="""
-redis.call("ZINCRBY", KEYS[1], 0, KEYS[2])
+        lq_put=dict(keys=('Q', 'h_k'), args=('score', ), script="""
+redis.call("ZINCRBY", KEYS[1], ARGV[1], KEYS[2])
+return 1
+"""),
+
+        # returns 1
+        lq_put_delayed=dict(
+            keys=('Qd', 'h_k'), args=('not_before', ), script="""
+redis.call("ZADD", KEYS[1], ARGV[1], KEYS[2])
 return 1
 """),
 
         # returns 1 if got an item, and returns an error otherwise
-        lq_get=dict(keys=('Q', ), args=('client_id', 'expireat'), script="""
+        # first moves (a bounded number of) due items from Qd onto Q
+        lq_get=dict(
+            keys=('Q', 'Qd'),
+            args=('client_id', 'expireat', 'now', 'priority_aging'), script="""
+local aging = tonumber(ARGV[4])
+for _,k in ipairs(redis.call(
+        "ZRANGEBYSCORE", KEYS[2], "-inf", ARGV[3], "LIMIT", 0, 100)) do
+local score = 0
+if aging > 0 then
+    local p, t = string.match(k, "^(-?%d+):([%d.]+):")
+    score = tonumber(p) + tonumber(t) / aging
+end
+redis.call("ZINCRBY", KEYS[1], score, k)
+redis.call("ZREM", KEYS[2], k)
+end
 local h_k = redis.call("ZRANGE", KEYS[1], 0, 0)[1]
 if nil == h_k then return {err="queue empty"} end
 if false == redis.call("SET", h_k, ARGV[1], "NX") then
 return {err="already locked"} end
 if 1 ~= redis.call("EXPIREAT", h_k, ARGV[2]) then
 return {err="invalid expireat"} end
+if tonumber(redis.call("ZSCORE", KEYS[1], h_k)) < 1e15 then
+redis.call("ZADD", KEYS[1], "1e15", h_k) end
 redis.call("ZINCRBY", KEYS[1], 1, h_k)
 return h_k
 """),
@@ -203,6 +234,7 @@ elseif rv == ARGV[3] then
     return 1
 else
     local score = tonumber(redis.call("ZSCORE", KEYS[2], KEYS[1]))
+    if score >= 1e15 then score = score - 1e15 end  -- num times taken
     math.randomseed(tonumber(ARGV[2]))
     local num = math.random(math.floor(score) + 1)
     if num ~= 1 then
@@ -213,6 +245,9 @@ end
 else
 if 1 ~= redis.call("EXPIREAT", KEYS[1], ARGV[1]) then
     return {err="invalid expireat"} end
+local score = tonumber(redis.call("ZSCORE", KEYS[2], KEYS[1]))
+if not score or score < 1e15 then
+    redis.call("ZADD", KEYS[2], "1e15", KEYS[1]) end
 redis.call("ZINCRBY", KEYS[2], 1, KEYS[1])
 return 1
 end
@@ -243,6 +278,21 @@ redis.call("ZREM", KEYS[2], KEYS[1])
 if "completed" ~= rv then redis.call("INCR", KEYS[3]) end
 return 1
 else return 0 end
+"""),
+
+        # returns 1 if moved h_k to the back of the queue as new_h_k.
+        # returns 0 if client doesn't own the lock on h_k.
+        # new_h_k is delayed if not_before > 0
+        lq_requeue=dict(
+            keys=('h_k', 'Q', 'new_h_k', 'Qd'),
+            args=('client_id', 'not_before', 'score'), script="""
+if ARGV[1] ~= redis.call("GET", KEYS[1]) then return 0 end
+redis.call("DEL", KEYS[1])
+redis.call("ZREM", KEYS[2], KEYS[1])
+if tonumber(ARGV[2]) > 0 then
+redis.call("ZADD", KEYS[4], ARGV[2], KEYS[3])
+else redis.call("ZINCRBY", KEYS[2], ARGV[3], KEYS[3]) end
+return 1
 """),
 
         # returns nil.  markes job completed
@@ -264,18 +314,19 @@ if ARGV[1] == redis.call("GET", KEYS[1]) then
 else return 0 end
 """),
 
-        # returns number of items {(queued + taken), completed}
+        # returns number of items {(queued + delayed + taken), completed}
         # O(log(n))
         lq_qsize_fast=dict(
-            keys=('Q', 'Qi'), args=(), script="""
-return {redis.call("ZCARD", KEYS[1]), redis.call("INCRBY", KEYS[2], 0)}"""),
+            keys=('Q', 'Qi', 'Qd'), args=(), script="""
+return {redis.call("ZCARD", KEYS[1]) + redis.call("ZCARD", KEYS[3]),
+        redis.call("INCRBY", KEYS[2], 0)}"""),
 
-        # returns number of items {in_queue, taken, completed}
+        # returns number of items {in_queue (or delayed), taken, completed}
         # O(n)  -- eek!
         lq_qsize_slow=dict(
-            keys=('Q', 'Qi'), args=(), script="""
+            keys=('Q', 'Qi', 'Qd'), args=(), script="""
 local taken = 0
-local queued = 0
+local queued = redis.call("ZCARD", KEYS[3])
 for _,k in ipairs(redis.call("ZRANGE", KEYS[1], 0, -1)) do
 local v = redis.call("GET", k)
 if "completed" ~= v then
@@ -302,7 +353,7 @@ else return {false, false ~= redis.call("ZSCORE", KEYS[1], KEYS[2]), false} end
         # raises an error if already completed.
         # O(N * strlen(item)) -- eek!
         lq_is_queued_item=dict(
-            keys=('Q', 'item'), args=(), script="""
+            keys=('Q', 'item', 'Qd'), args=(), script="""
 for _,k in ipairs(redis.call("ZRANGE", KEYS[1], 0, -1)) do
 if string.sub(k, -string.len(KEYS[2])) == KEYS[2] then
     local taken = redis.call("GET", k)
@@ -313,6 +364,10 @@ if string.sub(k, -string.len(KEYS[2])) == KEYS[2] then
     return {false, true, false} end
 end
 end
+for _,k in ipairs(redis.call("ZRANGE", KEYS[3], 0, -1)) do
+if string.sub(k, -string.len(KEYS[2])) == KEYS[2] then
+    return {false, true, false} end
+end
 return {false, false, false}
 """),
     )
@@ -320,6 +375,8 @@ return {false, false, false}
     def __init__(self, path):
         super(LockingQueue, self).__init__(path)
         self._q_lookup = ".%s" % path
+        self._q_delayed = "..%s" % path
+        self._priority_aging = get_NS().qb_redis_priority_aging
 
         self._item = None
         self._h_k = None
@@ -329,25 +386,46 @@ return {false, false, false}
             if self.LOCKS.get(k) == self._client_id:
                 self.LOCKS.pop(k)
 
-    def put(self, value, priority=100):
+    def _score(self, priority, insert_time):
+        """Rank of a new item in the queue.  By default, all items get the same
+        score and are ordered by their key.  If the queue ages its items,
+        an item's score is its priority less 1 unit for every
+        `priority_aging` seconds it has waited in the queue.  The
+        score is relative, so it doesn't need updating as time passes.
+        Taken items get scores above 1e15, so they never block the head of
+        the queue"""
+        if not self._priority_aging:
+            return 0
+        return aged_score(priority, insert_time, self._priority_aging)
+
+    def put(self, value, priority=100, delay=0):
         """Add item onto queue.
         Rank items by priority.  Get low priority items before high priority
+        If given a `delay` in seconds, hide the item from get() until it's due
         """
         # format into hashed key
-        h_k = "%d:%f:%s" % (priority, time.time(), value)
+        not_before = time.time() + delay
+        h_k = "%d:%f:%s" % (priority, not_before, value)
 
-        rv = raw_client().evalsha(
-            self._SHAS['lq_put'],
-            len(self.SCRIPTS['lq_put']['keys']),
-            self._path, h_k)
+        if delay > 0:
+            rv = raw_client().evalsha(
+                self._SHAS['lq_put_delayed'],
+                len(self.SCRIPTS['lq_put_delayed']['keys']),
+                self._q_delayed, h_k, not_before)
+        else:
+            rv = raw_client().evalsha(
+                self._SHAS['lq_put'],
+                len(self.SCRIPTS['lq_put']['keys']),
+                self._path, h_k, self._score(priority, not_before))
         assert rv == 1
 
     def consume(self):
         """Consume value gotten from queue.
-        Raise UserWarning if consume() called before get()
+        Raise exceptions.NotTaken if consume() called before get()
         """
         if self._item is None:
-            raise UserWarning("Must call get() before consume()")
+            raise stolos.exceptions.NotTaken(
+                "Must call get() before consume()")
 
         self.LOCKS.pop(self._h_k)
 
@@ -360,6 +438,32 @@ return {false, false, false}
         self._h_k = None
         self._item = None
 
+    def requeue(self, priority=None, delay=0):
+        """Atomically move the value gotten from queue to the back of the queue
+        and unlock it.  The value keeps its priority unless given `priority`.
+        If given a `delay` in seconds, hide the item from get() until it's due
+        Raise exceptions.NotTaken if requeue() called before get()
+        """
+        if self._item is None:
+            raise stolos.exceptions.NotTaken(
+                "Must call get() before requeue()")
+        if priority is None:
+            priority = int(self._h_k.decode().split(':', 1)[0])
+        not_before = time.time() + delay
+        h_k = "%d:%f:%s" % (priority, not_before, self._item)
+
+        self.LOCKS.pop(self._h_k)
+
+        rv = raw_client().evalsha(
+            self._SHAS['lq_requeue'],
+            len(self.SCRIPTS['lq_requeue']['keys']),
+            self._h_k, self._path, h_k, self._q_delayed, self._client_id,
+            not_before if delay > 0 else 0, self._score(priority, not_before))
+        assert rv == 1
+
+        self._h_k = None
+        self._item = None
+
     def get(self, timeout=None):
         """Get an item from the queue or return None.  Do not block forever."""
         if self._item is not None:
@@ -372,7 +476,8 @@ return {false, false, false}
                 self._h_k = raw_client().evalsha(
                     self._SHAS['lq_get'],
                     len(self.SCRIPTS['lq_get']['keys']),
-                    self._path, self._client_id, expire_at)
+                    self._path, self._q_delayed, self._client_id, expire_at,
+                    time.time(), self._priority_aging)
             except redis.exceptions.ResponseError as err:
                 if str(err) not in ['queue empty', 'already locked']:
                     raise err
@@ -402,13 +507,13 @@ return {false, false, false}
             n_queued_and_taken, _ = raw_client().evalsha(
                 self._SHAS['lq_qsize_fast'],
                 len(self.SCRIPTS['lq_qsize_fast']['keys']),
-                self._path, self._q_lookup)
+                self._path, self._q_lookup, self._q_delayed)
             return n_queued_and_taken
         else:
             nqueued, ntaken, _ = raw_client().evalsha(
                 self._SHAS['lq_qsize_slow'],
                 len(self.SCRIPTS['lq_qsize_slow']['keys']),
-                self._path, self._q_lookup)
+                self._path, self._q_lookup, self._q_delayed)
             if queued:
                 return nqueued
             elif taken:
@@ -432,9 +537,34 @@ return {false, false, false}
             taken, queued, completed = raw_client().evalsha(
                 self._SHAS['lq_is_queued_item'],
                 len(self.SCRIPTS['lq_is_queued_item']['keys']),
-                self._path, value)
+                self._path, value, self._q_delayed)
         return taken or queued
 
+    def iter_items(self):
+        """
+        Yield (value, is_taken) for every item in the queue, including delayed
+        items, in no particular order
+        """
+        rc = raw_client()
+        batch = []
+        for h_k, _ in rc.zscan_iter(self._path, count=_SCAN_COUNT):
+            batch.append(h_k)
+            if len(batch) >= _SCAN_COUNT:
+                for rv in self._iter_taken(batch):
+                    yield rv
+                batch = []
+        for rv in self._iter_taken(batch):
+            yield rv
+        for h_k, _ in rc.zscan_iter(self._q_delayed, count=_SCAN_COUNT):
+            yield (h_k.decode().split(':', 2)[2], False)
+
+    def _iter_taken(self, h_ks):
+        if not h_ks:
+            return
+        for h_k, lock in zip(h_ks, raw_client().mget(h_ks)):
+            if lock != b'completed':
+                yield (h_k.decode().split(':', 2)[2], lock is not None)
+
 
 def _raise_err(x, y):
     time.sleep(1)  # hack to better deal with cleanup
@@ -549,6 +679,49 @@ def get(path):
     return rv
 
 
+# num keys to ask for per SCAN call or to fetch per MGET
+_SCAN_COUNT = 1000
+
+
+def get_many(paths):
+    """Get values at the given paths in as few round trips as possible.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    rv = []
+    for i in range(0, len(paths), _SCAN_COUNT):
+        for val in raw_client().mget(paths[i:i + _SCAN_COUNT]):
+            if val is not None:
+                val = val.decode()
+                if val == '--STOLOSEMPTYSTRING--':
+                    val = ''
+            rv.append(val)
+    return rv
+
+
+def is_locked_many(paths):
+    """Return a list of whether the Lock at each of the given paths is
+    currently locked by anyone, in as few round trips as possible
+    """
+    rv = []
+    for i in range(0, len(paths), _SCAN_COUNT):
+        rv.extend(
+            x is not None
+            for x in raw_client().mget(paths[i:i + _SCAN_COUNT]))
+    return rv
+
+
+def iter_children(path):
+    """Yield names of the nodes directly beneath the given path, in no
+    particular order.  A name may rarely be yielded twice.
+    """
+    prefix = "%s/" % path
+    match = re.sub(r'([\\*?\[\]])', r'\\\1', prefix) + '*'
+    for key in raw_client().scan_iter(match=match, count=_SCAN_COUNT):
+        name = key.decode()[len(prefix):]
+        if '/' not in name:
+            yield name
+
+
 def exists(path):
     """Return True if path exists (value can be ''), False otherwise"""
     return raw_client().exists(path)
@@ -609,6 +782,7 @@ build_arg_parser = at.build_arg_parser([
     at.add_argument('--qb_redis_db', default=0, type=int),
     at.add_argument('--qb_redis_lock_timeout', default=60, type=int),
     at.add_argument('--qb_redis_max_network_delay', default=30, type=int),
+    priority_aging('redis'),
     at.add_argument(
         '--qb_redis_socket_timeout', default='15', type=float, help=(
             "number of seconds that the redis client will spend waiting for a"
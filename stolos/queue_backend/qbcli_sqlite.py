@@ -0,0 +1,472 @@
+"""
+A queue backend stored in a SQLite database file.  Processes on one host
+share state through the file, so Stolos can run without any daemons.
+
+The database uses write-ahead logging, so readers don't block the writer.
+Every operation is one transaction, and reads that modify state take the
+write lock up front (BEGIN IMMEDIATE), so concurrent processes wait on
+--qb_sqlite_busy_timeout rather than fail with a deadlock.
+
+Locks and taken queue items are leases that expire after
+--qb_sqlite_lock_timeout seconds.  A background thread in each process
+extends all of that process's leases in a single statement, so if a process
+dies, its locks and taken items become available again.
+"""
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+import time
+
+import six
+
+from stolos import log
+from stolos import get_NS
+from stolos import argparse_shared as at
+from stolos import exceptions
+from .backend_tools import Leases, aged_score, priority_aging
+from .qbcli_baseapi import Lock as BaseLock, LockingQueue as BaseLockingQueue
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    path TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    value TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    score REAL NOT NULL,
+    not_before REAL NOT NULL,
+    owner TEXT,
+    expire_at REAL
+);
+CREATE INDEX IF NOT EXISTS queue_next ON queue (path, owner, score, id);
+CREATE INDEX IF NOT EXISTS queue_value ON queue (path, value);
+CREATE TABLE IF NOT EXISTS locks (
+    path TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expire_at REAL NOT NULL
+);
+"""
+
+# max num of bound parameters per statement (SQLITE_MAX_VARIABLE_NUMBER)
+_BATCH_SIZE = 500
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf8')
+    return six.text_type(value)
+
+
+def _range(path):
+    """Bounds of the keys beneath path, for an indexed range scan"""
+    prefix = path.rstrip('/') + '/'
+    return prefix, prefix[:-1] + '0'  # '0' sorts right after '/'
+
+
+_LOCAL = threading.local()
+
+
+def raw_client():
+    """Return this thread's connection to the database.
+    Connections are per thread and are not shared with forked children"""
+    ns = get_NS()
+    key = (os.getpid(), ns.qb_sqlite_path)
+    if getattr(_LOCAL, 'key', None) != key:
+        log.debug(
+            "Connecting to SQLite queue backend",
+            extra=dict(qb_sqlite_path=ns.qb_sqlite_path))
+        conn = sqlite3.connect(
+            ns.qb_sqlite_path, timeout=ns.qb_sqlite_busy_timeout,
+            isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # with WAL, only a power loss can lose the last transactions
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with transaction(conn):
+            for statement in _SCHEMA.split(';'):
+                conn.execute(statement)
+        _LOCAL.conn = conn
+        _LOCAL.key = key
+    return _LOCAL.conn
+
+
+@contextmanager
+def transaction(conn=None):
+    """Run the statements in the block as one transaction that holds the
+    database's write lock from the start"""
+    if conn is None:
+        conn = raw_client()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:  # roll back on KeyboardInterrupt too
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _extend_leases(process_key, leases):
+    """Push back the expiry of this process's locks and taken queue items"""
+    expire_at = _expire_at()
+    pattern = process_key + '.%'
+    try:
+        with transaction() as conn:
+            conn.execute(
+                "UPDATE locks SET expire_at=? WHERE owner LIKE ?",
+                (expire_at, pattern))
+            conn.execute(
+                "UPDATE queue SET expire_at=?"
+                " WHERE owner IS NOT NULL AND owner LIKE ?",
+                (expire_at, pattern))
+    except sqlite3.Error as err:
+        log.warn(
+            "SQLite queue backend could not extend leases: %s" % err)
+
+
+_LEASES = Leases(
+    "stolos.queue_backend.qbcli_sqlite", _extend_leases,
+    lambda: get_NS().qb_sqlite_lock_timeout)
+
+
+def _expire_leases(path):
+    """Pretend that the owners of all locks and taken items at or beneath
+    the given path died.  This is only for tests"""
+    past = time.time() - 1
+    lo, hi = _range(path)
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE locks SET expire_at=?"
+            " WHERE path=? OR (path >= ? AND path < ?)",
+            (past, path, lo, hi))
+        conn.execute(
+            "UPDATE queue SET expire_at=? WHERE owner IS NOT NULL"
+            " AND (path=? OR (path >= ? AND path < ?))",
+            (past, path, lo, hi))
+
+
+def _expire_at():
+    return time.time() + get_NS().qb_sqlite_lock_timeout
+
+
+def _score(priority, insert_time):
+    return aged_score(
+        priority, insert_time, get_NS().qb_sqlite_priority_aging)
+
+
+def _insert(conn, path, value, priority, delay):
+    not_before = time.time() + delay
+    conn.execute(
+        "INSERT INTO queue (path, value, priority, score, not_before)"
+        " VALUES (?, ?, ?, ?, ?)",
+        (path, value, priority, _score(priority, not_before), not_before))
+
+
+class LockingQueue(BaseLockingQueue):
+    def __init__(self, path):
+        self._path = path
+        self._item = None
+        self._id = None
+        self._owner = None
+
+    def put(self, value, priority=100, delay=0):
+        """Add item onto queue.
+        Rank items by priority.  Get low priority items before high priority
+        If given a `delay` in seconds, hide the item from get() until it's due
+        """
+        _insert(raw_client(), self._path, _text(value), priority, delay)
+
+    def consume(self):
+        """Consume value gotten from queue.
+        Raise exceptions.NotTaken if consume() called before get()
+        """
+        if self._item is None:
+            raise exceptions.NotTaken("Must call get() before consume()")
+        raw_client().execute(
+            "DELETE FROM queue WHERE id=? AND owner=?",
+            (self._id, self._owner))
+        self._item = self._id = self._owner = None
+
+    def requeue(self, priority=None, delay=0):
+        """Atomically move the value gotten from queue to the back of the queue
+        and unlock it.  The value keeps its priority unless given `priority`.
+        If given a `delay` in seconds, hide the item from get() until it's due
+        Raise exceptions.NotTaken if requeue() called before get()
+        """
+        if self._item is None:
+            raise exceptions.NotTaken("Must call get() before requeue()")
+        with transaction() as conn:
+            row = conn.execute(
+                "SELECT priority FROM queue WHERE id=? AND owner=?",
+                (self._id, self._owner)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM queue WHERE id=?", (self._id, ))
+                if priority is None:
+                    priority = row[0]
+            elif priority is None:
+                priority = 100
+            _insert(conn, self._path, self._item, priority, delay)
+        self._item = self._id = self._owner = None
+
+    def get(self, timeout=None):
+        """Get an item from the queue or return None.  Do not block forever."""
+        if self._item is not None:
+            return self._item
+        now = time.time()
+        owner = _LEASES.unique()
+        with transaction() as conn:
+            # take back items whose owner died
+            conn.execute(
+                "UPDATE queue SET owner=NULL, expire_at=NULL"
+                " WHERE path=? AND owner IS NOT NULL AND expire_at < ?",
+                (self._path, now))
+            row = conn.execute(
+                "SELECT id, value FROM queue"
+                " WHERE path=? AND owner IS NULL AND not_before <= ?"
+                " ORDER BY score, id LIMIT 1",
+                (self._path, now)).fetchone()
+            if row is None:
+                return
+            conn.execute(
+                "UPDATE queue SET owner=?, expire_at=? WHERE id=?",
+                (owner, _expire_at(), row[0]))
+        self._id, self._item = row
+        self._owner = owner
+        return self._item
+
+    def size(self, queued=True, taken=True):
+        """
+        Find the number of jobs in the queue
+
+        `queued` - Include the entries in the queue that are not currently
+            being processed or otherwise locked
+        `taken` - Include the entries in the queue that are currently being
+            processed or are otherwise locked
+
+        Raise AttributeError if all kwargs are False
+        """
+        if not queued and not taken:
+            raise AttributeError("either `taken` or `queued` must be True")
+        sql = "SELECT COUNT(*) FROM queue WHERE path=?"
+        if not taken:
+            sql += " AND (owner IS NULL OR expire_at < ?)"
+        elif not queued:
+            sql += " AND owner IS NOT NULL AND expire_at >= ?"
+        args = (self._path, ) if queued and taken else (
+            self._path, time.time())
+        return raw_client().execute(sql, args).fetchone()[0]
+
+    def is_queued(self, value):
+        """
+        Return True if item is in queue or currently being processed.
+        False otherwise
+        """
+        return raw_client().execute(
+            "SELECT 1 FROM queue WHERE path=? AND value=? LIMIT 1",
+            (self._path, _text(value))).fetchone() is not None
+
+    def iter_items(self):
+        """
+        Yield (value, is_taken) for every item in the queue, including delayed
+        items, in no particular order
+        """
+        rows = raw_client().execute(
+            "SELECT value, owner IS NOT NULL AND expire_at >= ?"
+            " FROM queue WHERE path=?", (time.time(), self._path))
+        for value, is_taken in rows.fetchall():
+            yield (value, bool(is_taken))
+
+
+class Lock(BaseLock):
+    # num seconds between attempts to acquire a lock held by someone else
+    _POLL_INTERVAL = .05
+
+    def __init__(self, path):
+        self._path = path
+        self._owner = _LEASES.unique()
+
+    def _acquire(self):
+        with transaction() as conn:
+            row = conn.execute(
+                "SELECT owner, expire_at FROM locks WHERE path=?",
+                (self._path, )).fetchone()
+            if row is not None and row[0] != self._owner \
+                    and row[1] >= time.time():
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO locks (path, owner, expire_at)"
+                " VALUES (?, ?, ?)", (self._path, self._owner, _expire_at()))
+        return True
+
+    def acquire(self, blocking=False, timeout=None):
+        """
+        Acquire a lock at the Lock's path.
+        Return True if acquired, False otherwise
+
+        `blocking` (bool) If False, return immediately if we got lock.
+            If True, wait up to `timeout` seconds to acquire a lock
+        `timeout` (int) number of seconds.  By default, wait indefinitely
+        """
+        if blocking and timeout is not None:
+            expire_at = time.time() + timeout
+        while not self._acquire():
+            if not blocking:
+                return False
+            if timeout is not None and time.time() >= expire_at:
+                return False
+            time.sleep(self._POLL_INTERVAL)
+        return True
+
+    def release(self):
+        """
+        Release a lock at the Lock's path.
+        Raise UserWarning if the lock isn't held by this Lock instance
+        """
+        rv = raw_client().execute(
+            "DELETE FROM locks WHERE path=? AND owner=?",
+            (self._path, self._owner))
+        if not rv.rowcount:
+            raise UserWarning("You must acquire lock before releasing it")
+
+    def is_locked(self):
+        """
+        Return True if path is currently locked by anyone, and False otherwise
+        """
+        return raw_client().execute(
+            "SELECT 1 FROM locks WHERE path=? AND expire_at >= ?",
+            (self._path, time.time())).fetchone() is not None
+
+
+def get(path):
+    """Get value at given path.
+    If path does not exist, throw stolos.exceptions.NoNodeError
+    """
+    row = raw_client().execute(
+        "SELECT value FROM nodes WHERE path=?", (path, )).fetchone()
+    if row is None:
+        raise exceptions.NoNodeError(path)
+    return row[0]
+
+
+def get_many(paths):
+    """Get values at the given paths in as few queries as possible.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    conn = raw_client()
+    found = {}
+    for i in range(0, len(paths), _BATCH_SIZE):
+        batch = paths[i:i + _BATCH_SIZE]
+        found.update(conn.execute(
+            "SELECT path, value FROM nodes WHERE path IN (%s)"
+            % ','.join('?' * len(batch)), batch).fetchall())
+    return [found.get(path) for path in paths]
+
+
+def is_locked_many(paths):
+    """Return a list of whether the Lock at each of the given paths is
+    currently locked by anyone, in as few queries as possible
+    """
+    conn = raw_client()
+    now = time.time()
+    locked = {}  # the module defines its own set()
+    for i in range(0, len(paths), _BATCH_SIZE):
+        batch = paths[i:i + _BATCH_SIZE]
+        locked.update(conn.execute(
+            "SELECT path, 1 FROM locks WHERE path IN (%s) AND expire_at >= ?"
+            % ','.join('?' * len(batch)), list(batch) + [now]).fetchall())
+    return [path in locked for path in paths]
+
+
+def iter_children(path):
+    """Yield names of the nodes directly beneath the given path, in no
+    particular order.
+    """
+    lo, hi = _range(path)
+    rows = raw_client().execute(
+        "SELECT substr(path, ?) FROM nodes WHERE path >= ? AND path < ?"
+        " AND instr(substr(path, ?), '/') = 0",
+        (len(lo) + 1, lo, hi, len(lo) + 1))
+    for (name, ) in rows.fetchall():
+        yield name
+
+
+def exists(path):
+    """Return True if path exists (value can be ''), False otherwise"""
+    return raw_client().execute(
+        "SELECT 1 FROM nodes WHERE path=?", (path, )).fetchone() is not None
+
+
+def delete(path, _recursive=False):
+    """Remove path from queue backend.
+    Return True if anything was removed, False otherwise
+
+    `_recursive` - Also remove everything beneath the path.  For tests only
+    """
+    if not _recursive:
+        return bool(raw_client().execute(
+            "DELETE FROM nodes WHERE path=?", (path, )).rowcount)
+    lo, hi = _range(path)
+    removed = 0
+    with transaction() as conn:
+        for table in ['nodes', 'queue', 'locks']:
+            removed += conn.execute(
+                "DELETE FROM %s WHERE path=? OR (path >= ? AND path < ?)"
+                % table, (path, lo, hi)).rowcount
+    return bool(removed)
+
+
+def set(path, value):
+    """Set value at given path
+    If the path does not already exist, raise stolos.exceptions.NoNodeError
+    """
+    rv = raw_client().execute(
+        "UPDATE nodes SET value=? WHERE path=?", (_text(value), path))
+    if not rv.rowcount:
+        raise exceptions.NoNodeError("Could not set path: %s" % path)
+
+
+def create(path, value):
+    """Set value at given path.
+    If path already exists, raise stolos.exceptions.NodeExistsError
+    """
+    try:
+        raw_client().execute(
+            "INSERT INTO nodes (path, value) VALUES (?, ?)",
+            (path, _text(value)))
+    except sqlite3.IntegrityError:
+        raise exceptions.NodeExistsError("Could not create path: %s" % path)
+
+
+def increment(path, value=1):
+    """Increment the counter at given path
+    Return the incremented count as an int
+    """
+    with transaction() as conn:
+        row = conn.execute(
+            "SELECT value FROM nodes WHERE path=?", (path, )).fetchone()
+        rv = int(row[0] if row and row[0] else 0) + value
+        conn.execute(
+            "INSERT OR REPLACE INTO nodes (path, value) VALUES (?, ?)",
+            (path, _text(rv)))
+    return rv
+
+
+build_arg_parser = at.build_arg_parser([
+    at.add_argument(
+        '--qb_sqlite_path', default='stolos.sqlite', help=(
+            "Filepath to the SQLite database.  Every Stolos process that"
+            " shares state must use the same file on a local filesystem")),
+    at.add_argument(
+        '--qb_sqlite_busy_timeout', default=30, type=float, help=(
+            "Max num secs to wait for another process to release its write"
+            " lock on the database")),
+    at.add_argument(
+        '--qb_sqlite_lock_timeout', default=60, type=float, help=(
+            "Locks and taken queue items held by a process that died become"
+            " available after this many seconds")),
+    priority_aging('sqlite'),
+], description=(
+    "These options specify which queue to use to store state about your jobs"))
@@ -1,4 +1,5 @@
 import atexit
+import time
 from kazoo.client import (
     KazooClient,
     Lock as _zkLock,
@@ -16,27 +17,135 @@ from stolos import get_NS
 from stolos import argparse_shared as at
 from stolos import util
 from stolos import exceptions
+from .backend_tools import aged_score, priority_aging
 from .qbcli_baseapi import Lock as BaseLock, LockingQueue as BaseLockingQueue
 from . import log
 
 
+# look for due delayed entries at most this often (in seconds).
+# see LockingQueue._promote_delayed
+_PROMOTE_INTERVAL = 1
+# queue path: time after which this process should next look for due entries
+_NEXT_PROMOTE = {}
+
+
 class LockingQueue(BaseLockingQueue):
     def __init__(self, path):
         self._path = path
         self._q = _zkLockingQueue(client=raw_client(), path=path)
-
-    def put(self, value, priority=100):
-        self._q.put(util.tobytes(value), priority=priority)
+        # delayed entries are named like: entry-<not_before>-<priority>-<seq>
+        self._delayed_path = join(path, 'delayed')
+
+    def _entry_path(self, priority, insert_time=None):
+        """Entries are named like: entry-<priority>-<seq>.  If the queue ages
+        its items, they're named like: entry-<aged_priority>-<priority>-<seq>
+        See backend_tools.aged_score"""
+        aging = get_NS().qb_zookeeper_priority_aging
+        if not aging:
+            return "%s/%s-%03d-" % (
+                self._q._entries_path, self._q.entry, priority)
+        if insert_time is None:
+            insert_time = time.time()
+        return "%s/%s-%020.6f-%03d-" % (
+            self._q._entries_path, self._q.entry,
+            aged_score(priority, insert_time, aging), priority)
+
+    def _delayed_entry_path(self, priority, delay):
+        return "%s/%s-%013d-%03d-" % (
+            self._delayed_path, self._q.entry,
+            (time.time() + delay) * 1000, priority)
+
+    def put(self, value, priority=100, delay=0):
+        """Add item onto queue.
+        Rank items by priority.  Get low priority items before high priority
+        If given a `delay` in seconds, hide the item from get() until it's due
+        """
+        value = util.tobytes(value)
+        self._q._check_put_arguments(value, priority)
+        if delay > 0:
+            raw_client().create(
+                self._delayed_entry_path(priority, delay), value,
+                sequence=True, makepath=True)
+        else:
+            self._q._ensure_paths()
+            raw_client().create(
+                self._entry_path(priority), value, sequence=True)
 
     def consume(self):
         if not self._q.consume():
-            raise UserWarning(
+            raise exceptions.NotTaken(
                 "Cannot consume() from queue without first calling q.get()")
 
+    def requeue(self, priority=None, delay=0):
+        """Atomically move the value gotten from queue to the back of the queue
+        and unlock it.  The value keeps its priority unless given `priority`.
+        If given a `delay` in seconds, hide the item from get() until it's due
+        Raise exceptions.NotTaken if requeue() called before get(), or
+        UserWarning if the item couldn't be requeued
+        """
+        q = self._q
+        if q.processing_element is None or not q.holds_lock():
+            raise exceptions.NotTaken(
+                "Cannot requeue() from queue without first calling q.get()")
+        id_, value = q.processing_element
+        if priority is None:
+            priority = int(id_.split('-')[-2])
+
+        if delay > 0:
+            raw_client().ensure_path(self._delayed_path)
+            new_path = self._delayed_entry_path(priority, delay)
+        else:
+            new_path = self._entry_path(priority)
+
+        t = raw_client().transaction()
+        t.create(new_path, value, sequence=True)
+        t.delete(join(q._entries_path, id_))
+        t.delete(join(q._lock_path, id_))
+        errors = [x for x in t.commit() if isinstance(x, Exception)]
+        if errors:
+            raise UserWarning(
+                "Could not requeue item.  Got errors: %s" % errors)
+        q.processing_element = None
+
+    def _promote_delayed(self):
+        """Move delayed entries that are due onto the queue.
+        To spare zookeeper, only look for them every _PROMOTE_INTERVAL
+        seconds, or sooner if the earliest delayed entry is due sooner"""
+        now = time.time()
+        if now < _NEXT_PROMOTE.get(self._path, 0):
+            return
+        _NEXT_PROMOTE[self._path] = now + _PROMOTE_INTERVAL
+        if not _num_children(self._delayed_path):
+            return
+        zk = raw_client()
+        try:
+            names = sorted(zk.get_children(self._delayed_path))
+        except NoNodeError:
+            return
+        self._q._ensure_paths()
+        for name in names:
+            _, not_before, priority, _ = name.split('-')
+            if int(not_before) > now * 1000:
+                _NEXT_PROMOTE[self._path] = min(
+                    _NEXT_PROMOTE[self._path], int(not_before) / 1000.)
+                break
+            path = join(self._delayed_path, name)
+            try:
+                value = zk.get(path)[0]
+            except NoNodeError:
+                continue  # another client promoted it
+            t = zk.transaction()
+            t.delete(path)
+            t.create(
+                self._entry_path(int(priority), int(not_before) / 1000.),
+                value, sequence=True)
+            t.commit()  # fails harmlessly if another client promoted it
+
     def get(self, timeout=None):
         """Get an item from the queue or return None."""
         if timeout is None:
             timeout = get_NS().qb_zookeeper_timeout
+        self._promote_delayed()
         return util.frombytes(self._q.get(timeout=timeout))
 
     def size(self, queued=True, taken=True):
@@ -50,23 +159,15 @@ class LockingQueue(BaseLockingQueue):
         """
         pq = join(self._path, 'entries')
         pt = join(self._path, 'taken')
-        zk = raw_client()
         if queued:
-            try:
-                entries = zk.exists(pq).numChildren
-            except AttributeError:
-                return 0
+            entries = _num_children(pq) + _num_children(self._delayed_path)
             if taken:
                 return entries
             else:
-                taken = zk.exists(pt).numChildren
-                return entries - taken
+                return entries - _num_children(pt)
         else:
             if taken:
-                try:
-                    return zk.exists(pt).numChildren
-                except AttributeError:
-                    return 0
+                return _num_children(pt)
             else:
                 raise AttributeError(
                     "You asked for an impossible situation.  Queue items are"
@@ -80,19 +181,50 @@ class LockingQueue(BaseLockingQueue):
         False otherwise
         """
         cli = raw_client()
-        entries = self._q.structure_paths[1]
+        items = set()
         # eek this is aweful
-        try:
-            items = {
-                cli.get(join(entries, x))[0]
-                for x in cli.get_children(entries)}
-        except NoNodeError:
-            items = []
+        for entries in [self._q.structure_paths[1], self._delayed_path]:
+            try:
+                items.update(
+                    cli.get(join(entries, x))[0]
+                    for x in cli.get_children(entries))
+            except NoNodeError:
+                pass
 
         if util.tobytes(value) in items:
             return True
         return False
 
+    def iter_items(self):
+        """
+        Yield (value, is_taken) for every item in the queue, including delayed
+        items, in no particular order
+        """
+        cli = raw_client()
+        try:
+            taken = frozenset(cli.get_children(self._q._lock_path))
+        except NoNodeError:
+            taken = frozenset()
+        for entries in [self._q._entries_path, self._delayed_path]:
+            names = list(iter_children(entries))
+            for i in range(0, len(names), _BATCH_SIZE):
+                batch = names[i:i + _BATCH_SIZE]
+                values = get_many([join(entries, x) for x in batch])
+                for name, value in zip(batch, values):
+                    if value is not None:
+                        yield (value, name in taken)
+
+
+# num nodes to request concurrently
+_BATCH_SIZE = 1000
+
+
+def _num_children(path):
+    try:
+        return raw_client().exists(path).numChildren
+    except AttributeError:
+        return 0
+
 
 class Lock(BaseLock):
     def __init__(self, path):
@@ -151,6 +283,45 @@ def get(path):
         raise exceptions.NoNodeError("%s: %s" % (path, err))
 
 
+def get_many(paths):
+    """Get values at the given paths in as few round trips as possible.
+    Return a list of values, with None in place of paths that don't exist
+    """
+    rv = []
+    for i in range(0, len(paths), _BATCH_SIZE):
+        futures = [raw_client().get_async(p) for p in paths[i:i + _BATCH_SIZE]]
+        for f in futures:
+            try:
+                rv.append(util.frombytes(f.get()[0]))
+            except NoNodeError:
+                rv.append(None)
+    return rv
+
+
+def is_locked_many(paths):
+    """Return a list of whether the Lock at each of the given paths is
+    currently locked by anyone, in as few round trips as possible
+    """
+    rv = []
+    for i in range(0, len(paths), _BATCH_SIZE):
+        futures = [
+            raw_client().exists_async(p) for p in paths[i:i + _BATCH_SIZE]]
+        rv.extend(bool(getattr(f.get(), 'numChildren', 0)) for f in futures)
+    return rv
+
+
+def iter_children(path):
+    """Yield names of the nodes directly beneath the given path, in no
+    particular order.  A name may rarely be yielded twice.
+    """
+    try:
+        children = raw_client().get_children(path)
+    except NoNodeError:
+        return
+    for name in children:
+        yield name
+
+
 def exists(path):
     return bool(raw_client().exists(path))
 
@@ -197,6 +368,7 @@ build_arg_parser = at.build_arg_parser([
     at.add_argument(
         '--qb_zookeeper_timeout', default=5, type=float,
         help="Max num secs to wait on response if timeout not specified"),
+    priority_aging('zookeeper'),
 ], description=(
     "Options that specify which queue to use to store state about your jobs")
 )
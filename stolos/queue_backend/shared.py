@@ -9,8 +9,12 @@ FAILED = 'failed'
 SKIPPED = 'skipped'
 
 
+def get_all_subtasks_path(app_name):
+    return join(app_name, 'all_subtasks')
+
+
 def get_job_path(app_name, job_id, *args):
-    return join(app_name, 'all_subtasks', job_id, *args)
+    return join(get_all_subtasks_path(app_name), job_id, *args)
 
 
 def get_lock_path(typ, app_name, job_id):
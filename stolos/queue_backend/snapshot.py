@@ -0,0 +1,116 @@
+"""
+Stream a snapshot of job state out of the queue backend for offline analysis.
+
+A snapshot is newline delimited json containing one record per line:
+
+    {"type": "job", "app_name": ..., "job_id": ..., "state": ...,
+     "retry_count": ..., "num_complete_parents": ..., "priority": ...,
+     "blocked": ..., "execute_locked": ...}
+    {"type": "queued", "app_name": ..., "job_id": ..., "taken": ...}
+
+Jobs are read from the backend in batches, so memory use is bounded by the
+batch size rather than by the number of jobs.
+"""
+import gzip
+import itertools
+import simplejson
+import six
+import sys
+
+from . import shared
+from . import log
+
+
+# nodes beneath a job's path that are exported, in order
+_JOB_FIELDS = ('retry_count', 'num_complete_parents', 'priority', 'blocked')
+
+
+def _as_int(value):
+    if value is None:
+        return None
+    return int(value)
+
+
+def _iter_job_records(app_name, batch_size):
+    qbcli = shared.get_qbclient()
+    job_ids = qbcli.iter_children(shared.get_all_subtasks_path(app_name))
+    n = 1 + len(_JOB_FIELDS)
+    while True:
+        batch = list(itertools.islice(job_ids, batch_size))
+        if not batch:
+            break
+        paths = []
+        for job_id in batch:
+            paths.append(shared.get_job_path(app_name, job_id))
+            paths.extend(
+                shared.get_job_path(app_name, job_id, x) for x in _JOB_FIELDS)
+        values = qbcli.get_many(paths)
+        # only pending jobs can be executing
+        pending = [
+            job_id for i, job_id in enumerate(batch)
+            if values[i * n] == shared.PENDING]
+        execute_locked = dict(zip(pending, qbcli.is_locked_many([
+            shared.get_lock_path('execute', app_name, job_id)
+            for job_id in pending])))
+
+        for i, job_id in enumerate(batch):
+            state, retry_count, num_complete_parents, priority, blocked = \
+                values[i * n:(i + 1) * n]
+            if state is None:
+                continue  # job was removed since we listed it
+            yield dict(
+                type='job', app_name=app_name, job_id=job_id, state=state,
+                retry_count=_as_int(retry_count) or 0,
+                num_complete_parents=_as_int(num_complete_parents) or 0,
+                priority=_as_int(priority),
+                blocked=blocked is not None,
+                execute_locked=execute_locked.get(job_id, False))
+
+
+def _iter_queue_records(app_name):
+    q = shared.get_qbclient().LockingQueue(app_name)
+    for job_id, taken in q.iter_items():
+        yield dict(
+            type='queued', app_name=app_name, job_id=job_id, taken=taken)
+
+
+def export_snapshot(fp, app_names, batch_size=1000):
+    """Write the job states and queue contents of the given apps to the
+    file object, `fp`, as newline delimited json.
+    Return the number of records written
+
+    `batch_size` (int) max num jobs to read from the queue backend at a time
+    """
+    n = 0
+    for app_name in app_names:
+        records = itertools.chain(
+            _iter_job_records(app_name, batch_size),
+            _iter_queue_records(app_name))
+        for record in records:
+            fp.write(simplejson.dumps(record, sort_keys=True))
+            fp.write('\n')
+            n += 1
+        log.info("Exported snapshot of app", extra=dict(app_name=app_name))
+    return n
+
+
+def open_snapshot(filename, mode='r', compress=None):
+    """Open a snapshot file for reading or writing text.
+    Use gzip compression if `compress` is True, or if it's None and the
+    filename ends with .gz.  A filename of "-" means stdin or stdout
+    """
+    if compress is None:
+        compress = filename.endswith('.gz')
+    if filename == '-':
+        if compress:
+            raise UserWarning("Cannot gzip a snapshot on stdin or stdout")
+        return sys.stdin if mode == 'r' else sys.stdout
+    if compress:
+        return gzip.open(filename, mode + ('t' if six.PY3 else 'b'))
+    return open(filename, mode)
+
+
+def read_snapshot(fp):
+    """Yield records from a snapshot file object"""
+    for line in fp:
+        yield simplejson.loads(line)
@@ -0,0 +1,126 @@
+"""
+Cheap counts of each app's jobs by state, for dashboards and monitoring.
+
+Whenever a job changes state, a counter for its app and state is updated
+(see _set_state_unsafe), and likewise when a job is blocked waiting on its
+parents or unblocked.  Reading the counters of any number of apps takes one
+get_many call, plus one call per app to get its queue size, so reading
+status never scans queues or jobs.
+
+Apps also count the num seconds their jobs took to run (see
+record_duration), which critical_path uses to estimate when jobs complete.
+
+The counters aren't updated atomically with the job's state, so they may
+drift if a process dies at the wrong moment, or if jobs were created before
+counters existed.  recount() scans an app's jobs and resets its counters.
+"""
+from os.path import join
+import itertools
+
+from stolos import exceptions
+from . import shared
+from . import log
+
+
+# counters of jobs kept per app
+COUNTERS = (
+    shared.PENDING, shared.COMPLETED, shared.FAILED, shared.SKIPPED,
+    'blocked')
+
+
+def get_counter_path(app_name, name):
+    return join(app_name, 'status', name)
+
+
+def _inc(app_name, name, value):
+    shared.get_qbclient().increment(get_counter_path(app_name, name), value)
+
+
+def get_state_counter_changes(old_state, new_state):
+    """Return [(counter, value to add), ...] for a job that changed from
+    `old_state` (None if the job is new) to `new_state`"""
+    if old_state == new_state:
+        return []
+    rv = [(new_state, 1)]
+    if old_state is not None:
+        rv.append((old_state, -1))
+    return rv
+
+
+def update_state_counters(app_name, old_state, new_state):
+    """A job of the given app changed from `old_state` (None if the job is
+    new) to `new_state`"""
+    for name, value in get_state_counter_changes(old_state, new_state):
+        _inc(app_name, name, value)
+
+
+def update_blocked_counter(app_name, value):
+    _inc(app_name, 'blocked', value)
+
+
+def get_duration_path(app_name, job_id):
+    return shared.get_job_path(app_name, job_id, 'duration')
+
+
+def record_duration(app_name, job_id, seconds):
+    """Remember how many seconds a job took to run, and add it to its app's
+    total, so the duration of its jobs can be estimated"""
+    qbcli = shared.get_qbclient()
+    path = get_duration_path(app_name, job_id)
+    try:
+        qbcli.set(path, repr(float(seconds)))
+    except exceptions.NoNodeError:
+        qbcli.create(path, repr(float(seconds)))
+    _inc(app_name, 'duration_ms', int(seconds * 1000))
+    _inc(app_name, 'num_durations', 1)
+
+
+def get_status(app_names):
+    """Return {app_name: {counter: count, ..., 'queue_size': n}} where
+    queue_size counts jobs in the queue, whether or not they are taken"""
+    qbcli = shared.get_qbclient()
+    values = qbcli.get_many([
+        get_counter_path(app_name, name)
+        for app_name in app_names for name in COUNTERS])
+    n = len(COUNTERS)
+    rv = {}
+    for i, app_name in enumerate(app_names):
+        counts = dict(
+            (name, int(value or 0))
+            for name, value in zip(COUNTERS, values[i * n:(i + 1) * n]))
+        counts['queue_size'] = qbcli.LockingQueue(app_name).size(
+            queued=True, taken=True)
+        rv[app_name] = counts
+    return rv
+
+
+def recount(app_name, batch_size=1000):
+    """Scan every job of the given app and reset its counters.  This is slow.
+    Return the new counts"""
+    qbcli = shared.get_qbclient()
+    counts = dict((name, 0) for name in COUNTERS)
+    job_ids = qbcli.iter_children(shared.get_all_subtasks_path(app_name))
+    seen = set()
+    while True:
+        batch = [x for x in itertools.islice(job_ids, batch_size)
+                 if x not in seen]
+        if not batch:
+            break
+        seen.update(batch)
+        values = qbcli.get_many([
+            path for job_id in batch for path in (
+                shared.get_job_path(app_name, job_id),
+                shared.get_job_path(app_name, job_id, 'blocked'))])
+        for state, blocked in zip(values[::2], values[1::2]):
+            if state in counts:
+                counts[state] += 1
+            if blocked is not None:
+                counts['blocked'] += 1
+    for name, count in counts.items():
+        path = get_counter_path(app_name, name)
+        try:
+            qbcli.set(path, str(count))
+        except exceptions.NoNodeError:
+            qbcli.create(path, str(count))
+    log.info("Recounted job states", extra=dict(app_name=app_name, **counts))
+    return counts
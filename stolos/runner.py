@@ -3,13 +3,16 @@ This code fetches jobs from the queue, decides whether to run jobs, and then
 runs them or manipulates its own and parent/child queues
 """
 import importlib
+import time
 
 from stolos import argparse_shared as at
 from stolos import log
 from stolos import dag_tools as dt, exceptions
 from stolos import queue_backend as qb
 from stolos import configuration_backend as cb
-from stolos.initializer import initialize
+from stolos import metrics
+from stolos import profiling
+from stolos.initializer import initialize, cached_parser
 
 
 def main(ns):
@@ -32,18 +35,33 @@ def main(ns):
         return
 
     log.info("Beginning Stolos", extra=dict(**ns.__dict__))
+    timings = Timings(ns.app_name)
+    outcome = 'error'
+    try:
+        with profiling.profile(ns, lambda: (ns.app_name, ns.job_id)):
+            outcome = _main(ns, timings)
+    finally:
+        timings.log(ns.job_id, outcome)
+
+
+def _main(ns, timings):
+    """Fetch a job and run it, timing each phase.  Return what happened to
+    the job, ie "completed" or "lock_failed" """
     q = qb.get_qbclient().LockingQueue(ns.app_name)
     if ns.job_id:
-        lock = _handle_manually_given_job_id(ns)
+        with timings('get_lock'):
+            lock = _handle_manually_given_job_id(ns)
         q.consume = object  # do nothing
     else:
-        ns.job_id = q.get(timeout=ns.timeout)
+        with timings('dequeue'):
+            ns.job_id = q.get(timeout=ns.timeout)
         if not validate_job_id(app_name=ns.app_name, job_id=ns.job_id,
                                q=q, timeout=ns.timeout):
-            return
+            return 'no_job' if ns.job_id is None else 'invalid_job_id'
         try:
-            lock = get_lock_if_job_is_runnable(
-                app_name=ns.app_name, job_id=ns.job_id)
+            with timings('get_lock'):
+                lock = get_lock_if_job_is_runnable(
+                    app_name=ns.app_name, job_id=ns.job_id)
         except exceptions.NoNodeError:
             q.consume()
             log.exception(
@@ -51,7 +69,7 @@ def main(ns):
                 " exist?  The Queue backend may be in an inconsistent state."
                 " Consuming this job",
                 extra=dict(app_name=ns.app_name, job_id=ns.job_id))
-            return
+            return 'no_state'
 
     log.debug(
         "Stolos got a job_id.", extra=dict(
@@ -60,20 +78,32 @@ def main(ns):
         # infinite loop: some jobs will always requeue if lock is unobtainable
         log.info("Could not obtain a lock.  Will requeue and try again later",
                  extra=dict(app_name=ns.app_name, job_id=ns.job_id))
-        _send_to_back_of_queue(
-            q=q, app_name=ns.app_name, job_id=ns.job_id)
-        return
+        with timings('requeue'):
+            if qb.check_state(ns.app_name, ns.job_id, pending=True):
+                _send_to_back_of_queue(
+                    q=q, app_name=ns.app_name, job_id=ns.job_id,
+                    delay=_requeue_delay(ns))
+            else:
+                # the job was queued twice.  requeueing it as is would cycle
+                # it through the queue forever, so reset it to pending
+                _readd_to_back_of_queue(q, ns.app_name, ns.job_id)
+        return 'lock_failed'
 
-    if not parents_completed(ns.app_name, ns.job_id, q=q, lock=lock):
-        return
+    with timings('parents_completed'):
+        runnable = parents_completed(
+            ns.app_name, ns.job_id, q=q, lock=lock, ns=ns)
+    if not runnable:
+        return 'parents_not_completed'
 
     log.info(
         "Job starting!", extra=dict(app_name=ns.app_name, job_id=ns.job_id))
     try:
-        ns.job_type_func(ns=ns)
+        with timings('execute'):
+            ns.job_type_func(ns=ns)
     except exceptions.CodeError:  # assume error is previously logged
-        _handle_failure(ns, q, lock)
-        return
+        with timings('handle_failure'):
+            _handle_failure(ns, q, lock)
+        return 'failed'
     except Exception as err:
         log.exception(
             ("Job failed!  Unhandled exception in an application!"
@@ -81,21 +111,83 @@ def main(ns):
              " it is unclear how to handle this failure.  %s: %s")
             % (err.__class__.__name__, err), extra=dict(
                 app_name=ns.app_name, job_id=ns.job_id, failed=True))
-        return
-    _handle_success(ns, q, lock)
+        return 'unhandled_exception'
+    _handle_success(ns, q, lock, timings)
+    return 'completed'
+
 
+class Timings(object):
+    """Num seconds that one run of the runner spent in each phase:
+        dequeue - waiting for a job_id from the queue
+        get_lock - checking the job is pending and obtaining its lock
+        parents_completed - checking (and maybe queueing) parents
+        execute - running the job with its plugin
+        set_completed - marking the job completed and queueing its children
+        consume_release - removing the job from its queue, releasing its lock
+    and requeue or handle_failure, if the job didn't complete.
+
+    Each phase is also observed in the metrics.REGISTRY histogram,
+    runner_phase_seconds.  Use it as a context manager:
+
+        with timings('execute'):
+            ...
+    """
+    def __init__(self, app_name):
+        self.app_name = app_name
+        self.phases = []
 
-def parents_completed(app_name, job_id, q, lock):
-    """Ensure parents are completed and if they aren't, return False"""
+    def __call__(self, phase):
+        return _PhaseTimer(self, phase)
+
+    def add(self, phase, seconds):
+        self.phases.append((phase, seconds))
+        metrics.REGISTRY.observe(
+            'runner_phase_seconds', seconds, app=self.app_name, phase=phase)
+
+    def log(self, job_id, outcome):
+        """Log the time spent in each phase and count the outcome"""
+        metrics.REGISTRY.inc('runner_jobs', app=self.app_name, outcome=outcome)
+        extra = dict(
+            ('%s_seconds' % phase, round(seconds, 6))
+            for phase, seconds in self.phases)
+        total = sum(seconds for _, seconds in self.phases)
+        execute = dict(self.phases).get('execute', 0)
+        log.info("Job timings", extra=dict(
+            app_name=self.app_name, job_id=job_id, outcome=outcome,
+            total_seconds=round(total, 6),
+            scheduling_seconds=round(total - execute, 6), **extra))
+
+
+class _PhaseTimer(object):
+    def __init__(self, timings, phase):
+        self._timings = timings
+        self._phase = phase
+
+    def __enter__(self):
+        self._start = time.time()
+
+    def __exit__(self, *exc_info):
+        self._timings.add(self._phase, time.time() - self._start)
+
+
+def parents_completed(app_name, job_id, q, lock, ns=None):
+    """Ensure parents are completed and if they aren't, return False
+
+    `ns` (optional) - if given, back off according to the ns.requeue_delay
+        option when sending the job to the back of the queue
+    """
     parents_completed, consume_queue, parent_lock = \
         qb.ensure_parents_completed(app_name=app_name, job_id=job_id)
     if parents_completed is False:
         if consume_queue:
+            # the parent we locked promises to requeue us when it completes
+            parent_lock is not None and qb.block_subtask(app_name, job_id)
             q.consume()
             parent_lock is not None and parent_lock.release()
-        else:
+        elif not qb.park_subtask(app_name, job_id, q=q):
             _send_to_back_of_queue(
-                q=q, app_name=app_name, job_id=job_id)
+                q=q, app_name=app_name, job_id=job_id,
+                delay=_requeue_delay(ns) if ns is not None else 0)
         lock.release()
         return False
     else:
@@ -179,19 +271,59 @@ def get_lock_if_job_is_runnable(app_name, job_id):
     return l
 
 
-def _send_to_back_of_queue(q, app_name, job_id):
-    # this exists so un-runnable tasks don't hog the front of the queue
-    # and soak up resources
+def _backoff(base_delay, attempt, max_delay):
+    """Return num seconds to delay the nth attempt, doubling on each attempt"""
+    return min(base_delay * 2 ** max(attempt - 1, 0), max_delay)
+
+
+def _requeue_delay(ns):
+    """Num seconds to hide a job that can't run yet from its queue"""
+    if not ns.requeue_delay:
+        return 0
+    return _backoff(
+        ns.requeue_delay, qb.inc_requeue_count(ns.app_name, ns.job_id),
+        ns.max_delay)
+
+
+def _retry_delay(ns):
+    """Num seconds to hide a failed job from its queue before retrying it"""
+    if not ns.retry_delay:
+        return 0
+    return _backoff(
+        ns.retry_delay, qb.get_retry_count(ns.app_name, ns.job_id),
+        ns.max_delay)
+
+
+def _readd_to_back_of_queue(q, app_name, job_id):
+    """Queue the job again with its state reset to pending, and consume the
+    item this process got from the queue.  Return False if the job couldn't
+    be queued again"""
     try:
         qb.readd_subtask(app_name, job_id, _force=True)
-        q.consume()
-        log.info(
-            "Job sent to back of queue",
-            extra=dict(app_name=app_name, job_id=job_id))
     except exceptions.JobAlreadyQueued:
         log.info(
             "Job already queued. Cannot send to back of queue.",
             extra=dict(app_name=app_name, job_id=job_id))
+        return False
+    q.consume()
+    log.info(
+        "Job sent to back of queue",
+        extra=dict(app_name=app_name, job_id=job_id))
+    return True
+
+
+def _send_to_back_of_queue(q, app_name, job_id, delay=0):
+    # this exists so un-runnable tasks don't hog the front of the queue
+    # and soak up resources
+    try:
+        q.requeue(delay=delay)
+    except exceptions.NotTaken:
+        # we didn't get this job from the queue (ie. --job_id was given)
+        _readd_to_back_of_queue(q, app_name, job_id)
+        return
+    log.info(
+        "Job sent to back of queue",
+        extra=dict(app_name=app_name, job_id=job_id, delay=delay))
 
 
 def _handle_failure(ns, q, lock):
@@ -203,23 +335,72 @@ def _handle_failure(ns, q, lock):
         q.consume()
     else:
         _send_to_back_of_queue(
-            q=q, app_name=ns.app_name, job_id=ns.job_id)
+            q=q, app_name=ns.app_name, job_id=ns.job_id,
+            delay=_retry_delay(ns))
     if lock:
         lock.release()
     log.warn("Job failed", extra=dict(
         job_id=ns.job_id, app_name=ns.app_name, failed=True))
 
 
-def _handle_success(ns, q, lock):
-    qb.set_state(
-        app_name=ns.app_name, job_id=ns.job_id, completed=True)
-    q.consume()
-    lock.release()
+def _handle_success(ns, q, lock, timings):
+    with timings('set_completed'):
+        qb.set_state(
+            app_name=ns.app_name, job_id=ns.job_id, completed=True)
+        qb.record_duration(
+            ns.app_name, ns.job_id, dict(timings.phases)['execute'])
+    with timings('consume_release'):
+        q.consume()
+        lock.release()
     log.info(
         "successfully completed job",
         extra=dict(app_name=ns.app_name, job_id=ns.job_id, completed=True))
 
 
+build_arg_parser = at.build_arg_parser([at.group(
+    "Runtime options",
+    at.app_name,
+    at.add_argument(
+        '--bypass_scheduler', action='store_true', help=(
+            "Run a task directly. Do not schedule it."
+            "  Do not obtain a lock on this job."
+            "  Requires passing --job_id")),
+    at.add_argument(
+        '--timeout', type=int, default=2,
+        help='time to wait for task to appear in queue before dying'),
+    at.add_argument(
+        '--max_retry', type=int, default=5,
+        help='Maximum number of times to retry a failed task.'),
+    at.add_argument(
+        '--retry_delay', type=float, default=0, help=(
+            "Num seconds to hide a failed task from its queue before it"
+            " is retried.  The delay doubles on each retry, up to"
+            " --max_delay.  By default, retry immediately")),
+    at.add_argument(
+        '--requeue_delay', type=float, default=0, help=(
+            "Num seconds to hide a task that can't run yet (because its"
+            " parents are not completed or it is locked) from its queue."
+            "  The delay doubles each time the task is sent to the back"
+            " of its queue, up to --max_delay."
+            "  By default, requeue immediately")),
+    at.add_argument(
+        '--max_delay', type=float, default=600, help=(
+            "Max num seconds that --retry_delay or --requeue_delay may"
+            " hide a task from its queue")),
+    at.add_argument(
+        '--job_id', help=(
+            'run a specific job_id. If a job is already queued,'
+            ' it will run twice')),
+)], description=(
+    "This script intelligently executes your application's jobs."
+    " Specifically, an instance of this script fetches exactly 1 job"
+    " from your application's queue, decides how to perform those jobs,"
+    " and then dies.  Because jobs are managed in a DAG, Stolos may choose"
+    " to delay execution of a job until dependencies have been met."
+    " It may also queue child or parent jobs depending on their status."),
+)
+
+
 def build_arg_parser_and_parse_args():
     # """
     # Get an argparse.Namespace from sys.argv,
@@ -227,43 +408,18 @@ def build_arg_parser_and_parse_args():
     # And recreate the namespace with arguments specific to that plugin module
     # """
 
-    parser = at.build_arg_parser([at.group(
-        "Runtime options",
-        at.app_name,
-        at.add_argument(
-            '--bypass_scheduler', action='store_true', help=(
-                "Run a task directly. Do not schedule it."
-                "  Do not obtain a lock on this job."
-                "  Requires passing --job_id")),
-        at.add_argument(
-            '--timeout', type=int, default=2,
-            help='time to wait for task to appear in queue before dying'),
-        at.add_argument(
-            '--max_retry', type=int, default=5,
-            help='Maximum number of times to retry a failed task.'),
-        at.add_argument(
-            '--job_id', help=(
-                'run a specific job_id. If a job is already queued,'
-                ' it will run twice')),
-    )], description=(
-        "This script intelligently executes your application's jobs."
-        " Specifically, an instance of this script fetches exactly 1 job"
-        " from your application's queue, decides how to perform those jobs,"
-        " and then dies.  Because jobs are managed in a DAG, Stolos may choose"
-        " to delay execution of a job until dependencies have been met."
-        " It may also queue child or parent jobs depending on their status."),
-    )
     parser, ns = initialize(
-        [parser(), dt, cb, qb],
+        [build_arg_parser, dt, cb, qb, metrics, profiling],
         parse_known_args=True)
 
-    # get plugin parser
+    # get plugin parser.  (the pyspark plugin's parser depends on the app)
     plugin = importlib.import_module(
         'stolos.plugins.%s_plugin' % dt.get_job_type(ns.app_name))
-    ns = at.build_arg_parser(
-        parents=[parser, plugin.build_arg_parser()],
-        add_help=True
-    ).parse_args()
+    ns = cached_parser(
+        (parser, plugin, ns.app_name), lambda: at.build_arg_parser(
+            parents=[parser, plugin.build_arg_parser()],
+            add_help=True
+        )).parse_args()
     ns.job_type_func = plugin.main
     return ns
 
@@ -0,0 +1,55 @@
+import nose.tools as nt
+import os
+import tempfile
+
+from stolos import testing_tools as tt
+from stolos import configuration_backend as cb
+from stolos import dag_tools as dt
+from stolos import get_NS
+from stolos.configuration_backend.json_config import (
+    JSONMapping, JSONSequence)
+from stolos.configuration_backend.mmap_config import MmapMapping, write_mmap
+
+
+def get_results(app1, job_id1, autofill1, child, child_job_id):
+    return dict(
+        edges=sorted(dt.build_dag().edges(keys=True)),
+        templates=[dt.get_job_id_template(x) for x in [app1, autofill1]],
+        parents=sorted(dt.get_parents(child, child_job_id, True)),
+        children=sorted(dt.get_children(app1, job_id1, True)))
+
+
+@tt.with_setup
+def test_mmap_mapping(func_name, app1, job_id1, autofill1, topological_sort1,
+                      depends_on_job_id1):
+    args = (app1, job_id1, autofill1, topological_sort1, depends_on_job_id1)
+    expected = get_results(*args)
+    tasks = cb.get_tasks_config().to_dict()
+    fp = tempfile.mkstemp(prefix='tasks_mmap', suffix=func_name)[1]
+    try:
+        write_mmap(dt.compile_dag(), fp)
+        ns = get_NS()
+        ns.tasks_mmap = fp
+        ns.configuration_backend = MmapMapping
+
+        td = cb.get_tasks_config()
+        nt.assert_is_instance(td, MmapMapping)
+        nt.assert_equal(len(td), len(tasks))
+        nt.assert_equal(sorted(td), sorted(tasks))
+        nt.assert_is_instance(td[app1], JSONMapping)
+        nt.assert_is_instance(td[topological_sort1]['depends_on']['dep1'],
+                              JSONSequence)
+        nt.assert_dict_equal(td.to_dict(), tasks)
+        with nt.assert_raises(KeyError):
+            td['appNotExist']
+
+        nt.assert_is_not_none(dt.node.get_compiled(td))
+        nt.assert_dict_equal(get_results(*args), expected)
+
+        # the graph is cached until the file is compiled again
+        dag = dt.get_dag()
+        nt.assert_is(dt.get_dag(), dag)
+        write_mmap(dt.compile_dag(), fp)
+        nt.assert_is_not(dt.get_dag(), dag)
+    finally:
+        os.remove(fp)
@@ -1,7 +1,7 @@
 from stolos import testing_tools as tt
 import nose.tools as nt
 from stolos.configuration_backend.redis_config import (
-    RedisMapping, set_config)
+    RedisMapping, set_config, rebuild_app_index, migrate_to_json)
 from stolos.configuration_backend.json_config import (
     JSONMapping, JSONSequence)
 
@@ -36,9 +36,9 @@ def post_initialize(func_name):
 
 
 def teardown_redis(raw, cli, func_name):
-    assert cli.delete(
-        *(REDIS_PREFIX % (func_name, app_name)
-          for app_name in raw)), \
+    app_names = [REDIS_PREFIX % (func_name, app_name) for app_name in raw]
+    cli.srem('__app_names__', *app_names)
+    assert cli.delete(*app_names), \
         "Oops did not clean up redis properly"
 
 
@@ -86,7 +86,7 @@ def test_set_config(app1, cli, td):
     nt.assert_in('key1', td[app1])
     nt.assert_equal(1, td[app1]['key1'])
     td = RedisMapping()  # reset's RedisMapping's cache, from prev line
-    set_config(app1, dct, cli=cli)
+    nt.assert_equal(set_config(app1, dct, cli=cli), [True])
     nt.assert_in('key1', td[app1])
     nt.assert_equal(1, td[app1]['key1'])
 
@@ -106,3 +106,119 @@ def test_set_config(app1, cli, td):
 
     nt.assert_list_equal(list(td[app1][3]), dct[3])
     nt.assert_dict_equal(dict(td[app1][4]), dct[4])
+
+
+@with_setup
+def test_set_config_json(func_name, cli):
+    prefix = REDIS_PREFIX % (func_name, 'prefix/')
+    td = RedisMapping()
+    td.redis_key_prefix = prefix
+    dct = {'a': 1, 2: [1, {'b': None}], 'c': {'d': 1.5}}
+    try:
+        set_config('app1', dct, cli=cli, redis_key_prefix=prefix)
+        nt.assert_equal(
+            cli.hget(prefix + 'app1', '__stolos_encoding__'), b'json1')
+        nt.assert_equal(sorted(td['app1'], key=str), [2, 'a', 'c'])
+        nt.assert_equal(td['app1']['a'], 1)
+        nt.assert_equal(td['app1'][2][0], 1)
+        nt.assert_equal(td['app1'][2][1]['b'], None)
+        nt.assert_dict_equal(dict(td['app1']['c']), dct['c'])
+
+        # json can't store nested dicts with non-string keys
+        with nt.assert_raises(TypeError):
+            set_config(
+                'app1', {'a': {1: 1}}, cli=cli, redis_key_prefix=prefix)
+    finally:
+        cli.delete(*cli.keys(prefix + '*'))
+
+
+@with_setup
+def test_migrate_to_json(func_name, cli, raw):
+    prefix = REDIS_PREFIX % (func_name, 'prefix/')
+    td = RedisMapping()
+    td.redis_key_prefix = prefix
+    try:
+        for app_name, app_conf in raw.items():  # the original encoding
+            cli.hmset(prefix + app_name, app_conf)
+        set_config('app3', {'a': 1}, cli=cli, redis_key_prefix=prefix)
+        rebuild_app_index(cli, prefix)
+
+        nt.assert_equal(
+            sorted(migrate_to_json(cli, prefix)), ['app1', 'app2'])
+        nt.assert_equal(
+            cli.hget(prefix + 'app1', '__stolos_encoding__'), b'json1')
+        nt.assert_equal(td['app1']['key1'], 1)
+        nt.assert_equal(td['app1'][2], 2)
+        nt.assert_list_equal(list(td['app1'][3]), [3, 33, 333])
+        nt.assert_equal(migrate_to_json(cli, prefix), [])
+    finally:
+        cli.delete(*cli.keys(prefix + '*'))
+
+
+@with_setup
+def test_iter_len(func_name, cli):
+    prefix = REDIS_PREFIX % (func_name, 'prefix/')
+    td = RedisMapping()
+    td.redis_key_prefix = prefix
+    try:
+        set_config('app1', {'a': 1}, cli=cli, redis_key_prefix=prefix)
+        set_config('app2', {'a': 2}, cli=cli, redis_key_prefix=prefix)
+        cli.set(prefix + 'notahash', 1)
+
+        # list apps from the index
+        nt.assert_equal(sorted(td), ['app1', 'app2'])
+        nt.assert_equal(len(td), 2)
+        nt.assert_equal(td['app2']['a'], 2)
+
+        # without an index, scan for apps
+        cli.delete(prefix + '__app_names__')
+        td = RedisMapping()
+        td.redis_key_prefix = prefix
+        nt.assert_equal(sorted(td), ['app1', 'app2'])
+        nt.assert_equal(len(td), 2)
+
+        nt.assert_equal(rebuild_app_index(cli, prefix), 2)
+        nt.assert_equal(
+            sorted(cli.smembers(prefix + '__app_names__')),
+            [b'app1', b'app2'])
+    finally:
+        cli.delete(*cli.keys(prefix + '*'))
+
+
+@with_setup
+def test_shared_cache(func_name, cli):
+    prefix = REDIS_PREFIX % (func_name, 'prefix/')
+    td = RedisMapping()
+    td.redis_key_prefix = prefix
+    try:
+        set_config('app1', {'a': 1}, cli=cli, redis_key_prefix=prefix)
+        set_config('app2', {'a': 2}, cli=cli, redis_key_prefix=prefix)
+        td.shared.refresh(0)
+        nt.assert_equal(td['app1']['a'], 1)
+        nt.assert_equal(td['app2']['a'], 2)
+        nt.assert_equal(sorted(td.shared.configs), ['app1', 'app2'])
+
+        # another process changes app1
+        cli.hset(prefix + 'app1', '"a"', '3')
+        cli.hincrby(prefix + '__app_versions__', 'app1', 1)
+        cli.incr(prefix + '__config_version__')
+
+        td2 = RedisMapping()
+        td2.redis_key_prefix = prefix
+        td2.shared.refresh(0)
+        nt.assert_equal(sorted(td2.shared.configs), ['app2'])
+        nt.assert_equal(td2['app1']['a'], 3)
+        nt.assert_equal(td['app1']['a'], 1)
+
+        # changes made by this process are visible immediately
+        set_config('app2', {'a': 4}, cli=cli, redis_key_prefix=prefix)
+        nt.assert_equal(RedisMapping(td2)['app2']['a'], 4)
+
+        # without a version counter, changes can't be detected. don't cache
+        cli.delete(prefix + '__config_version__')
+        td2.shared.refresh(0)
+        nt.assert_equal(td2.shared.configs, {})
+        td2['app1']
+        nt.assert_equal(td2.shared.configs, {})
+    finally:
+        cli.delete(*cli.keys(prefix + '*'))
@@ -25,4 +25,14 @@ with_setup = tt.with_setup_factory(
 )
 
 
+def backend_with_setup_factory(setup_backend, teardown_backend):
+    """Create a `@with_setup` that runs tests against the queue backend
+    configured by `setup_backend(func_name)` rather than the default one"""
+    return tt.with_setup_factory(
+        (tt.setup_job_ids, setup_qb, setup_backend),
+        (teardown_backend, ),
+        (lambda: dict(qbcli=get_NS().queue_backend), )
+    )
+
+
 with_setup, setup_qb
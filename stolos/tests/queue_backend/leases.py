@@ -0,0 +1,49 @@
+"""
+Checks that a queue backend's locks and taken queue items expire if their
+owner dies.  test_return_values runs them against the default queue backend,
+and the test module of each backend with leases runs them against its own.
+"""
+from nose.plugins.skip import SkipTest
+import nose.tools as nt
+
+
+def _get_expire_leases(qbcli):
+    """Return the queue backend's hook that pretends the owners of all locks
+    and taken items at or beneath a path died.  Skip the test if the queue
+    backend's leases can't expire"""
+    if not hasattr(qbcli, '_expire_leases'):
+        raise SkipTest("%s has no leases to expire" % qbcli.__name__)
+    return qbcli._expire_leases
+
+
+def check_Lock_expires(qbcli, app1):
+    expire_leases = _get_expire_leases(qbcli)
+    lock = qbcli.Lock(app1)
+    lock2 = qbcli.Lock(app1)
+    nt.assert_true(lock.acquire())
+    nt.assert_false(lock2.acquire())
+
+    expire_leases(app1)
+    nt.assert_false(lock.is_locked())
+    nt.assert_true(lock2.acquire())
+    nt.assert_true(lock.is_locked())
+    with nt.assert_raises(UserWarning):
+        lock.release()
+    lock2.release()
+
+
+def check_LockingQueue_taken_item_expires(qbcli, app1, item1, item2):
+    expire_leases = _get_expire_leases(qbcli)
+    queue = qbcli.LockingQueue(app1)
+    queue2 = qbcli.LockingQueue(app1)
+    queue.put(item1)
+    queue.put(item2)
+    nt.assert_equal(queue.get(), item1)
+
+    expire_leases(app1)
+    nt.assert_equal(queue2.get(), item1)
+    # the expired owner can no longer consume the item
+    queue.consume()
+    nt.assert_equal(queue.size(), 2)
+    queue2.consume()
+    nt.assert_equal(sorted(queue.iter_items()), [(item2, False)])
@@ -0,0 +1,120 @@
+from nose.plugins.skip import SkipTest
+import nose.tools as nt
+from os.path import join
+import six
+import threading
+
+from stolos import api
+from stolos import exceptions
+from stolos import queue_backend as qb
+from stolos import testing_tools as tt
+from . import with_setup
+
+if six.PY3:
+    import asyncio
+    from stolos.queue_backend import aio
+
+
+def _skip_py2():
+    if six.PY2:
+        raise SkipTest("asyncio requires Python 3")
+
+
+def _check_client(aqbcli, qbcli, app, item1, item2):
+    loop = asyncio.new_event_loop()
+    run = loop.run_until_complete
+    try:
+        path = join(app, 'key')
+        nt.assert_false(run(aqbcli.exists(path)))
+        with nt.assert_raises(exceptions.NoNodeError):
+            run(aqbcli.get(path))
+        with nt.assert_raises(exceptions.NoNodeError):
+            run(aqbcli.set(path, 'a'))
+        run(aqbcli.create(path, ''))
+        nt.assert_equal(run(aqbcli.get(path)), '')
+        with nt.assert_raises(exceptions.NodeExistsError):
+            run(aqbcli.create(path, 'a'))
+        run(aqbcli.set(path, 'b'))
+        nt.assert_equal(qbcli.get(path), 'b')
+        nt.assert_equal(
+            run(aqbcli.get_many([path, join(app, 'nokey')])), ['b', None])
+        nt.assert_equal(run(aqbcli.increment(join(app, 'count'), 2)), 2)
+
+        lock = aqbcli.Lock(join(app, 'lock'))
+        nt.assert_true(run(lock.acquire()))
+        nt.assert_true(run(lock.is_locked()))
+        nt.assert_false(qbcli.Lock(join(app, 'lock')).acquire())
+        run(lock.release())
+        nt.assert_false(run(lock.is_locked()))
+        with nt.assert_raises(UserWarning):
+            run(lock.release())
+
+        q = aqbcli.LockingQueue(app)
+        run(q.put(item1))
+        run(q.put(item2))
+        nt.assert_equal(run(q.size()), 2)
+        nt.assert_true(run(q.is_queued(item2)))
+        nt.assert_equal(run(q.get()), item1)
+        run(q.consume())
+        nt.assert_false(run(q.is_queued(item1)))
+        nt.assert_equal(qbcli.LockingQueue(app).size(), 1)
+    finally:
+        loop.close()
+
+
+@with_setup
+def test_client(qbcli, app1, app2, item1, item2):
+    _skip_py2()
+    _check_client(aio.get_qbclient(), qbcli, app1, item1, item2)
+    _check_client(aio.ThreadedClient(qbcli), qbcli, app2, item1, item2)
+
+
+def test_ThreadedObject_created_in_calling_thread():
+    _skip_py2()
+    threads = []
+
+    class Obj(object):
+        def __init__(self, path):
+            threads.append(threading.current_thread())
+
+        def get(self):
+            threads.append(threading.current_thread())
+
+    loop = asyncio.new_event_loop()
+    try:
+        obj = aio.ThreadedObject(Obj, 'path')
+        loop.run_until_complete(obj.get())
+    finally:
+        loop.close()
+    nt.assert_equal(len(threads), 2)
+    nt.assert_is(threads[0], threading.current_thread())
+    nt.assert_is_not(threads[1], threading.current_thread())
+
+
+@tt.with_setup
+def test_maybe_add_subtask(app1, job_id1, job_id2, job_id3):
+    _skip_py2()
+    loop = asyncio.new_event_loop()
+    run = loop.run_until_complete
+    try:
+        nt.assert_equal(run(aio.gather(
+            (aio.maybe_add_subtask(app1, x) for x in [job_id1, job_id2]),
+            limit=1)), [True, True])
+        nt.assert_false(run(aio.maybe_add_subtask(app1, job_id1)))
+        nt.assert_true(run(aio.maybe_add_subtask(app1, job_id3, priority=5)))
+
+        nt.assert_equal(
+            run(aio.check_state(
+                app1, [job_id1, job_id2, job_id3], pending=True)),
+            qb.check_state(app1, [job_id1, job_id2, job_id3], pending=True))
+        nt.assert_equal(run(aio.check_state(app1, job_id1, _get=True)),
+                        'pending')
+        nt.assert_false(run(aio.check_state(app1, 'nojob', pending=True)))
+        with nt.assert_raises(exceptions.NoNodeError):
+            run(aio.check_state(app1, 'nojob', raise_if_not_exists=True))
+    finally:
+        loop.close()
+    nt.assert_equal(qb.get_qbclient().LockingQueue(app1).size(), 3)
+    nt.assert_equal(api.get_status([app1])[app1]['pending'], 3)
+    nt.assert_equal(qb.get_qbclient().get(
+        qb.get_job_path(app1, job_id3, 'priority')), '5')
@@ -0,0 +1,76 @@
+import nose.tools as nt
+import os
+import shutil
+import tempfile
+import time
+
+from stolos.queue_backend import qbcli_file
+from . import backend_with_setup_factory
+from . import leases
+
+
+def setup_file(func_name):
+    dirpath = tempfile.mkdtemp(prefix='qb_file', suffix=func_name)
+    return (('--queue_backend', 'file', '--qb_file_dir', dirpath),
+            dict(qb_file_dir=dirpath))
+
+
+def teardown_file(qb_file_dir):
+    shutil.rmtree(qb_file_dir)
+
+
+with_setup = backend_with_setup_factory(setup_file, teardown_file)
+
+
+@with_setup
+def test_Lock_expires(qbcli, app1):
+    leases.check_Lock_expires(qbcli, app1)
+
+
+@with_setup
+def test_LockingQueue_taken_item_expires(qbcli, app1, item1, item2):
+    leases.check_LockingQueue_taken_item_expires(qbcli, app1, item1, item2)
+
+
+@with_setup
+def test_LockingQueue_sees_new_items(qbcli, app1, item1, item2, item3):
+    queue = qbcli.LockingQueue(app1)
+    queue2 = qbcli.LockingQueue(app1)
+    queue.put(item2, 50)
+    queue.put(item3, 60)
+    nt.assert_equal(queue.get(), item2)
+    queue.consume()
+    # queue's listing is cached, so it may not see items put by others...
+    queue2.put(item1, 10)
+    nt.assert_equal(queue.get(), item3)
+    queue.consume()
+    # ...until it runs out of items
+    nt.assert_equal(queue.get(), item1)
+    queue.consume()
+
+
+@with_setup
+def test_LockingQueue_is_queued_lists_names(qbcli, app1, item1, item2, item3):
+    queue = qbcli.LockingQueue(app1)
+    queue.put(item1)
+    queue.put(item2, delay=60)
+    nt.assert_equal(queue.get(), item1)
+    queue.requeue(delay=60)
+    nt.assert_equal(queue.size(taken=False), 2)
+
+    read = qbcli_file._read
+    reads = []
+    qbcli_file._read = lambda fp: reads.append(fp) or read(fp)
+    try:
+        nt.assert_true(queue.is_queued(item1))
+        nt.assert_true(queue.is_queued(item2))
+        nt.assert_false(queue.is_queued(item3))
+        nt.assert_equal(reads, [])
+        # an entry named by an older version of Stolos, without a digest
+        with open(os.path.join(
+                qbcli_file._dir(app1), '.queue',
+                '%024.6f-%017.6f-100-1.1' % (100, time.time())), 'w') as fout:
+            fout.write(item3)
+        nt.assert_true(queue.is_queued(item3))
+    finally:
+        qbcli_file._read = read
@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+from . import backend_with_setup_factory
+from . import leases
+
+
+def setup_sqlite(func_name):
+    fp = tempfile.mkstemp(prefix='qb_sqlite', suffix=func_name)[1]
+    return (('--queue_backend', 'sqlite', '--qb_sqlite_path', fp),
+            dict(qb_sqlite_path=fp))
+
+
+def teardown_sqlite(qb_sqlite_path):
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(qb_sqlite_path + suffix):
+            os.remove(qb_sqlite_path + suffix)
+
+
+with_setup = backend_with_setup_factory(setup_sqlite, teardown_sqlite)
+
+
+@with_setup
+def test_Lock_expires(qbcli, app1):
+    leases.check_Lock_expires(qbcli, app1)
+
+
+@with_setup
+def test_LockingQueue_taken_item_expires(qbcli, app1, item1, item2):
+    leases.check_LockingQueue_taken_item_expires(qbcli, app1, item1, item2)
@@ -1,8 +1,11 @@
 import nose.tools as nt
 from os.path import join
+import time
 
 from stolos import exceptions
+from stolos import get_NS
 from . import with_setup
+from . import leases
 
 
 @with_setup
@@ -64,6 +67,25 @@ def test_set1(qbcli, app1, item1, item2):
         qbcli.set(join(app1, 'noexist'), item2)
 
 
+@with_setup
+def test_get_many(qbcli, app1, app2, item1):
+    nt.assert_equal(qbcli.get_many([]), [])
+    qbcli.create(app1, item1)
+    qbcli.create(join(app1, 'a'), '')
+    nt.assert_equal(
+        qbcli.get_many([app1, app2, join(app1, 'a')]), [item1, None, ''])
+
+
+@with_setup
+def test_iter_children(qbcli, app1, item1):
+    nt.assert_equal(list(qbcli.iter_children(app1)), [])
+    qbcli.create(join(app1, 'a'), item1)
+    qbcli.create(join(app1, 'b'), item1)
+    qbcli.create(join(app1, 'b/c'), item1)
+    nt.assert_equal(sorted(set(qbcli.iter_children(app1))), ['a', 'b'])
+    nt.assert_equal(list(qbcli.iter_children(join(app1, 'b'))), ['c'])
+
+
 @with_setup
 def test_exists1(qbcli, app1, app2, app3, item1):
     nt.assert_false(qbcli.exists(app1))
@@ -134,8 +156,16 @@ def test_Lock_is_locked(qbcli, app1, app2):
     l2 = qbcli.Lock(app1)
     nt.assert_true(l2.is_locked())
     nt.assert_false(l2.acquire())
+    nt.assert_equal(qbcli.is_locked_many([app2, app1]), [False, True])
+    nt.assert_equal(qbcli.is_locked_many([]), [])
     # cleanup
     l.release()
+    nt.assert_equal(qbcli.is_locked_many([app1]), [False])
+
+
+@with_setup
+def test_Lock_expires(qbcli, app1):
+    leases.check_Lock_expires(qbcli, app1)
 
 
 @with_setup
@@ -173,7 +203,7 @@ def test_LockingQueue_put_get(qbcli, app1, item1, item2):
     nt.assert_equal(queue.size(), 0)
 
     # fail if consuming before you've gotten anything
-    with nt.assert_raises(UserWarning):
+    with nt.assert_raises(exceptions.NotTaken):
         queue.consume()
 
     # get nothing from an empty queue (and don't fail!)
@@ -247,11 +277,131 @@ def test_LockingQueue_put_insertion_order(
     queue.consume()
 
 
+@with_setup
+def test_LockingQueue_requeue(qbcli, app1, item1, item2, item3):
+    queue = qbcli.LockingQueue(app1)
+    with nt.assert_raises(exceptions.NotTaken):
+        queue.requeue()
+
+    queue.put(item1)
+    queue.put(item2)
+    nt.assert_equal(queue.get(), item1)
+    nt.assert_is_none(queue.requeue())
+    with nt.assert_raises(exceptions.NotTaken):
+        queue.consume()
+    nt.assert_equal(queue.size(), 2)
+    nt.assert_equal(queue.size(queued=False), 0)
+    nt.assert_true(queue.is_queued(item1))
+
+    # requeued items go to the back of the queue
+    nt.assert_equal(queue.get(), item2)
+    queue.consume()
+    nt.assert_equal(queue.get(), item1)
+    queue.consume()
+
+    # requeued items may get a new priority
+    queue.put(item2, 50)
+    queue.put(item3, 60)
+    nt.assert_equal(queue.get(), item2)
+    queue.requeue(priority=70)
+    nt.assert_equal(queue.get(), item3)
+    queue.consume()
+    nt.assert_equal(queue.get(), item2)
+    queue.consume()
+    nt.assert_equal(queue.size(), 0)
+
+
+@with_setup
+def test_LockingQueue_delay(qbcli, app1, item1, item2):
+    queue = qbcli.LockingQueue(app1)
+    queue.put(item1, delay=1)
+    queue.put(item2)
+    nt.assert_equal(queue.size(), 2)
+    nt.assert_equal(queue.size(taken=False), 2)
+    nt.assert_true(queue.is_queued(item1))
+
+    # delayed items are hidden from consumers until they are due
+    nt.assert_equal(queue.get(), item2)
+    queue.requeue(delay=1)
+    nt.assert_is_none(queue.get(timeout=1))
+    nt.assert_equal(queue.size(taken=False), 2)
+    nt.assert_true(queue.is_queued(item2))
+
+    time.sleep(1.1)
+    nt.assert_equal(queue.get(), item1)
+    queue.consume()
+    nt.assert_equal(queue.get(), item2)
+    queue.consume()
+    nt.assert_equal(queue.size(), 0)
+
+
+@with_setup
+def test_LockingQueue_priority_aging(qbcli, app1, item1, item2):
+    ns = get_NS()
+    opt = 'qb_%s_priority_aging' % qbcli.__name__.split('qbcli_')[1]
+    setattr(ns, opt, .01)  # gain 1 unit of priority every .01 seconds
+    try:
+        queue = qbcli.LockingQueue(app1)
+        queue.put(item1, 150)
+        time.sleep(.6)
+        queue.put(item2, 100)
+        # the old item aged ahead of the new more urgent item
+        nt.assert_equal(queue.get(), item1)
+        queue.consume()
+        nt.assert_equal(queue.get(), item2)
+        queue.consume()
+    finally:
+        setattr(ns, opt, 0)
+
+
+@with_setup
+def test_LockingQueue_priority_aging_consumers(
+        qbcli, app1, app2, item1, item2):
+    ns = get_NS()
+    opt = 'qb_%s_priority_aging' % qbcli.__name__.split('qbcli_')[1]
+    setattr(ns, opt, .01)
+    try:
+        queue = qbcli.LockingQueue(app1)
+        queue.put(item1)
+        time.sleep(.1)
+        queue.put(item2)
+        # a taken item doesn't hide the items behind it from other consumers
+        nt.assert_equal(queue.get(), item1)
+        queue2 = qbcli.LockingQueue(app1)
+        nt.assert_equal(queue2.get(), item2)
+        queue2.consume()
+        queue.consume()
+        nt.assert_equal(queue.size(), 0)
+    finally:
+        setattr(ns, opt, 0)
+
+
+@with_setup
+def test_LockingQueue_taken_item_expires(qbcli, app1, item1, item2):
+    leases.check_LockingQueue_taken_item_expires(qbcli, app1, item1, item2)
+
+
+@with_setup
+def test_LockingQueue_iter_items(qbcli, app1, item1, item2, item3):
+    queue = qbcli.LockingQueue(app1)
+    nt.assert_equal(list(queue.iter_items()), [])
+    queue.put(item1)
+    queue.put(item2)
+    queue.put(item3, delay=60)
+    nt.assert_equal(queue.get(), item1)
+    nt.assert_equal(
+        sorted(queue.iter_items()),
+        [(item1, True), (item2, False), (item3, False)])
+    queue.consume()
+    nt.assert_equal(
+        sorted(queue.iter_items()), [(item2, False), (item3, False)])
+
+
 @with_setup
 def test_LockingQueue_consume_size(qbcli, app1, item1, item2):
     nt.assert_false(qbcli.exists(app1))
     queue = qbcli.LockingQueue(app1)
-    with nt.assert_raises(UserWarning):
+    with nt.assert_raises(exceptions.NotTaken):
         queue.consume()
 
     queue.put(item1)
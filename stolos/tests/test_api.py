@@ -1,10 +1,15 @@
 from nose import tools as nt
 from networkx import MultiDiGraph
+import logging
+import six
 
 import stolos
 from stolos import api
+from stolos import initializer
 from stolos import testing_tools as tt
 from stolos import queue_backend as qb
+from stolos.queue_backend import critical_path, status
+from stolos import util
 from stolos.exceptions import JobAlreadyQueued, InvalidJobId, NoNodeError
 from stolos.configuration_backend import TasksConfigBaseMapping
 # nt.assert_equal.im_class.maxDiff = None
@@ -76,6 +81,66 @@ def test_get_qsize(app1, job_id1, job_id2):
     nt.assert_equal(2, api.get_qsize(app1, queued=True, taken=False))
 
 
+@tt.with_setup
+def test_get_status(app1, app2, job_id1, job_id2):
+    zero = dict(pending=0, completed=0, failed=0, skipped=0, blocked=0,
+                queue_size=0)
+    nt.assert_equal(api.get_status([app1]), {app1: zero})
+    api.maybe_add_subtask(app1, job_id1)
+    api.maybe_add_subtask(app1, job_id2)
+    qb.set_state(app1, job_id1, completed=True)  # also queues app2 job_id1
+    qb.set_state(app1, job_id2, failed=True)
+    qb.block_subtask(app2, job_id1)
+    qb.block_subtask(app2, job_id1)
+    expected = {
+        app1: dict(zero, completed=1, failed=1, queue_size=2),
+        app2: dict(zero, pending=1, blocked=1, queue_size=1)}
+    nt.assert_equal(api.get_status([app1, app2]), expected)
+    nt.assert_equal(api.get_status()[app2], expected[app2])
+
+    # counters that drifted are fixed by a recount
+    qb.get_qbclient().delete(status.get_counter_path(app1, 'completed'))
+    qb.get_qbclient().increment(status.get_counter_path(app1, 'failed'), 5)
+    nt.assert_equal(
+        status.recount(app1),
+        dict(pending=0, completed=1, failed=1, skipped=0, blocked=0))
+    nt.assert_equal(api.get_status([app1]), {app1: expected[app1]})
+
+
+@tt.with_setup
+def test_get_eta(app1, app2, app3, app4, job_id1, job_id2):
+    # app4 depends on app1, app2 and app3.  app2 depends on app1
+    qb.record_duration(app1, job_id2, 10)
+    qb.record_duration(app2, job_id2, 1000)
+    qb.record_duration(app2, job_id1, 30)  # a previous run of this job
+    qb.record_duration(app3, job_id2, 5)
+    rv = api.get_eta(app4, job_id1, default_duration=1)
+    nt.assert_equal(rv['seconds'], 41)
+    nt.assert_equal(rv['critical_path'], [
+        (app1, job_id1, 10), (app2, job_id1, 30), (app4, job_id1, 1)])
+    nt.assert_equal(rv['num_jobs'], 4)
+
+    qb.set_state(app1, job_id1, completed=True)
+    rv = api.get_eta(app4, job_id1, default_duration=1)
+    nt.assert_equal(rv['seconds'], 31)
+    nt.assert_equal(rv['critical_path'], [
+        (app2, job_id1, 30), (app4, job_id1, 1)])
+    nt.assert_equal(rv['num_jobs'], 3)
+
+    qb.set_state(app3, job_id1, completed=True)
+    rv = api.get_eta(app3, job_id1)
+    nt.assert_equal(
+        (rv['seconds'], rv['critical_path'], rv['num_jobs']), (0, [], 0))
+
+    # many targets share the work
+    rv = critical_path.analyze([(app4, job_id1), (app2, job_id2)])
+    nt.assert_equal(
+        sorted((k, v['finish']) for k, v in rv.items()),
+        sorted([((app4, job_id1), 30), ((app2, job_id1), 30),
+                ((app2, job_id2), 1010), ((app1, job_id2), 10)]))
+    nt.assert_equal(rv[(app2, job_id2)]['parent'], (app1, job_id2))
+
+
 @tt.with_setup
 def test_maybe_add_subtask(app1, job_id1, job_id2, job_id3):
     # we don't queue anything if we request queue=False, but we create data for
@@ -116,6 +181,23 @@ def test_readd_subtask(app1, job_id1, job_id2):
     tt.validate_n_queued_task(app1, job_id1, job_id2)
 
 
+@tt.with_setup
+def test_requeue_count_reset(app1, job_id1):
+    # a job that was sent to the back of its queue starts counting again
+    # once it is readded or reaches a terminal state
+    qb.inc_requeue_count(app1, job_id1)
+    nt.assert_equal(qb.inc_requeue_count(app1, job_id1), 2)
+    api.readd_subtask(app1, job_id1)
+    nt.assert_equal(qb.inc_requeue_count(app1, job_id1), 1)
+
+    qb.inc_requeue_count(app1, job_id1)
+    qb.set_state(app1, job_id1, completed=True,
+                 _disable_maybe_queue_children_for_testing_only=True)
+    nt.assert_equal(qb.inc_requeue_count(app1, job_id1), 1)
+    qb.set_state(app1, job_id1, failed=True)
+    nt.assert_equal(qb.inc_requeue_count(app1, job_id1), 1)
+
+
 @tt.with_setup
 def test_get_qbclient(app1):
     qb1 = api.get_qbclient()
@@ -227,11 +309,74 @@ def test_initialize():
     nt.assert_false(hasattr(stolos, 'Uninitialized'))
 
 
+@tt.with_setup
+def test_initialize_reuses_parsers():
+    objects = [api._dt, api._cb, api._qb]
+    args = ['--configuration_backend', 'json', '--tasks_json', 'a']
+    parser, ns = initializer.initialize(objects, args=args)
+    parser2, ns2 = initializer.initialize(objects, args=args)
+    nt.assert_is(parser, parser2)
+    nt.assert_equal(ns, ns2)
+
+    args[-1] = 'b'
+    parser3, ns3 = initializer.initialize(objects, args=args)
+    nt.assert_is(parser, parser3)
+    nt.assert_equal(ns3.tasks_json, 'b')
+
+    parser4, _ = initializer.initialize(
+        objects, args=args, parse_known_args=True)
+    nt.assert_is_not(parser, parser4)
+
+
 @tt.with_setup
 def test_configure_logging(log, func_name):
     nt.assert_equal(log.name, 'stolos.tests.%s' % func_name)
 
 
+def test_configure_logging_formats_extras():
+    stream = six.StringIO()
+    log = logging.getLogger('stolos.tests.formats_extras')
+    log.handlers[:] = []
+    api.configure_logging(True, log=log, colorize=False)
+    log.handlers[0].stream = stream
+    calls = []
+    log.info('msg %s', 1, extra=dict(
+        a=1, b=util.LazyExtra(lambda x: calls.append(x) or 'lazy', 2)))
+    nt.assert_equal(calls, [2])
+    line = stream.getvalue()
+    nt.assert_true(line.startswith('INFO     msg 1    '), line)
+    nt.assert_count_equal(
+        line.rsplit('    ', 1)[1].split(), ['a=1', 'b=lazy'])
+
+    # records aren't modified by formatting
+    record = log.makeRecord(
+        log.name, logging.INFO, 'f', 1, 'msg', (), None, extra=dict(a=1))
+    log.handlers[0].format(record)
+    nt.assert_equal(record.msg, 'msg')
+    nt.assert_equal(log.handlers[0].format(record), 'INFO     msg    a=1')
+
+    # extras of disabled levels are never computed
+    log.setLevel(logging.INFO)
+    log.debug('msg', extra=dict(b=util.LazyExtra(calls.append, 3)))
+    nt.assert_equal(calls, [2])
+
+
+def test_configure_logging_async_handler():
+    stream = six.StringIO()
+    handler = logging.StreamHandler(stream)
+    log = logging.getLogger('stolos.tests.async_handler')
+    log.handlers[:] = []
+    api.configure_logging(handler, log=log, async_handler=True)
+    log.info('msg', extra=dict(a=1))
+    if six.PY2:
+        # falls back to logging synchronously
+        nt.assert_is(log.handlers[0], handler)
+    else:
+        nt.assert_is_not(log.handlers[0], handler)
+        log.handlers[0].listener.stop()
+    nt.assert_in('msg', stream.getvalue())
+
+
 @tt.with_setup
 def test_visualize_dag():
     # this should succeeed but do nothing.
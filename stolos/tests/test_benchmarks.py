@@ -0,0 +1,96 @@
+from nose import tools as nt
+import shutil
+import tempfile
+
+from stolos.benchmarks import (
+    dag_traversal, harness, queue_backend, queue_throughput, simulator)
+
+
+def test_percentile():
+    values = list(range(101))
+    nt.assert_equal(harness.percentile(values, 50), 50)
+    nt.assert_equal(harness.percentile(values, 99), 99)
+    nt.assert_equal(harness.percentile([3], 99), 3)
+    nt.assert_is_none(harness.percentile([], 50))
+    rv = harness.summarize('x', [.002, .001, .003], 1)
+    nt.assert_equal(
+        (rv['ops'], rv['ops_per_sec'], rv['p50_ms'], rv['max_ms']),
+        (3, 3, 2, 3))
+
+
+def test_queue_throughput():
+    dirpath = tempfile.mkdtemp(prefix='qb_file')
+    try:
+        ns = queue_throughput.build_arg_parser().parse_args(
+            ['-n', '2', '--num_items', '20'])
+        rv = queue_throughput.main(
+            ns, ['--queue_backend', 'file', '--qb_file_dir', dirpath])
+    finally:
+        shutil.rmtree(dirpath)
+    nt.assert_equal(rv['num_items'], 20)
+    nt.assert_equal(rv['queue_backend'], 'stolos.queue_backend.qbcli_file')
+    nt.assert_greater(rv['get_consume_per_sec'], 0)
+    nt.assert_equal([x['ops'] for x in rv['results']], [20, 20])
+
+
+def test_queue_backend():
+    dirpath = tempfile.mkdtemp(prefix='qb_file')
+    try:
+        ns = queue_backend.build_arg_parser().parse_args([
+            '--num_ops', '10', '-n', '2', '--depths', '1', '5',
+            '--fan_out', '2', '-o', dirpath + '/results.json'])
+        rv = queue_backend.main(
+            ns, ['--queue_backend', 'file', '--qb_file_dir', dirpath])
+    finally:
+        shutil.rmtree(dirpath)
+    nt.assert_equal(
+        [(x['workload'], x['ops'], x.get('queue_depth'))
+         for x in rv['results']],
+        [('bulk_put', 10, None), ('get_consume', 10, None),
+         ('lock_churn', 10, None), ('is_queued', 10, 1),
+         ('is_queued', 10, 5), ('size', 10, 1), ('size', 10, 5),
+         ('fan_out', 5, None)])
+    for x in rv['results']:
+        nt.assert_less_equal(x['p50_ms'], x['p99_ms'])
+
+
+def test_dag_traversal():
+    dirpath = tempfile.mkdtemp(prefix='dag_traversal')
+    history = dirpath + '/history.jsonl'
+    argv = ['--num_apps', '60', '--num_client_ids', '20', '--num_job_ids',
+            '10', '--compiled', '--history', history]
+    try:
+        rv, slowdowns = dag_traversal.main(
+            dag_traversal.build_arg_parser().parse_args(argv), [])
+        nt.assert_equal(slowdowns, [])
+        nt.assert_equal(
+            [x['workload'] for x in rv['results']],
+            list(dag_traversal.WORKLOADS))
+        # only runs with the same parameters are compared
+        nt.assert_equal(
+            len(dag_traversal.read_history(history, rv['params'])), 1)
+        rv2, slowdowns = dag_traversal.main(
+            dag_traversal.build_arg_parser().parse_args(
+                argv + ['--max_slowdown', '0']), [])
+        nt.assert_equal(
+            len(dag_traversal.read_history(history, rv['params'])), 2)
+        nt.assert_equal(
+            [x[0] for x in slowdowns],
+            [x['workload'] for x in rv['results'] if x['p50_ms']])
+    finally:
+        shutil.rmtree(dirpath)
+
+
+def test_simulator():
+    ns = simulator.build_arg_parser().parse_args([
+        '--num_runners', '3', '--num_apps', '12', '--num_client_ids', '2',
+        '--enqueue', 'all', '--max_seconds', '60', '-o', '/dev/null'])
+    rv = simulator.main(ns, ['--queue_backend', 'memory'])['results'][0]
+    nt.assert_false(rv['timed_out'])
+    nt.assert_equal((rv['errors'], rv['duplicate_runs']), (0, 0))
+    nt.assert_greater(rv['completed'], 0)
+    nt.assert_equal(
+        rv['dequeues'], rv['completed'] + rv['wasted_dequeues'])
+    nt.assert_greater_equal(
+        rv['ops']['LockingQueue.consume'], rv['completed'])
+    nt.assert_greater(rv['ops_per_job'], 1)
@@ -1,6 +1,7 @@
 import os
 from subprocess import check_output, CalledProcessError
 from nose import tools as nt
+import simplejson
 from stolos import queue_backend as qb
 
 from stolos.testing_tools import (
@@ -53,3 +54,63 @@ def test_stolos_submit_multiple_jobs(app1, app2, job_id1, job_id2,
         tasks_json_tmpfile)
     validate_n_queued_task(app1, job_id1, job_id2)
     validate_n_queued_task(app2, job_id1, job_id2)
+
+
+@with_setup
+def test_stolos_export(app1, app2, job_id1, job_id2, tasks_json_tmpfile):
+    qb.set_state(app1, job_id1, completed=True)  # also queues app2 job_id1
+    qb.maybe_add_subtask(app1, job_id2, priority=50)
+    qb.inc_retry_count(app1, job_id2, max_retry=5)
+    lock = qb.obtain_execute_lock(app1, job_id2)
+    try:
+        rv = run("stolos-export -a %s %s" % (app1, app2), tasks_json_tmpfile)
+    finally:
+        lock.release()
+    records = sorted(
+        (simplejson.loads(line) for line in rv.decode().splitlines()),
+        key=lambda x: (x['type'], x['app_name'], x['job_id']))
+    nt.assert_equal(records, [
+        dict(type='job', app_name=app1, job_id=job_id1, state='completed',
+             retry_count=0, num_complete_parents=0, priority=None,
+             blocked=False, execute_locked=False),
+        dict(type='job', app_name=app1, job_id=job_id2, state='pending',
+             retry_count=1, num_complete_parents=0, priority=50,
+             blocked=False, execute_locked=True),
+        dict(type='job', app_name=app2, job_id=job_id1, state='pending',
+             retry_count=0, num_complete_parents=1, priority=None,
+             blocked=False, execute_locked=False),
+        dict(type='queued', app_name=app1, job_id=job_id2, taken=False),
+        dict(type='queued', app_name=app2, job_id=job_id1, taken=False),
+    ])
+
+
+@with_setup
+def test_stolos_status(app1, app2, job_id1, job_id2, tasks_json_tmpfile):
+    qb.set_state(app1, job_id1, completed=True)  # also queues app2 job_id1
+    qb.maybe_add_subtask(app1, job_id2)
+    rv = run("stolos-status -a %s %s --json" % (app1, app2),
+             tasks_json_tmpfile)
+    nt.assert_equal(simplejson.loads(rv.decode()), {
+        app1: dict(pending=1, completed=1, failed=0, skipped=0, blocked=0,
+                   queue_size=1),
+        app2: dict(pending=1, completed=0, failed=0, skipped=0, blocked=0,
+                   queue_size=1),
+    })
+    rv = run("stolos-status -a %s" % app1, tasks_json_tmpfile).decode()
+    header, row = rv.splitlines()
+    nt.assert_equal(header.split(), [
+        'app_name', 'queue_size', 'pending', 'completed', 'failed',
+        'skipped', 'blocked'])
+    nt.assert_equal(row.split(), [app1, '1', '1', '1', '0', '0', '0'])
+
+
+@with_setup
+def test_stolos_compile_config(app1, job_id1, tasks_json_tmpfile):
+    compiled_fp = tasks_json_tmpfile + '.compiled'
+    run("stolos-compile-config", tasks_json_tmpfile)
+    try:
+        nt.assert_true(os.path.exists(compiled_fp))
+        run("stolos-submit -a %s -j %s" % (app1, job_id1), tasks_json_tmpfile)
+        validate_one_queued_task(app1, job_id1)
+    finally:
+        os.remove(compiled_fp)
@@ -1,8 +1,11 @@
 from nose import tools as nt
+import os
+import simplejson
 
 from stolos import testing_tools as tt
 from stolos import dag_tools
 from stolos import exceptions
+from stolos.configuration_backend import json_config
 
 # nt.assert_equal.im_class.maxDiff = None
 try:
@@ -379,6 +382,98 @@ def test_topological_sort(topological_sort1, app1, app2, depends_on1, bash2,
     )
 
 
+@tt.with_setup
+def test_get_dag():
+    dg = dag_tools.build_dag()
+    dag = dag_tools.get_dag()
+    nt.assert_count_equal(dag.app_names, dg.nodes())
+    for app_name in dg.nodes():
+        nt.assert_count_equal(
+            dag.children(app_name),
+            [(child, key) for child, keys in dg.succ[app_name].items()
+             for key in keys])
+        nt.assert_count_equal(
+            dag.parents(app_name),
+            [(parent, key) for parent, keys in dg.pred[app_name].items()
+             for key in keys])
+    order = dag.topological_order()
+    nt.assert_count_equal(order, dg.nodes())
+    for parent, child in dg.edges():
+        nt.assert_less(order.index(parent), order.index(child))
+
+    cyclic = dag_tools.graph.CompactDAG.from_edges(
+        ['a', 'b', 'c'], [('a', 'b', 'x'), ('b', 'c', 'x'), ('c', 'b', 'y')])
+    nt.assert_equal(cyclic.children('c'), [('b', 'y')])
+    with nt.assert_raises(exceptions.DAGMisconfigured):
+        cyclic.topological_order()
+
+
+@tt.with_setup
+def test_get_dag_cached(app1, tasks_json_tmpfile):
+    dag = dag_tools.get_dag()
+    nt.assert_is(dag_tools.get_dag(), dag)
+
+    # the graph is built again when the config changes
+    with open(tasks_json_tmpfile) as fin:
+        tasks = simplejson.load(fin)
+    tasks['new_app'] = dict(depends_on=dict(app_name=[app1]))
+    with open(tasks_json_tmpfile, 'w') as fout:
+        simplejson.dump(tasks, fout)
+    dag2 = dag_tools.get_dag()
+    nt.assert_is_not(dag2, dag)
+    nt.assert_in('new_app', dag2.app_names)
+    nt.assert_in(('new_app', 'default'), dag2.children(app1))
+
+
+def _nx_topological_order(dg):
+    """The topological order of a networkx graph, where apps that may go in
+    either order are sorted by name"""
+    order = []
+    remaining = set(dg.nodes())
+    while remaining:
+        app_name = min(x for x in remaining
+                       if not remaining.intersection(dg.predecessors(x)))
+        order.append(app_name)
+        remaining.remove(app_name)
+    return order
+
+
+@tt.with_setup
+def test_compile_dag(app1, autofill1, topological_sort1, depends_on_job_id1,
+                     job_id1, tasks_json_tmpfile):
+    def get_results():
+        return dict(
+            edges=sorted(dag_tools.build_dag().edges(keys=True)),
+            templates=[
+                dag_tools.get_job_id_template(x) for x in [app1, autofill1]],
+            autofill_values={
+                k: list(v) for k, v in
+                dag_tools.get_autofill_values(autofill1).items()},
+            order=list(dag_tools.get_dag().topological_order()),
+            parents=list(dag_tools.topological_sort(dag_tools.get_parents(
+                topological_sort1, depends_on_job_id1, True))),
+            children=sorted(dag_tools.get_children(app1, job_id1, True)))
+
+    expected = get_results()
+    # traversal agrees with the networkx graph
+    nt.assert_equal(
+        expected['order'], _nx_topological_order(dag_tools.build_dag()))
+    nt.assert_is_none(dag_tools.node.get_compiled())
+    compiled = dag_tools.compile_dag()
+    nt.assert_equal(compiled['topological_order'], expected['order'])
+    compiled_fp = json_config.write_compiled(compiled, tasks_json_tmpfile)
+    try:
+        nt.assert_is_not_none(dag_tools.node.get_compiled())
+        nt.assert_dict_equal(get_results(), expected)
+
+        # ignore the compiled config once the tasks_json file changes
+        with open(tasks_json_tmpfile, 'a') as fout:
+            fout.write(' ')
+        nt.assert_is_none(dag_tools.node.get_compiled())
+    finally:
+        os.remove(compiled_fp)
+
+
 @tt.with_setup
 def test_depends_on_all(func_name, all_test1, all_test2, all_test3, all_test4,
                         all_test4b, all_test5):
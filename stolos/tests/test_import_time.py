@@ -0,0 +1,38 @@
+"""
+Process startup is a large share of the cost of short jobs, so the runner
+should only import what the chosen backends and plugin need
+"""
+from nose import tools as nt
+import subprocess
+import sys
+
+
+# modules that importing the runner must not import
+LAZY_MODULES = ['networkx', 'kazoo', 'pyspark', 'colorlog']
+if sys.version_info >= (3, 7):
+    # stolos.__version__ is looked up lazily
+    LAZY_MODULES.append('pkg_resources')
+
+# num seconds.  Generous, because test machines are noisy.
+IMPORT_TIME_BUDGET = 1.0
+
+
+def _import(module_name):
+    """Import the module in a new python process.  Return the num seconds
+    that took and the names of all imported modules"""
+    code = (
+        "import sys, time; t = time.time(); import %s;"
+        " print(time.time() - t); print(' '.join(sys.modules))"
+    ) % module_name
+    out = subprocess.check_output([sys.executable, '-c', code])
+    elapsed, modules = out.decode().splitlines()
+    return float(elapsed), set(modules.split())
+
+
+def test_runner_import_time():
+    elapsed, modules = _import('stolos.runner')
+    nt.assert_equal(
+        [x for x in LAZY_MODULES
+         if x in modules or any(y.startswith(x + '.') for y in modules)],
+        [])
+    nt.assert_less(elapsed, IMPORT_TIME_BUDGET)
@@ -0,0 +1,83 @@
+from nose import tools as nt
+import socket
+from six.moves.urllib.request import urlopen
+
+from stolos import get_NS
+from stolos import metrics
+from stolos import queue_backend as qb
+from stolos import testing_tools as tt
+
+
+def test_registry():
+    r = metrics.Registry(buckets=(.1, 1, float('inf')))
+    r.inc('jobs', app='a')
+    r.inc('jobs', 2, app='a')
+    r.observe('took_seconds', .05, app='a')
+    r.observe('took_seconds', 5, app='a')
+    with r.timer('took_seconds', app='b'):
+        pass
+    nt.assert_equal(r.counters(), {('jobs', (('app', 'a'), )): 3})
+    h = r.histograms()[('took_seconds', (('app', 'a'), ))]
+    nt.assert_equal((h.counts, h.sum, h.count), ([1, 0, 1], 5.05, 2))
+
+    text = r.to_prometheus()
+    nt.assert_in('# TYPE stolos_jobs counter\nstolos_jobs{app="a"} 3\n', text)
+    nt.assert_in('stolos_took_seconds_bucket{app="a",le="1"} 1\n', text)
+    nt.assert_in('stolos_took_seconds_bucket{app="a",le="+Inf"} 2\n', text)
+    nt.assert_in('stolos_took_seconds_count{app="b"} 1\n', text)
+    r.reset()
+    nt.assert_equal(r.to_prometheus(), '\n')
+
+
+@tt.with_setup
+def test_instrument(app1, job_id1):
+    registry = metrics.Registry()
+    qbcli = get_NS().queue_backend
+    get_NS().queue_backend = metrics.instrument(qbcli, registry)
+    try:
+        nt.assert_equal(qb.get_qbclient().__name__, qbcli.__name__)
+        qb.maybe_add_subtask(app1, job_id1)
+        qb.get_qbclient().LockingQueue(app1).is_queued(job_id1)
+        list(qb.get_qbclient().iter_children(app1))
+    finally:
+        get_NS().queue_backend = qbcli
+    ops = dict(
+        (dict(labels)['op'], h.count)
+        for (name, labels), h in registry.histograms().items()
+        if dict(labels)['app'] == app1)
+    nt.assert_equal(ops['LockingQueue.is_queued'], 1)
+    nt.assert_equal(ops['LockingQueue.put'], 1)
+    nt.assert_equal(ops['Lock.acquire'], 1)
+    nt.assert_equal(ops['iter_children'], 1)
+    wrapped = metrics.instrument(qbcli)
+    nt.assert_is(metrics.instrument(wrapped), wrapped)
+
+
+def test_exporters():
+    registry = metrics.Registry()
+    registry.inc('jobs', app='a/b')
+    registry.observe('took_seconds', .5, app='a/b')
+    registry.observe('took_seconds', 1.5, app='a/b')
+
+    server = metrics.start_http_server(0, registry=registry)
+    try:
+        body = urlopen(
+            'http://127.0.0.1:%s/metrics' % server.server_port).read()
+    finally:
+        server.shutdown()
+    nt.assert_equal(body.decode('utf8'), registry.to_prometheus())
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(5)
+    emitter = metrics.StatsdEmitter(
+        '127.0.0.1:%s' % sock.getsockname()[1], registry)
+    emitter.flush()
+    nt.assert_equal(
+        sock.recv(2048).decode('utf8').split('\n'),
+        ['stolos.jobs.a_b:1|c', 'stolos.took.a_b:1000.0000|ms|@0.5'])
+    # only changes are sent
+    registry.inc('jobs', app='a/b')
+    emitter.flush()
+    nt.assert_equal(sock.recv(2048).decode('utf8'), 'stolos.jobs.a_b:1|c')
+    sock.close()
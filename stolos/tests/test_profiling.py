@@ -0,0 +1,59 @@
+import argparse
+import os
+import pstats
+import shutil
+import tempfile
+from nose import tools as nt
+
+from stolos import api
+from stolos import profiling
+from stolos import testing_tools as tt
+
+
+def _ns(**kwargs):
+    ns = argparse.Namespace(
+        profile=tempfile.mkdtemp(prefix='stolos_profile'), profile_sample=1,
+        profile_api='', profile_aggregate=False)
+    ns.__dict__.update(kwargs)
+    return ns
+
+
+def test_profile():
+    ns = _ns()
+    try:
+        with profiling.profile(ns, lambda: ('app/1', 'job1')):
+            sorted(range(100))
+            # nested blocks are part of the outer profile
+            with profiling.profile(ns, lambda: ('app/1', 'job2')):
+                pass
+        fps = os.listdir(ns.profile)
+        nt.assert_equal(len(fps), 1)
+        nt.assert_true(fps[0].startswith('app_1.job1.%s.' % os.getpid()))
+        stats = profiling.print_stats(
+            [os.path.join(ns.profile, fps[0])], stream=open(os.devnull, 'w'))
+        nt.assert_is_instance(stats, pstats.Stats)
+
+        with profiling.profile(_ns(profile=None), lambda: ('app', 'job')):
+            pass
+        nt.assert_equal(len(os.listdir(ns.profile)), 1)
+    finally:
+        shutil.rmtree(ns.profile)
+
+
+@tt.with_setup
+def test_wrap_api(app1, job_id1):
+    ns = _ns(profile_api='maybe_add_subtask, check_state')
+    func = api.maybe_add_subtask
+    try:
+        profiling.wrap_api(ns)
+        profiling.wrap_api(ns)  # wraps the original functions, not wrappers
+        nt.assert_is(api.maybe_add_subtask.unprofiled, func)
+        api.maybe_add_subtask(app1, job_id1)
+        nt.assert_true(api.check_state(app1, job_id1, pending=True))
+        nt.assert_equal(
+            sorted(x.split('.')[1] for x in os.listdir(ns.profile)),
+            ['check_state', 'maybe_add_subtask'])
+    finally:
+        api.maybe_add_subtask = func
+        api.check_state = api.check_state.unprofiled
+        shutil.rmtree(ns.profile)
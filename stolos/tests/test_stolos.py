@@ -1,5 +1,8 @@
 import nose
+import os
+import shutil
 import subprocess
+import tempfile
 
 from stolos import api
 from stolos import exceptions
@@ -76,6 +79,17 @@ def test_maybe_add_subtask_priority_second(app1, job_id1, job_id2):
     nose.tools.assert_equal(consume_queue(app1), job_id1)
 
 
+@with_setup
+def test_child_inherits_parent_priority(app1, app2, job_id1, job_id2):
+    api.maybe_add_subtask(app2, job_id2, priority=150)
+    api.maybe_add_subtask(app1, job_id1, priority=200)
+    consume_queue(app1)
+    qb.set_state(app1, job_id1, completed=True)
+    # the child is less urgent than the default priority, like its parent
+    nose.tools.assert_equal(consume_queue(app2), job_id2)
+    nose.tools.assert_equal(consume_queue(app2), job_id1)
+
+
 @with_setup
 def test_bypass_scheduler(bash1, job_id1, log, tasks_json_tmpfile):
     validate_zero_queued_task(bash1)
@@ -504,6 +518,21 @@ def test_retry_failed_task(
     validate_one_failed_task(app1, job_id2)
 
 
+@with_setup
+def test_retry_failed_task_with_delay(
+        app1, job_id1, log, tasks_json_tmpfile):
+    """Failed tasks may be hidden from the queue until they are due"""
+    enqueue(app1, job_id1)
+    run_code(
+        log, tasks_json_tmpfile, app1,
+        extra_opts='--retry_delay 60 --bash_cmd "&& notacommand...fail"')
+    # the failed task is still queued, but not visible to consumers
+    nose.tools.assert_true(get_qb_status(app1, job_id1)['in_queue'])
+    nose.tools.assert_is_none(
+        qb.get_qbclient().LockingQueue(app1).get(timeout=1))
+    validate_one_queued_task(app1, job_id1)
+
+
 @with_setup
 def test_valid_if_or_1(app2, job_id1):
     """Invalid tasks should be automatically completed.
@@ -600,6 +629,48 @@ def test_app_has_command_line_params(
         'newfakereadfp', logoutput, msg % logoutput)
 
 
+@with_setup
+def test_queued_job_not_pending(app1, job_id1, log, tasks_json_tmpfile):
+    """A job that is still queued but no longer pending is reset to pending,
+    rather than sent around its queue forever"""
+    enqueue(app1, job_id1)
+    qb.set_state(app1, job_id1, completed=True,
+                 _disable_maybe_queue_children_for_testing_only=True)
+    run_code(log, tasks_json_tmpfile, app1)
+    validate_one_queued_task(app1, job_id1)
+    run_code(log, tasks_json_tmpfile, app1)
+    validate_one_completed_task(app1, job_id1)
+
+
+@with_setup
+def test_job_timings(app1, job_id1, log, tasks_json_tmpfile):
+    enqueue(app1, job_id1)
+    _, logoutput = run_code(log, tasks_json_tmpfile, app1, capture=True)
+    validate_one_completed_task(app1, job_id1)
+    line = [x for x in logoutput.splitlines() if 'Job timings' in x]
+    nose.tools.assert_equal(len(line), 1, logoutput)
+    for key in ['outcome=completed', 'dequeue_seconds=', 'get_lock_seconds=',
+                'parents_completed_seconds=', 'execute_seconds=',
+                'set_completed_seconds=', 'consume_release_seconds=',
+                'scheduling_seconds=']:
+        nose.tools.assert_in(key, line[0])
+
+
+@with_setup
+def test_runner_writes_pstats(app1, job_id1, log, tasks_json_tmpfile):
+    enqueue(app1, job_id1)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        run_code(log, tasks_json_tmpfile, app1, '--profile %s' % tmpdir)
+        validate_one_completed_task(app1, job_id1)
+        fps = os.listdir(tmpdir)
+        nose.tools.assert_equal(len(fps), 1)
+        nose.tools.assert_true(fps[0].startswith(
+            '%s.%s.' % (app1.replace('/', '_'), job_id1)), fps[0])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
 @with_setup
 def test_run_given_specific_job_id(app1, job_id1, log, tasks_json_tmpfile):
     enqueue(app1, job_id1)
@@ -649,6 +720,30 @@ def test_child_running_while_parent_pending_and_executing(
     lock.release()
 
 
+@with_setup
+def test_child_parks_while_parent_executing(
+        app1, app2, job_id1, log, tasks_json_tmpfile):
+    # A child whose parent is running should leave its queue rather than
+    # cycle through it.  The parent wakes the child up when it completes.
+    enqueue(app1, job_id1)
+    enqueue(app2, job_id1)
+    lock = qb.obtain_execute_lock(app1, job_id1)
+    assert lock
+    blocked_path = qb.get_job_path(app2, job_id1, 'blocked')
+
+    run_code(log, tasks_json_tmpfile, app2)
+    validate_zero_queued_task(app2)
+    validate_one_queued_executing_task(app1, job_id1)
+    nose.tools.assert_true(api.get_qbclient().exists(blocked_path))
+
+    consume_queue(app1)
+    qb.set_state(app1, job_id1, completed=True)
+    lock.release()
+    validate_one_completed_task(app1, job_id1)
+    validate_one_queued_task(app2, job_id1)
+    nose.tools.assert_false(api.get_qbclient().exists(blocked_path))
+
+
 @with_setup
 def test_race_condition_when_parent_queues_child(
         app1, app2, job_id1, log, tasks_json_tmpfile):
@@ -3,7 +3,6 @@ Fairly generic utility functions that have no knowledge of Stolos and
 could just as well be in a third party library
 """
 import argparse
-import colorlog
 import collections
 import functools
 import inspect
@@ -69,7 +68,59 @@ except ImportError:  # python 2
     cached.CACHES = {}
 
 
-def configure_logging(add_handler, log=log, colorize=True):
+# LogRecord attributes that aren't extras
+_LOG_RECORD_KEYS = frozenset(logging.makeLogRecord({}).__dict__).union(
+    ['message', 'asctime'])
+
+
+def _format_extras(record, _ignore=_LOG_RECORD_KEYS):
+    return ' '.join(
+        "%s=%s" % (k, v) for k, v in record.__dict__.items()
+        if k not in _ignore)
+
+
+class LazyExtra(object):
+    """A value in a log record's extras that is only computed if the record
+    is formatted (ie the log level is enabled)
+
+        log.debug('msg', extra=dict(state=LazyExtra(func, arg1, ...)))
+    """
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+    __repr__ = __str__
+
+
+def _stop_listener(listener):
+    """QueueListener.stop() fails if called twice (before python 3.12)"""
+    if listener._thread is not None:
+        listener.stop()
+
+
+def _async_handler(handler):
+    """Return a handler that puts records in a queue, and start a
+    thread that passes them to the given handler.  Requires python3"""
+    from logging.handlers import QueueHandler, QueueListener
+    from six.moves import queue
+    import atexit
+
+    q = queue.Queue(-1)
+    listener = QueueListener(q, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    _h = QueueHandler(q)
+    _h.listener = listener
+    return _h
+
+
+def configure_logging(add_handler, log=log, colorize=True,
+                      async_handler=False):
     """
     Configure log records.  If adding a handler, make the formatter print all
     passed in key:value data.
@@ -82,30 +133,34 @@ def configure_logging(add_handler, log=log, colorize=True):
         if given a handler instance, add that the the logger
     `colorize` - (True|False) only relevant if add_handler=True.
         Option to use colorized logging output or not
+    `async_handler` - (True|False) if adding a handler, format and write
+        records from a background thread, so logging doesn't block the
+        code that logs.  Requires python3
     """
-    _ignore_log_keys = set(logging.makeLogRecord({}).__dict__)
-
-    def _json_format(record):
-        extras = ' '.join(
-            "%s=%s" % (k, record.__dict__[k])
-            for k in set(record.__dict__).difference(_ignore_log_keys))
-        if extras:
-            record.msg = "%s    %s" % (record.msg, extras)
-        return record
-
     if colorize:
+        import colorlog
         parent = colorlog.ColoredFormatter
     else:
         parent = logging.Formatter
 
     class JsonFormatter(parent):
         def format(self, record):
-            record = _json_format(record)
-            return super(JsonFormatter, self).format(record)
+            extras = _format_extras(record)
+            if not extras:
+                return super(JsonFormatter, self).format(record)
+            msg = record.msg
+            record.msg = "%s    %s" % (msg, extras)
+            try:
+                return super(JsonFormatter, self).format(record)
+            finally:
+                record.msg = msg
+
+    _h = None
     if isinstance(add_handler, logging.Handler):
-        log.addHandler(add_handler)
+        _h = add_handler
     elif add_handler is True:
-        if not any(isinstance(h, logging.StreamHandler) for h in log.handlers):
+        if not any(isinstance(h, logging.StreamHandler) or
+                   hasattr(h, 'listener') for h in log.handlers):
             _h = logging.StreamHandler()
             if colorize:
                 _h.setFormatter(JsonFormatter((
@@ -113,10 +168,17 @@ def configure_logging(add_handler, log=log, colorize=True):
                     " %(reset)s %(cyan)s"), reset=True))
             else:
                 _h.setFormatter(JsonFormatter("%(levelname)-8s %(message)s",))
-            log.addHandler(_h)
     elif not log.handlers:
         log.addHandler(logging.NullHandler())
     log.setLevel(logging.DEBUG)
+    if _h is not None:
+        try:
+            log.addHandler(_async_handler(_h) if async_handler else _h)
+        except ImportError:
+            log.addHandler(_h)
+            log.warn(
+                "Asynchronous log handlers require python3."
+                "  Logging synchronously")
     log.propagate = False
     return log
 